@@ -6,11 +6,18 @@ async function req(path, opts) {
   return res.json()
 }
 
-export const getEvents = (timeMin, timeMax) =>
-  req(`/events?timeMin=${encodeURIComponent(timeMin)}&timeMax=${encodeURIComponent(timeMax)}`)
+// one-trip dashboard payload: the day's events (timed / allDay), tasks due within
+// the horizon, category protocol and sync status
+export const getAgenda = (date) => req(`/agenda?date=${encodeURIComponent(date)}`)
+
+// Calendar grid for seven days from weekStart (YYYY-MM-DD): per day, timed blocks
+// with overlap columns (top/bottom in minutes from midnight) and all-day events
+export const getLayout = (weekStart) => req(`/layout?weekStart=${encodeURIComponent(weekStart)}`)
 
 const acctQ = (account) => (account ? `?account=${encodeURIComponent(account)}` : '')
 
+export const getEvent = (id, account) => req(`/events/${encodeURIComponent(id)}${acctQ(account)}`)
+
 export const createEvent = (body, account) =>
   req(`/events${acctQ(account)}`, {
     method: 'POST',
@@ -70,17 +77,40 @@ export const unlinkAccount = (email) => req(`/accounts/${encodeURIComponent(emai
 export const setPrimaryAccount = (email) =>
   req(`/accounts/${encodeURIComponent(email)}/primary`, { method: 'POST' })
 
+const RESUME_TRIES = 3
+
 // POST to an SSE endpoint and invoke onEvent for each parsed `data:` payload;
-// the backend keys agent conversations on sessionId
+// the backend keys agent conversations on sessionId. A dropped connection
+// re-attaches to the same turn from the last seen event id instead of failing.
 export async function streamChat(sessionId, message, onEvent) {
-  const res = await fetch(`${API}/chat/stream`, {
+  let res = await fetch(`${API}/chat/stream`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({ user_id: sessionId, message }),
   })
-  if (!res.ok || !res.body) throw new Error(`http ${res.status}`)
+  if (!res.ok || !res.body) throw Object.assign(new Error(`http ${res.status}`), { status: res.status })
+
+  const turnId = res.headers.get('X-Turn-Id')
+  let lastId = 0
+  let finished = false
+  for (let tries = 0; ; tries++) {
+    try {
+      await readSSE(res.body, (id, ev) => {
+        lastId = id ?? lastId
+        if (ev.type === 'done' || ev.type === 'error') finished = true
+        onEvent(ev)
+      })
+    } catch (e) {
+      if (!turnId || tries >= RESUME_TRIES) throw e
+    }
+    if (finished || !turnId || tries >= RESUME_TRIES) return
+    res = await fetch(`${API}/chat/stream/${turnId}`, { headers: { 'Last-Event-ID': String(lastId) } })
+    if (!res.ok || !res.body) throw Object.assign(new Error(`http ${res.status}`), { status: res.status })
+  }
+}
 
-  const reader = res.body.getReader()
+async function readSSE(body, onFrame) {
+  const reader = body.getReader()
   const decoder = new TextDecoder()
   let buf = ''
   for (;;) {
@@ -90,8 +120,10 @@ export async function streamChat(sessionId, message, onEvent) {
     const chunks = buf.split('\n\n')
     buf = chunks.pop()
     for (const chunk of chunks) {
-      const line = chunk.split('\n').find((l) => l.startsWith('data: '))
-      if (line) onEvent(JSON.parse(line.slice(6)))
+      const lines = chunk.split('\n')
+      const data = lines.find((l) => l.startsWith('data: '))
+      const id = lines.find((l) => l.startsWith('id: '))
+      if (data) onFrame(id ? Number(id.slice(4)) : null, JSON.parse(data.slice(6)))
     }
   }
 }
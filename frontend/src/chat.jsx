@@ -4,6 +4,8 @@ import { streamChat, closeChatSession } from './api.js'
 const OFFLINE_MSG =
   '// LINK OFFLINE - backend not reachable on 127.0.0.1:8787. Start it with: uvicorn src.server:app --port 8787'
 
+const BUSY_MSG = '// AGENT BUSY - too many chats running at once, try again in a few seconds'
+
 const ChatCtx = createContext(null)
 
 const makeSession = () => ({ id: crypto.randomUUID(), messages: [], thinking: false })
@@ -55,6 +57,7 @@ export function ChatProvider({ children }) {
             return [...parts, { t: 'text', text: ev.text }]
           }
           if (ev.type === 'tool') return [...parts, { t: 'tool', name: ev.name }]
+          if (ev.type === 'queued') return [...parts, { t: 'tool', name: `queued #${ev.position}` }]
           if (ev.type === 'break') {
             if (last?.t === 'text') return [...parts.slice(0, -1), { ...last, closed: true }]
             return parts
@@ -69,12 +72,13 @@ export function ChatProvider({ children }) {
           return parts
         })
       })
-    } catch {
+    } catch (e) {
+      const text = e.status === 429 ? BUSY_MSG : OFFLINE_MSG
       patchSession(sess.id, (s) => ({
         ...s,
         messages: [
           ...s.messages,
-          { id: replyId, from: 'agent', parts: [{ t: 'text', text: OFFLINE_MSG, err: true }] },
+          { id: replyId, from: 'agent', parts: [{ t: 'text', text, err: true }] },
         ],
       }))
     }
@@ -12,6 +12,8 @@ const kindTag = {
   IMPORT: 'tag cyan',
   SEARCH: 'tag dim',
   SYNC: 'tag dim',
+  FAILED: 'tag warn',
+  CONFLICT: 'tag warn',
 }
 
 export default function Activity() {
@@ -1,8 +1,8 @@
 import { useEffect, useState } from 'react'
 import { VentPanel, NodePanel, PageHead, HButton, JoinChip } from '../components/ui.jsx'
 import AgendaEdit from '../components/AgendaEdit.jsx'
-import { getEvents, patchEvent, deleteEvent } from '../api.js'
-import { toItem, toPatch, hm, TZ, tagClass, isAccent, loadProtocol } from '../gcal.js'
+import { getLayout, getEvent, patchEvent, deleteEvent } from '../api.js'
+import { toItem, toPatch, hm, TZ, tagClass, isAccent, loadProtocol, localDate } from '../gcal.js'
 
 const DAY_START = 8
 const DAY_END = 22
@@ -21,33 +21,15 @@ function weekStartOf(date) {
   return d
 }
 
-// google-calendar-style overlap handling: cluster overlapping events, assign
-// columns greedily within the cluster, split the lane width equally
-function layoutDay(events) {
-  const sorted = [...events].sort((a, b) => a.startH - b.startH || b.endH - a.endH)
-  const placed = []
-  let cluster = []
-  let colEnds = []
-  let clusterEnd = -1
-  const flush = () => {
-    if (!cluster.length) return
-    const n = colEnds.length
-    cluster.forEach((e) => (e.ncols = n))
-    placed.push(...cluster)
-    cluster = []
-    colEnds = []
-  }
-  for (const e of sorted) {
-    if (cluster.length && e.startH >= clusterEnd) flush()
-    let col = colEnds.findIndex((end) => e.startH >= end)
-    if (col === -1) col = colEnds.length
-    colEnds[col] = e.endH
-    cluster.push({ ...e, col })
-    clusterEnd = cluster.length === 1 ? e.endH : Math.max(clusterEnd, e.endH)
-  }
-  flush()
-  return placed
-}
+// server-laid-out block (minutes from midnight, overlap columns assigned by
+// /layout) -> grid item, clamped to the visible hours
+const toBlock = (b) => ({
+  ...toItem(b),
+  col: b.col,
+  ncols: b.cols,
+  startH: Math.max(DAY_START, Math.min(DAY_END - 0.5, b.top / 60)),
+  endH: Math.max(DAY_START + 0.5, Math.min(DAY_END, b.bottom / 60)),
+})
 
 function isoWeekNum(date) {
   const d = new Date(Date.UTC(date.getFullYear(), date.getMonth(), date.getDate()))
@@ -57,18 +39,13 @@ function isoWeekNum(date) {
   return Math.ceil(((d - yearStart) / 86400000 + 1) / 7)
 }
 
-const hourOf = (iso) => {
-  const d = new Date(iso)
-  return d.getHours() + d.getMinutes() / 60
-}
-
 function DayColumn({ label, events, allDayItems, isToday, nowHour, detailed, onSelect }) {
   return (
     <div className={`cal-day ${isToday ? 'today' : ''}`}>
       <div className="cal-daylabel">{label}</div>
       <div className="cal-lane">
-        {allDayItems.map((it) => (
-          <span key={it.id} className="cal-task" onClick={() => onSelect({ ...it, dayLabel: label })}>
+        {allDayItems.map((it, i) => (
+          <span key={`${it.id}/${i}`} className="cal-task" onClick={() => onSelect({ ...it, dayLabel: label })}>
             {it.name}
           </span>
         ))}
@@ -77,9 +54,9 @@ function DayColumn({ label, events, allDayItems, isToday, nowHour, detailed, onS
         {hours.map((h) => (
           <i key={h} className="cal-line" style={{ top: (h - DAY_START) * HOUR_PX }} />
         ))}
-        {layoutDay(events).map((e) => (
+        {events.map((e) => (
           <div
-            key={e.id}
+            key={`${e.id}/${e.col}`}
             className={`cal-event ${isAccent(e.cat) ? 'important' : ''} ${e.endH - e.startH <= 0.8 ? 'short' : ''}`}
             style={{
               top: (e.startH - DAY_START) * HOUR_PX + 1,
@@ -105,7 +82,7 @@ function DayColumn({ label, events, allDayItems, isToday, nowHour, detailed, onS
 
 export default function Calendar() {
   const [view, setView] = useState('week')
-  const [items, setItems] = useState([])
+  const [week, setWeek] = useState([])
   const [linkDown, setLinkDown] = useState(false)
   const [selected, setSelected] = useState(null)
   const [editing, setEditing] = useState(null)
@@ -147,12 +124,10 @@ export default function Calendar() {
   }${last.getDate()}`
 
   const refresh = async () => {
-    const end = new Date(start)
-    end.setDate(end.getDate() + 7)
     try {
       await loadProtocol()
-      const evs = await getEvents(start.toISOString(), end.toISOString())
-      setItems(evs.map(toItem))
+      const layout = await getLayout(localDate(start))
+      setWeek(layout.days.map((d) => ({ timed: d.blocks.map(toBlock), allDay: d.allDay.map(toItem) })))
       setLinkDown(false)
     } catch {
       setLinkDown(true)
@@ -163,20 +138,20 @@ export default function Calendar() {
     refresh()
   }, [+start])
 
-  // position timed events on the grid, clamped to visible hours
-  const dayIndexOf = (it) => Math.round((new Date(it.startISO).setHours(0, 0, 0, 0) - start) / 86400000)
-  const timed = items
-    .filter((it) => !it.allDay)
-    .map((it) => ({
-      ...it,
-      day: dayIndexOf(it),
-      startH: Math.max(DAY_START, Math.min(DAY_END - 0.5, hourOf(it.startISO))),
-      endH: Math.max(DAY_START + 0.5, Math.min(DAY_END, hourOf(it.endISO))),
-    }))
-  const allDay = items.filter((it) => it.allDay)
+  const timedCount = week.reduce((n, d) => n + d.timed.length, 0)
+  const allDayCount = week.reduce((n, d) => n + d.allDay.length, 0)
 
   const days = view === 'week' ? weekDays.map((_, i) => i) : [anchorIndex]
 
+  // the grid carries no descriptions; the editor gets the whole event first
+  const openEditor = async (item) => {
+    try {
+      setEditing({ ...toItem(await getEvent(item.id, item.account)), dayLabel: item.dayLabel })
+    } catch {
+      setLinkDown(true)
+    }
+  }
+
   const saveItem = async (updated) => {
     setEditing(null)
     try {
@@ -243,8 +218,8 @@ export default function Calendar() {
         title={view === 'week' ? 'Grid // 7 day' : `Grid // ${weekDays[anchorIndex]}`}
         right={
           <>
-            <span>{timed.length} events</span>
-            <span>{allDay.length} all-day</span>
+            <span>{timedCount} events</span>
+            <span>{allDayCount} all-day</span>
             <span>
               now <span className="c">{hm(new Date())}</span>
             </span>
@@ -266,8 +241,8 @@ export default function Calendar() {
               <DayColumn
                 key={di}
                 label={weekDays[di]}
-                events={timed.filter((e) => e.day === di)}
-                allDayItems={allDay.filter((it) => dayIndexOf(it) === di)}
+                events={week[di]?.timed ?? []}
+                allDayItems={week[di]?.allDay ?? []}
                 isToday={di === todayIndex}
                 nowHour={nowHour}
                 detailed={view === 'day'}
@@ -317,7 +292,7 @@ export default function Calendar() {
                 </div>
               )}
               <div className="cal-dbtns">
-                <HButton small onClick={() => setEditing(selected)}>
+                <HButton small onClick={() => openEditor(selected)}>
                   Edit
                 </HButton>
                 <HButton small onClick={() => deleteItem(selected.id)}>
@@ -2,17 +2,16 @@ import { useEffect, useRef, useState } from 'react'
 import { NodePanel, WirePanel, PageHead, Corners, HButton, JoinChip } from '../components/ui.jsx'
 import AgendaEdit from '../components/AgendaEdit.jsx'
 import {
-  getEvents,
+  getAgenda,
   createEvent,
   patchEvent,
   deleteEvent,
-  getTasks,
   createTask,
   patchTask,
   deleteTask,
   moveTask,
 } from '../api.js'
-import { toItem, toPatch, toTask, toTaskPatch, localDate, hm, tagClass, getCats, loadProtocol } from '../gcal.js'
+import { toItem, toPatch, toTask, toTaskPatch, localDate, hm, tagClass, getCats, setCats } from '../gcal.js'
 import { useFx, APP_T0 } from '../fx.jsx'
 
 const NEW_TASK_ID = '__new__'
@@ -277,33 +276,22 @@ export default function Dashboard() {
 
   const today = localDate(new Date())
 
-  const refreshTasks = async () => {
-    try {
-      setTasks((await getTasks()).map(toTask))
-    } catch {
-      setLinkDown(true)
-    }
-  }
-
+  // one round trip: the backend buckets today's events and applies the task horizon
   const refresh = async () => {
-    const start = new Date()
-    start.setHours(0, 0, 0, 0)
-    const end = new Date(start)
-    end.setDate(end.getDate() + 1)
     try {
-      const [evs] = await Promise.all([
-        getEvents(start.toISOString(), end.toISOString()),
-        refreshTasks(),
-        loadProtocol(),
-      ])
-      setItems(evs.map(toItem))
-      setSyncedAt(hm(new Date()))
+      const agenda = await getAgenda(localDate(new Date()))
+      setCats(agenda.categories)
+      setItems([...agenda.allDay, ...agenda.events].map(toItem))
+      setTasks(agenda.tasks.map(toTask))
+      setSyncedAt(hm(agenda.sync.events ? new Date(agenda.sync.events) : new Date()))
       setLinkDown(false)
     } catch {
       setLinkDown(true)
     }
   }
 
+  const refreshTasks = refresh
+
   useEffect(() => {
     refresh()
   }, [])
@@ -318,10 +306,8 @@ export default function Dashboard() {
   const events = items.filter((a) => a.type === 'event')
   const timedTasks = items.filter((a) => a.type === 'task')
 
-  // hide tasks due more than a week out; undated ones always show
-  const horizon = new Date()
-  horizon.setDate(horizon.getDate() + 7)
-  const weekTasks = tasks.filter((t) => !t.date || t.date <= localDate(horizon))
+  // the agenda already drops tasks due more than a week out; undated ones always show
+  const weekTasks = tasks
   const allTasks = [...timedTasks, ...weekTasks]
   const tasksDone = allTasks.filter((t) => t.done).length
   const untimedDone = weekTasks.filter((t) => t.done).length
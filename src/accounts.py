@@ -0,0 +1,204 @@
+'''Linked google accounts: the registry, OAuth credentials, API services, and
+api_call(), which every google request goes through.
+
+The discovery and OAuth libraries are slow to import, so they load on first use
+rather than with the server - the mirror can answer requests before any of it
+is needed.'''
+
+import os.path
+import threading
+
+from . import quota
+from .store import list_accounts, save_accounts
+
+SCOPES = [
+	'https://www.googleapis.com/auth/calendar',
+	'https://www.googleapis.com/auth/tasks',
+]
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_services: dict[str, object] = {}
+_service_lock = threading.Lock()
+API_VERSIONS = {'calendar': 'v3', 'tasks': 'v1'}
+
+def get_accounts():
+	'''Registry of linked google accounts; migrates the original token.json in place.'''
+	accounts = list_accounts()
+	if not accounts and os.path.exists(os.path.join(BASE_DIR, 'token.json')):
+		accounts = [{'email': '', 'token': 'token.json'}]
+		save_accounts(accounts)
+	return accounts
+
+def _run_consent_flow():
+	creds_path = os.path.join(BASE_DIR, 'credentials.json')
+	from google_auth_oauthlib.flow import InstalledAppFlow
+	flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
+	return flow.run_local_server(port=0, timeout_seconds=180)
+
+class NeedsConsent(RuntimeError):
+	'''The account's token can no longer be refreshed; only a consent flow fixes it.'''
+
+def account_creds(entry, interactive=True):
+	'''Valid credentials for one account; refreshes silently, re-consents interactively.
+	interactive=False raises instead of opening a browser - background sync must never pop consent.'''
+	from google.auth.exceptions import TransportError
+	from google.auth.transport.requests import Request
+	from google.oauth2.credentials import Credentials
+	token_path = os.path.join(BASE_DIR, entry['token'])
+	creds = None
+
+	if os.path.exists(token_path):
+		# no scopes arg: creds.scopes must reflect what the token was GRANTED,
+		# not what we are requesting, or the stale-scope check below always passes
+		creds = Credentials.from_authorized_user_file(token_path)
+		if not creds.scopes or not set(SCOPES).issubset(set(creds.scopes)):
+			creds = None
+
+	if not creds or not creds.valid:
+		if creds and creds.expired and creds.refresh_token:
+			try:
+				creds.refresh(Request())
+			except TransportError:
+				raise  # offline: the token may be fine, consent would not help
+			except Exception:
+				creds = None
+
+		if not creds or not creds.valid:
+			if not interactive:
+				raise NeedsConsent(f"{entry.get('email') or 'account'} needs re-consent")
+			creds = _run_consent_flow()
+
+		with open(token_path, 'w') as token:
+			token.write(creds.to_json())
+
+	return creds
+
+def account_entry(account=None):
+	'''The linked account with this email, else the primary.'''
+	accounts = get_accounts()
+	if not accounts:
+		raise RuntimeError('no linked google account - use Link account in settings')
+	return next((a for a in accounts if a.get('email') == account), primary_of(accounts))
+
+def get_service(api='calendar', account=None, interactive=True):
+	'''Service for one account (by email); defaults to the primary (first linked).'''
+	entry = account_entry(account)
+	key = (entry['token'], api)
+	with _service_lock:
+		if key not in _services:
+			_services[key] = _build(api, account_creds(entry, interactive))
+		return _services[key]
+
+def resolve_account(email=None):
+	'''The account a write lands on when none is specified: the primary.'''
+	if email:
+		return email
+	prim = primary_of(get_accounts())
+	return (prim or {}).get('email', '')
+
+def api_call(request, account=None, interactive=True):
+	'''Executes a built google request under the shared per-account quota guard.
+	interactive=False marks background sync, which yields to UI and agent calls.'''
+	return quota.execute(request, resolve_account(account), interactive)
+
+def _build(api, creds):
+	from googleapiclient.discovery import build
+	return build(api, API_VERSIONS[api], credentials=creds)
+
+def _email_for(creds):
+	cal = _build('calendar', creds).calendarList().get(calendarId='primary').execute()
+	return cal.get('id', '')
+
+def google_status():
+	'''Per-account link health WITHOUT ever launching the interactive OAuth flow.'''
+	from google.oauth2.credentials import Credentials
+	statuses = []
+	accounts = get_accounts()
+	prim = primary_of(accounts)
+	changed = False
+	for entry in accounts:
+		token_path = os.path.join(BASE_DIR, entry['token'])
+		status = {'email': entry.get('email', ''), 'connected': False, 'primary': entry is prim}
+		try:
+			if not os.path.exists(token_path):
+				status['reason'] = 'no token'
+			else:
+				creds = Credentials.from_authorized_user_file(token_path)
+				if not creds.scopes or not set(SCOPES).issubset(set(creds.scopes)):
+					status['reason'] = 'missing scopes'
+				else:
+					email = _email_for(creds)
+					if email and entry.get('email') != email:
+						entry['email'] = email
+						changed = True
+					status.update(
+						connected=True,
+						email=email,
+						scopes=[s.rsplit('/', 1)[-1] for s in creds.scopes],
+					)
+		except Exception as e:
+			status['reason'] = str(e)[:120]
+		statuses.append(status)
+	if changed:
+		save_accounts(accounts)
+	return statuses
+
+def link_account():
+	'''Runs a consent flow; whichever account the user picks gets linked (or re-linked).'''
+	creds = _run_consent_flow()
+	email = _email_for(creds)
+	accounts = get_accounts()
+	entry = next((a for a in accounts if a.get('email') == email), None)
+	if entry is None:
+		os.makedirs(os.path.join(BASE_DIR, 'data'), exist_ok=True)
+		entry = {'email': email, 'token': f'data/token-{len(accounts) + 1}.json'}
+		accounts.append(entry)
+	with open(os.path.join(BASE_DIR, entry['token']), 'w') as token:
+		token.write(creds.to_json())
+	save_accounts(accounts)
+	with _service_lock:
+		_services.clear()
+	return email
+
+def primary_of(accounts):
+	'''The primary account: flagged entry, else the first linked. Registry order never changes.'''
+	if not accounts:
+		return None
+	return next((a for a in accounts if a.get('primary')), accounts[0])
+
+def set_primary_account(email):
+	'''Flags an account as primary - the default for agent writes and tasks.'''
+	accounts = get_accounts()
+	if not any(a.get('email') == email for a in accounts):
+		return False
+	for a in accounts:
+		a['primary'] = a.get('email') == email
+	save_accounts(accounts)
+	return True
+
+def unlink_account(email):
+	'''Drops an account: revokes the grant (best effort), deletes the token, updates the registry.'''
+	accounts = get_accounts()
+	entry = next((a for a in accounts if a.get('email') == email), None)
+	if entry is None:
+		return False
+	token_path = os.path.join(BASE_DIR, entry['token'])
+	try:
+		import requests
+		from google.oauth2.credentials import Credentials
+		creds = Credentials.from_authorized_user_file(token_path)
+		requests.post(
+			'https://oauth2.googleapis.com/revoke',
+			params={'token': creds.refresh_token or creds.token},
+			timeout=10,
+		)
+	except Exception:
+		pass
+	try:
+		os.remove(token_path)
+	except FileNotFoundError:
+		pass
+	save_accounts([a for a in accounts if a.get('email') != email])
+	with _service_lock:
+		_services.clear()
+	return True
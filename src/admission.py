@@ -0,0 +1,75 @@
+'''Admission control for agent turns.
+
+Each turn drives its own SDK client and fans out google calls, so a burst of
+sessions can swamp the thread pool and the quota. At most MAX_CONCURRENT_TURNS
+turns run at once across all sessions; up to MAX_QUEUED_TURNS more wait in
+arrival order, and anything past that is turned away at once (Busy) rather than
+piling up. Limits come from the environment (.env), like the API key.'''
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_CONCURRENT_TURNS = int(os.getenv('AGENT_MAX_CONCURRENT_TURNS', '4'))
+MAX_QUEUED_TURNS = int(os.getenv('AGENT_MAX_QUEUED_TURNS', '16'))
+TURN_TIMEOUT_SECONDS = float(os.getenv('AGENT_TURN_TIMEOUT_SECONDS', '180'))
+
+class Busy(Exception):
+	'''The wait queue is full; retry later.'''
+
+_slots = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
+_running = 0
+_waiting = 0
+_stats = {'admitted': 0, 'rejected': 0, 'timedOut': 0, 'waitSeconds': 0.0, 'maxWaitSeconds': 0.0}
+
+def is_full():
+	return _slots.locked() and _waiting >= MAX_QUEUED_TURNS
+
+def position():
+	'''Queue position a turn arriving now would take (0 = runs at once).'''
+	return _waiting + 1 if _slots.locked() else 0
+
+@asynccontextmanager
+async def admit():
+	'''Holds one turn slot for the body; raises Busy when the queue is full.'''
+	global _running, _waiting
+	if is_full():
+		_stats['rejected'] += 1
+		raise Busy(f'{_running} agent turns running and {_waiting} queued')
+	started = time.monotonic()
+	_waiting += 1
+	try:
+		await _slots.acquire()
+	finally:
+		_waiting -= 1
+	waited = time.monotonic() - started
+	_stats['admitted'] += 1
+	_stats['waitSeconds'] += waited
+	_stats['maxWaitSeconds'] = max(_stats['maxWaitSeconds'], waited)
+	_running += 1
+	try:
+		yield
+	finally:
+		_running -= 1
+		_slots.release()
+
+def timed_out():
+	_stats['timedOut'] += 1
+
+def stats():
+	return {
+		'limit': MAX_CONCURRENT_TURNS,
+		'running': _running,
+		'queued': _waiting,
+		'queueLimit': MAX_QUEUED_TURNS,
+		'admitted': _stats['admitted'],
+		'rejected': _stats['rejected'],
+		'timedOut': _stats['timedOut'],
+		'avgWaitSeconds': round(_stats['waitSeconds'] / (_stats['admitted'] or 1), 3),
+		'maxWaitSeconds': round(_stats['maxWaitSeconds'], 3),
+	}
@@ -1,8 +1,10 @@
+import argparse
 import asyncio
+import contextlib
 import json
-import os.path
-import threading
-from datetime import datetime
+import sys
+import time
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 from dotenv import load_dotenv
@@ -14,201 +16,28 @@ from claude_agent_sdk import (
 	ResultMessage,
 	StreamEvent,
 	TextBlock,
+	ToolResultBlock,
+	ToolUseBlock,
+	UserMessage,
 	create_sdk_mcp_server,
 	tool,
 )
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-from .store import (
-	cache_remove_event,
-	cache_upsert_event,
-	get_settings,
-	log_activity,
-	list_accounts,
-	save_accounts,
-)
+from . import admission, analytics, gapi, lanes, mirror, trace
+from .accounts import get_accounts, primary_of, resolve_account
+from .store import get_settings, log_activity
 
 load_dotenv()
-SCOPES = [
-	'https://www.googleapis.com/auth/calendar',
-	'https://www.googleapis.com/auth/tasks',
-]
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-_services: dict[str, object] = {}
-_service_lock = threading.Lock()
-API_VERSIONS = {'calendar': 'v3', 'tasks': 'v1'}
-
-def get_accounts():
-	'''Registry of linked google accounts; migrates the original token.json in place.'''
-	accounts = list_accounts()
-	if not accounts and os.path.exists(os.path.join(BASE_DIR, 'token.json')):
-		accounts = [{'email': '', 'token': 'token.json'}]
-		save_accounts(accounts)
-	return accounts
-
-def _run_consent_flow():
-	creds_path = os.path.join(BASE_DIR, 'credentials.json')
-	flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
-	return flow.run_local_server(port=0, timeout_seconds=180)
-
-def account_creds(entry, interactive=True):
-	'''Valid credentials for one account; refreshes silently, re-consents interactively.
-	interactive=False raises instead of opening a browser - background sync must never pop consent.'''
-	token_path = os.path.join(BASE_DIR, entry['token'])
-	creds = None
-
-	if os.path.exists(token_path):
-		# no scopes arg: creds.scopes must reflect what the token was GRANTED,
-		# not what we are requesting, or the stale-scope check below always passes
-		creds = Credentials.from_authorized_user_file(token_path)
-		if not creds.scopes or not set(SCOPES).issubset(set(creds.scopes)):
-			creds = None
-
-	if not creds or not creds.valid:
-		if creds and creds.expired and creds.refresh_token:
-			try:
-				creds.refresh(Request())
-			except Exception:
-				creds = None
-
-		if not creds or not creds.valid:
-			if not interactive:
-				raise RuntimeError(f"{entry.get('email') or 'account'} needs re-consent")
-			creds = _run_consent_flow()
-
-		with open(token_path, 'w') as token:
-			token.write(creds.to_json())
-
-	return creds
-
-def get_service(api='calendar', account=None, interactive=True):
-	'''Service for one account (by email); defaults to the primary (first linked).'''
-	accounts = get_accounts()
-	if not accounts:
-		raise RuntimeError('no linked google account - use Link account in settings')
-	entry = next((a for a in accounts if a.get('email') == account), primary_of(accounts))
-	key = (entry['token'], api)
-	with _service_lock:
-		if key not in _services:
-			_services[key] = build(api, API_VERSIONS[api], credentials=account_creds(entry, interactive))
-		return _services[key]
-
-def resolve_account(email=None):
-	'''The account a write lands on when none is specified: the primary.'''
-	if email:
-		return email
-	prim = primary_of(get_accounts())
-	return (prim or {}).get('email', '')
-
-def _email_for(creds):
-	cal = build('calendar', 'v3', credentials=creds).calendarList().get(calendarId='primary').execute()
-	return cal.get('id', '')
-
-def google_status():
-	'''Per-account link health WITHOUT ever launching the interactive OAuth flow.'''
-	statuses = []
-	accounts = get_accounts()
-	prim = primary_of(accounts)
-	changed = False
-	for entry in accounts:
-		token_path = os.path.join(BASE_DIR, entry['token'])
-		status = {'email': entry.get('email', ''), 'connected': False, 'primary': entry is prim}
-		try:
-			if not os.path.exists(token_path):
-				status['reason'] = 'no token'
-			else:
-				creds = Credentials.from_authorized_user_file(token_path)
-				if not creds.scopes or not set(SCOPES).issubset(set(creds.scopes)):
-					status['reason'] = 'missing scopes'
-				else:
-					email = _email_for(creds)
-					if email and entry.get('email') != email:
-						entry['email'] = email
-						changed = True
-					status.update(
-						connected=True,
-						email=email,
-						scopes=[s.rsplit('/', 1)[-1] for s in creds.scopes],
-					)
-		except Exception as e:
-			status['reason'] = str(e)[:120]
-		statuses.append(status)
-	if changed:
-		save_accounts(accounts)
-	return statuses
-
-def link_account():
-	'''Runs a consent flow; whichever account the user picks gets linked (or re-linked).'''
-	creds = _run_consent_flow()
-	email = _email_for(creds)
-	accounts = get_accounts()
-	entry = next((a for a in accounts if a.get('email') == email), None)
-	if entry is None:
-		os.makedirs(os.path.join(BASE_DIR, 'data'), exist_ok=True)
-		entry = {'email': email, 'token': f'data/token-{len(accounts) + 1}.json'}
-		accounts.append(entry)
-	with open(os.path.join(BASE_DIR, entry['token']), 'w') as token:
-		token.write(creds.to_json())
-	save_accounts(accounts)
-	with _service_lock:
-		_services.clear()
-	return email
-
-def primary_of(accounts):
-	'''The primary account: flagged entry, else the first linked. Registry order never changes.'''
-	if not accounts:
-		return None
-	return next((a for a in accounts if a.get('primary')), accounts[0])
-
-def set_primary_account(email):
-	'''Flags an account as primary - the default for agent writes and tasks.'''
-	accounts = get_accounts()
-	if not any(a.get('email') == email for a in accounts):
-		return False
-	for a in accounts:
-		a['primary'] = a.get('email') == email
-	save_accounts(accounts)
-	return True
-
-def unlink_account(email):
-	'''Drops an account: revokes the grant (best effort), deletes the token, updates the registry.'''
-	accounts = get_accounts()
-	entry = next((a for a in accounts if a.get('email') == email), None)
-	if entry is None:
-		return False
-	token_path = os.path.join(BASE_DIR, entry['token'])
-	try:
-		import requests
-		creds = Credentials.from_authorized_user_file(token_path)
-		requests.post(
-			'https://oauth2.googleapis.com/revoke',
-			params={'token': creds.refresh_token or creds.token},
-			timeout=10,
-		)
-	except Exception:
-		pass
-	try:
-		os.remove(token_path)
-	except FileNotFoundError:
-		pass
-	save_accounts([a for a in accounts if a.get('email') != email])
-	with _service_lock:
-		_services.clear()
-	return True
 
 async def gcal(op, log=None, cache=None):
-	'''Runs blocking Google API work off the event loop so a slow call
-	(or a pending OAuth consent) never freezes the server.
+	'''Awaits op(), a coroutine of gapi calls, turning API errors into tool results.
 	log: optional result -> (kind, text) for the activity feed, on success only.
-	cache: optional result -> None that patches the local mirror after a write.'''
+	cache: optional result -> None that writes a result through to the mirror
+	and queues its targeted reconcile (see sync.event_written).'''
 	try:
-		result = await asyncio.to_thread(op)
+		result = await op()
 		if log:
 			try:
 				kind, text = log(result)
@@ -218,14 +47,21 @@ async def gcal(op, log=None, cache=None):
 		if cache:
 			try:
 				cache(result)
-				from . import sync  # lazy: sync imports this module
-				sync.schedule_refresh()
 			except Exception:
 				pass
 		return tool_result(result)
 	except HttpError as error:
 		return tool_result(f'An error occurred: {error}')
 
+def _sync():
+	from . import sync  # lazy: sync imports this module
+	return sync
+
+def _calendar_of(event_id, account):
+	'''Calendar id of a mirrored event ('primary' when unknown), so edits and
+	deletes of shared-calendar events go to their own calendar.'''
+	return (mirror.full_event(event_id, resolve_account(account)) or {}).get('calendar') or mirror.PRIMARY
+
 def tool_result(data):
 	text = data if isinstance(data, str) else json.dumps(data)
 	return {'content': [{'type': 'text', 'text': text}]}
@@ -245,24 +81,39 @@ async def get_time(args):
 	tz = ZoneInfo(args.get('zone', get_settings()['timezone']))
 	return tool_result(datetime.now(tz).isoformat())
 
+RANGE_SCHEMA = {
+	'type': 'object',
+	'properties': {
+		'timeMin': {'type': 'string', 'description': 'range start, RFC3339 format'},
+		'timeMax': {'type': 'string', 'description': 'range end, RFC3339 format'},
+	},
+	'required': ['timeMin', 'timeMax'],
+}
+
 @tool(
 	'cal_view_events',
 	'''Returns events across all linked calendars between timeMin and timeMax (RFC3339 format).
-	ALWAYS pass timeMax to bound the window to what the user asked about (e.g. end of the requested day).''',
+	ALWAYS pass timeMax to bound the window to what the user asked about (e.g. end of the requested day).
+	For several windows at once (e.g. Monday, Wednesday and Friday mornings) pass them all in ranges
+	instead of calling this tool repeatedly; results then come back grouped per range.
+	query keeps only events whose title, location or description contain it; account keeps one account's events.''',
 	{
 		'type': 'object',
 		'properties': {
 			'timeMin': {'type': 'string', 'description': 'start of the search window, RFC3339 format'},
 			'timeMax': {'type': 'string', 'description': 'end of the search window, RFC3339 format - always set this'},
-			'maxResults': {'type': 'integer', 'description': 'max events per account, default 25'},
+			'ranges': {'type': 'array', 'items': RANGE_SCHEMA, 'description': 'several windows, used instead of timeMin/timeMax'},
+			'query': {'type': 'string', 'description': 'case-insensitive text filter'},
+			'account': {'type': 'string', 'description': 'only events of this linked account (email)'},
+			'maxResults': {'type': 'integer', 'description': 'max events per range, default 25'},
 		},
-		'required': ['timeMin'],
+		'required': [],
 	},
 )
 async def cal_view_events(args):
 	def slim(ev, email):
 		desc = ev.get('description', '')
-		return {
+		out = {
 			'id': ev.get('id'),
 			'summary': ev.get('summary'),
 			'start': ev.get('start'),
@@ -272,33 +123,67 @@ async def cal_view_events(args):
 			'colorId': ev.get('colorId'),
 			'account': email,
 		}
-
-	if args.get('timeMax'):
+		if ev.get('calendar') not in (None, mirror.PRIMARY):
+			out['calendar'] = ev['calendar']
+		return out
+
+	needle = (args.get('query') or '').casefold()
+	account = args.get('account')
+	cap = args.get('maxResults', 25)
+
+	def keep(ev, email):
+		if account and email != account:
+			return False
+		text = ' '.join(ev.get(k) or '' for k in ('summary', 'location', 'description'))
+		return not needle or needle in text.casefold()
+
+	ranges = args.get('ranges') or ([args] if args.get('timeMin') and args.get('timeMax') else None)
+	if ranges:
 		from . import sync  # lazy: sync imports this module
-		cached = sync.cached_events(args['timeMin'], args['timeMax'])
-		if cached is not None:
-			cap = args.get('maxResults', 25) * max(1, len(get_accounts()))
-			items = [slim(ev, ev.get('account', '')) for ev in cached[:cap]]
-			log_activity('SEARCH', f"scanned from {args['timeMin'][:16]} // {len(items)} results", 'agent')
-			return tool_result({'items': items})
-
-	def op():
+		try:
+			found = await asyncio.gather(*(sync.events_between(r['timeMin'], r['timeMax']) for r in ranges))
+		except (KeyError, ValueError):
+			return tool_result('An error occurred: every range needs RFC3339 timeMin and timeMax')
+		except HttpError as error:
+			return tool_result(f'An error occurred: {error}')
+		groups = []
+		for r, records in zip(ranges, found):
+			items = []
+			for rec in records:
+				ev = rec.to_dict()
+				if keep(ev, rec.account):
+					items.append(slim(ev, rec.account))
+			group = {'timeMin': r['timeMin'], 'timeMax': r['timeMax'], 'items': items[:cap]}
+			if len(items) > cap:
+				group['more'] = len(items) - cap
+			groups.append(group)
+		total = sum(len(g['items']) for g in groups)
+		log_activity('SEARCH', f"scanned {len(groups)} range(s) from {ranges[0]['timeMin'][:16]} // {total} results", 'agent')
+		if args.get('ranges'):
+			return tool_result({'ranges': groups})
+		return tool_result({'items': groups[0]['items']})
+
+	if not args.get('timeMin'):
+		return tool_result('An error occurred: pass timeMin (and timeMax) or ranges')
+
+	async def op():
 		kwargs = {
-			'calendarId': 'primary',
 			'timeMin': args['timeMin'],
-			'maxResults': args.get('maxResults', 25),
+			'maxResults': cap,
 			'singleEvents': True,
 			'orderBy': 'startTime',
 		}
-		if args.get('timeMax'):
-			kwargs['timeMax'] = args['timeMax']
+		if needle:
+			kwargs['q'] = args['query']
+		emails = [a.get('email', '') for a in get_accounts() if not account or a.get('email') == account]
+		calendars = await _sync().account_calendars(emails, background=False)
+		pulled = [(email, calendar['id']) for email in emails for calendar in calendars[email]]
+		pages = await asyncio.gather(*(gapi.events_list(email, calendar, **kwargs) for email, calendar in pulled))
 		merged = []
-		for acct in get_accounts():
-			email = acct.get('email', '')
-			events = get_service(account=email).events().list(**kwargs).execute()
-			merged.extend(slim(ev, email) for ev in events.get('items', []))
+		for (email, calendar), events in zip(pulled, pages):
+			merged.extend(slim({**ev, 'calendar': calendar}, email) for ev in events.get('items', []))
 		merged.sort(key=lambda e: e['start'].get('dateTime', e['start'].get('date', '')))
-		return {'items': merged}
+		return {'items': merged[:cap]}
 
 	return await gcal(
 		op,
@@ -362,9 +247,9 @@ async def cal_add_event(args):
 	}
 
 	return await gcal(
-		lambda: get_service(account=args.get('account')).events().insert(calendarId='primary', body=body).execute(),
+		lambda: gapi.events_insert(body, args.get('account')),
 		log=lambda r: ('CREATE', f"EVT {r.get('summary')} // {r['start'].get('dateTime', '')[:16]} // colorId {r.get('colorId', '-')}"),
-		cache=lambda r: cache_upsert_event({**r, 'account': resolve_account(args.get('account'))}),
+		cache=lambda r: _sync().event_written({**r, 'account': resolve_account(args.get('account'))}),
 	)
 
 @tool(
@@ -380,7 +265,14 @@ async def cal_add_event(args):
 	},
 )
 async def cal_get_event(args):
-	return await gcal(lambda: get_service(account=args.get('account')).events().get(calendarId='primary', eventId=args['eventId']).execute())
+	# mirrored events come from the payload on disk (fetched in full once if sync
+	# only pulled the masked fields); anything else goes to google
+	async def op():
+		full = await _sync().full_event(args['eventId'], args.get('account'))
+		if full is not None:
+			return full
+		return await gapi.events_get(args['eventId'], args.get('account'))
+	return await gcal(op)
 
 @tool(
 	'cal_edit_event',
@@ -425,10 +317,11 @@ async def cal_edit_event(args):
 	if 'timeMax' in args:
 		body['end'] = {'dateTime': args['timeMax'], 'timeZone': timezone}
 
+	calendar = _calendar_of(args['eventId'], args.get('account'))
 	return await gcal(
-		lambda: get_service(account=args.get('account')).events().patch(calendarId='primary', eventId=args['eventId'], body=body).execute(),
+		lambda: gapi.events_patch(args['eventId'], body, args.get('account'), calendar),
 		log=lambda r: ('EDIT', f"EVT {r.get('summary')} updated"),
-		cache=lambda r: cache_upsert_event({**r, 'account': resolve_account(args.get('account'))}),
+		cache=lambda r: _sync().event_written({**r, 'account': resolve_account(args.get('account')), 'calendar': calendar}),
 	)
 
 @tool(
@@ -444,19 +337,72 @@ async def cal_edit_event(args):
 	},
 )
 async def cal_delete_event(args):
-	def op():
-		get_service(account=args.get('account')).events().delete(calendarId='primary', eventId=args['eventId']).execute()
+	calendar = _calendar_of(args['eventId'], args.get('account'))
+
+	async def op():
+		await gapi.events_delete(args['eventId'], args.get('account'), calendar)
 		return 'Event successfully deleted.'
 	return await gcal(
 		op,
 		log=lambda r: ('DELETE', f"EVT {args['eventId']} removed"),
-		cache=lambda r: cache_remove_event(args['eventId']),
+		cache=lambda r: _sync().event_deleted(args['eventId'], resolve_account(args.get('account')), calendar),
 	)
 
+@tool(
+	'cal_time_analytics',
+	'''Returns how the user's time was spent between two local dates (end exclusive):
+	hours per category (from the event color protocol), per account, per weekday and per hour of day,
+	plus busy hours (overlaps counted once) and all-day event days per category.
+	Use this for "how many hours did I spend on X this month/semester" instead of summing cal_view_events results.''',
+	{
+		'type': 'object',
+		'properties': {
+			'start': {'type': 'string', 'description': 'first day, YYYY-MM-DD'},
+			'end': {'type': 'string', 'description': 'day after the last day, YYYY-MM-DD'},
+		},
+		'required': ['start', 'end'],
+	},
+)
+async def cal_time_analytics(args):
+	try:
+		result = await analytics.summary(args['start'], args['end'])
+	except (KeyError, ValueError) as e:
+		return tool_result(f'An error occurred: start and end must be YYYY-MM-DD dates ({e})')
+	except HttpError as error:
+		return tool_result(f'An error occurred: {error}')
+	log_activity('SEARCH', f"analytics {args['start']} to {args['end']} // {result['totalHours']}h", 'agent')
+	return tool_result(result)
+
+def _result_bytes(result):
+	return sum(len(c.get('text', '').encode()) for c in (result or {}).get('content', []))
+
+def _instrumented(tools):
+	'''Runs every tool's google and disk work in the agent lane (see lanes.py), and
+	records each call when tracing (see trace.py).'''
+	for t in tools:
+		async def handler(args, inner=t.handler, name=t.name):
+			with lanes.using('agent'):
+				if not trace.enabled():
+					return await inner(args)
+				started = time.monotonic()
+				result = await inner(args)
+				trace.record(
+					'tool', name=name, args=args,
+					ms=round(1000 * (time.monotonic() - started), 1), bytes=_result_bytes(result),
+				)
+				return result
+		t.handler = handler
+	return tools
+
+# also driven directly, without a model, by replay.py
+CALENDAR_TOOLS = _instrumented([
+	get_time, cal_view_events, cal_add_event, cal_get_event, cal_edit_event, cal_delete_event, cal_time_analytics,
+])
+
 calendar_server = create_sdk_mcp_server(
 	name='calendar',
 	version='1.0.0',
-	tools=[get_time, cal_view_events, cal_add_event, cal_get_event, cal_edit_event, cal_delete_event],
+	tools=CALENDAR_TOOLS,
 )
 
 SYSTEM_PROMPT = '''
@@ -468,12 +414,136 @@ Answer the user's request as directly as possible. If they ask for today's event
 NEVER ask the user for the eventId, always use the cal_view_events tool to find the event and get the id from there.
 '''
 
+SNAPSHOT_CLAUSE = '''Messages may start with a <context> block holding the current time and a snapshot of the coming days' events (with ids), taken from the local calendar mirror.
+Answer questions it covers directly, without calling get_time or cal_view_events; use the ids in it for edits and deletes.
+Call cal_view_events for anything outside the snapshot or when it says it was truncated.
+'''
+
+SNAPSHOT_DAYS = 7
+SNAPSHOT_MAX_CHARS = 6000
+
+HISTORY_CLAUSE = '''A message may also start with a <history> block: a condensed record of this conversation from before the session was compacted.
+Treat it as what was said earlier. Event ids in it may be out of date, so look events up again before editing them.
+'''
+
+# a session whose transcript passes CONTEXT_MAX_CHARS (~4 chars a token) is
+# restarted with a condensed <history>: the last few exchanges verbatim, older
+# ones as one-liners, tool results dropped (the snapshot re-supplies the calendar)
+CONTEXT_MAX_CHARS = 160_000
+COMPACT_KEEP_EXCHANGES = 3
+COMPACT_REPLY_CHARS = 1500
+COMPACT_LINE_CHARS = 160
+COMPACT_MAX_CHARS = 6000
+HISTORY_KEPT = 40
+
 CONFLICT_CLAUSE = '''Before creating events, check for conflicting events happening during/around the new event.
 If an event ends within half an hour of the new event's start time, or starts within half an hour of the new event's end time, check with the user before creating it.'''
 
+_snapshot = (None, '')
+
+def _when(rec, zone):
+	'''Times in the configured timezone; dates too when the event spans days.'''
+	if rec.start_ts is None or rec.end_ts is None:
+		return 'all day' if rec.all_day else f'{rec.start}-{rec.end}'
+	if rec.all_day:
+		# all-day ends are exclusive dates
+		last = datetime.fromtimestamp(rec.end_ts, zone).date() - timedelta(days=1)
+		first = datetime.fromtimestamp(rec.start_ts, zone).date()
+		return 'all day' if last <= first else f'all day {first.isoformat()} to {last.isoformat()}'
+	start = datetime.fromtimestamp(rec.start_ts, zone)
+	end = datetime.fromtimestamp(rec.end_ts, zone)
+	if start.date() == end.date():
+		return f'{start:%H:%M}-{end:%H:%M}'
+	return f'{start:%Y-%m-%d %H:%M}-{end:%Y-%m-%d %H:%M}'
+
+def _snapshot_line(rec, zone):
+	when = _when(rec, zone)
+	extra = ''.join(f', {k}={v}' for k, v in (('colorId', rec.colorId), ('location', rec.location)) if v)
+	return f'  {when} {rec.summary or "(no title)"} [id={rec.id}, account={rec.account}{extra}]'
+
+def calendar_snapshot():
+	'''Compact text of the next SNAPSHOT_DAYS days of mirrored events, capped at
+	SNAPSHOT_MAX_CHARS; rebuilt only when the mirror or the local date changes.
+	Returns (key, text), text '' until the mirror has synced once.'''
+	global _snapshot
+	if not mirror.section():
+		return None, ''
+	zone = mirror.tz()
+	today = datetime.now(zone).date()
+	key = (mirror.version(), today)
+	if _snapshot[0] != key:
+		lines, size = [], 0
+		for n in range(SNAPSHOT_DAYS):
+			date = today + timedelta(days=n)
+			day = [f"{date.isoformat()} {date.strftime('%a')}"]
+			day += [_snapshot_line(rec, zone) for rec in mirror.day(date.isoformat())] or ['  (nothing)']
+			block = '\n'.join(day)
+			if size + len(block) > SNAPSHOT_MAX_CHARS:
+				lines.append(f'(truncated at {date.isoformat()})')
+				break
+			lines.append(block)
+			size += len(block) + 1
+		_snapshot = (key, '\n'.join(lines))
+	return _snapshot
+
+def _turn_message(user_id, message):
+	'''Prefixes a turn with the current time and, when the mirror changed since the
+	session last saw it, a fresh snapshot - so common questions need no tool calls.
+	The first turn after a compaction also carries the condensed history.'''
+	key, snapshot = calendar_snapshot()
+	now = datetime.now(ZoneInfo(get_settings()['timezone'])).isoformat(timespec='seconds')
+	context = f'Current time: {now}'
+	if snapshot and _seen.get(user_id) != key:
+		context += f'\nEvents, next {SNAPSHOT_DAYS} days:\n{snapshot}'
+		_seen[user_id] = key
+	history = _carry.pop(user_id, None)
+	history = f'<history>\n{history}\n</history>\n' if history else ''
+	return f'{history}<context>\n{context}\n</context>\n\n{message}'
+
+def _clip(text, limit):
+	text = ' '.join(text.split())
+	return text if len(text) <= limit else text[:limit - 3] + '...'
+
+def _condensed(history):
+	'''Text standing in for a compacted transcript, at most COMPACT_MAX_CHARS.'''
+	recent = [
+		f'user: {h["user"]}\nyou: {_clip(h["reply"], COMPACT_REPLY_CHARS)}'
+		for h in history[-COMPACT_KEEP_EXCHANGES:]
+	]
+	size = sum(map(len, recent))
+	older = []
+	for h in reversed(history[:-COMPACT_KEEP_EXCHANGES]):
+		line = f'- user: {_clip(h["user"], COMPACT_LINE_CHARS)} / you: {_clip(h["reply"], COMPACT_LINE_CHARS)}'
+		if size + len(line) > COMPACT_MAX_CHARS:
+			break
+		older.append(line)
+		size += len(line) + 1
+	parts = []
+	if older:
+		parts.append('Earlier:\n' + '\n'.join(reversed(older)))
+	if recent:
+		parts.append('Most recent:\n' + '\n\n'.join(recent))
+	return '\n\n'.join(parts)
+
+def _message_chars(msg):
+	'''Rough transcript footprint of one SDK message; tool results dominate.'''
+	if not isinstance(msg, (AssistantMessage, UserMessage)):
+		return 0
+	if isinstance(msg.content, str):
+		return len(msg.content)
+	size = 0
+	for block in msg.content:
+		if isinstance(block, TextBlock):
+			size += len(block.text)
+		elif isinstance(block, ToolUseBlock):
+			size += len(json.dumps(block.input))
+		elif isinstance(block, ToolResultBlock) and block.content:
+			size += len(block.content if isinstance(block.content, str) else json.dumps(block.content))
+	return size
+
 def build_options():
 	settings = get_settings()
-	prompt = SYSTEM_PROMPT + f"The user's default timezone is {settings['timezone']}. Use it whenever they give no explicit zone.\n"
+	prompt = SYSTEM_PROMPT + SNAPSHOT_CLAUSE + HISTORY_CLAUSE + f"The user's default timezone is {settings['timezone']}. Use it whenever they give no explicit zone.\n"
 	cats = settings['categories']
 	proto = '\n'.join(f"- {c['colorId']} for {c['name']}" for c in cats)
 	prompt += (
@@ -506,11 +576,43 @@ def build_options():
 			'mcp__calendar__cal_get_event',
 			'mcp__calendar__cal_edit_event',
 			'mcp__calendar__cal_delete_event',
+			'mcp__calendar__cal_time_analytics',
 		],
 	)
 
 _clients: dict[str, ClaudeSDKClient] = {}
 _locks: dict[str, asyncio.Lock] = {}
+_seen: dict[str, tuple] = {}
+_history: dict[str, list[dict]] = {}
+_context: dict[str, int] = {}
+_carry: dict[str, str] = {}
+_turns = {'count': 0, 'seconds': 0.0, 'toolCalls': 0, 'compactions': 0}
+
+def _record_turn(started, tool_calls):
+	_turns['count'] += 1
+	_turns['seconds'] += time.monotonic() - started
+	_turns['toolCalls'] += tool_calls
+
+def turn_stats():
+	'''Mean latency and tool calls per turn, to see what the snapshot saves.'''
+	n = _turns['count'] or 1
+	return {
+		'turns': _turns['count'],
+		'avgSeconds': round(_turns['seconds'] / n, 2),
+		'avgToolCalls': round(_turns['toolCalls'] / n, 2),
+		'compactions': _turns['compactions'],
+		'largestContextChars': max(_context.values(), default=0),
+	}
+
+def _remember(user_id, message, reply, size):
+	history = _history.setdefault(user_id, [])
+	history.append({'user': message, 'reply': reply})
+	del history[:-HISTORY_KEPT]
+	_context[user_id] = _context.get(user_id, 0) + size
+
+def _forget(user_id):
+	for state in (_seen, _history, _context, _carry):
+		state.pop(user_id, None)
 
 async def get_client(user_id: str) -> ClaudeSDKClient:
 	client = _clients.get(user_id)
@@ -518,6 +620,8 @@ async def get_client(user_id: str) -> ClaudeSDKClient:
 		client = ClaudeSDKClient(options=build_options())
 		await client.connect()
 		_clients[user_id] = client
+		# a new conversation is likely to read and write the calendar: sync faster for a while
+		_sync().note_activity('chat')
 	return client
 
 HARNESS_TOOLS = {'ToolSearch', 'Agent', 'Task', 'TodoWrite'}
@@ -525,22 +629,83 @@ HARNESS_TOOLS = {'ToolSearch', 'Agent', 'Task', 'TodoWrite'}
 def display_tool_name(name: str) -> str:
 	return name.removeprefix('mcp__calendar__')
 
+class TurnTimeout(Exception):
+	pass
+
+async def _restart(user_id, interrupt=False):
+	'''Drops the session's client; the next message starts a fresh one, seeded with
+	the condensed history of this one.'''
+	client = _clients.pop(user_id, None)
+	_seen.pop(user_id, None)
+	if _history.get(user_id):
+		_carry[user_id] = _condensed(_history[user_id])
+	_context[user_id] = len(_carry.get(user_id, ''))
+	if client:
+		try:
+			if interrupt:
+				await client.interrupt()
+			await client.disconnect()
+		except Exception:
+			pass
+
+async def _abandon(user_id):
+	'''A turn cut off mid-response leaves its client in an unknown state.'''
+	await _restart(user_id, interrupt=True)
+
+async def _compact(user_id):
+	'''Keeps per-turn cost flat in long-lived sessions: past CONTEXT_MAX_CHARS the
+	transcript is replaced by its condensed history.'''
+	_turns['compactions'] += 1
+	print(f'[agent] compacting session {user_id} at {_context[user_id]} chars')
+	await _restart(user_id)
+
+async def _turn(user_id, message):
+	'''SDK messages of one admitted turn (see admission.py), cut off after
+	TURN_TIMEOUT_SECONDS. Raises admission.Busy when the wait queue is full.'''
+	async with admission.admit():
+		deadline = time.monotonic() + admission.TURN_TIMEOUT_SECONDS
+		if _context.get(user_id, 0) > CONTEXT_MAX_CHARS:
+			await _compact(user_id)
+		client = await get_client(user_id)
+		prompt = _turn_message(user_id, message)
+		size = len(prompt)
+		await client.query(prompt)
+		messages = client.receive_response()
+		while True:
+			try:
+				msg = await asyncio.wait_for(anext(messages), max(0, deadline - time.monotonic()))
+			except StopAsyncIteration:
+				return
+			except asyncio.TimeoutError:
+				admission.timed_out()
+				await _abandon(user_id)
+				raise TurnTimeout(
+					f'turn timed out after {admission.TURN_TIMEOUT_SECONDS:g}s; the session was reset'
+				) from None
+			size += _message_chars(msg)
+			if isinstance(msg, ResultMessage):
+				_remember(user_id, message, msg.result or '', size)
+			yield msg
+
 async def agent_stream(user_id: str, message: str):
 	'''Yields event dicts for one agent turn:
+	{'type': 'queued', 'position': n} - waiting for a turn slot
 	{'type': 'text', 'text': delta} - streamed text
 	{'type': 'tool', 'name': tool_name} - a tool call started
 	{'type': 'break'} - a new assistant turn started after emitted text
 	{'type': 'done', 'result': full_text}
-	{'type': 'error', 'message': str}
+	{'type': 'error', 'message': str, 'busy': bool}
 	'''
 	lock = _locks.setdefault(user_id, asyncio.Lock())
 	async with lock:
+		started, tool_calls = time.monotonic(), 0
 		try:
-			client = await get_client(user_id)
-			await client.query(message)
+			position = admission.position()
+			if position and not admission.is_full():
+				yield {'type': 'queued', 'position': position}
 
 			emitted_text = False
-			async for msg in client.receive_response():
+			async for msg in _turn(user_id, message):
 				if isinstance(msg, StreamEvent):
 					ev = msg.event
 					if ev.get('type') == 'content_block_delta':
@@ -552,36 +717,43 @@ async def agent_stream(user_id: str, message: str):
 						block = ev.get('content_block', {})
 						# harness-internal tools are noise in the chat transcript
 						if block.get('type') == 'tool_use' and block.get('name') not in HARNESS_TOOLS:
+							tool_calls += 1
 							yield {'type': 'tool', 'name': display_tool_name(block.get('name', ''))}
 					elif ev.get('type') == 'message_start' and emitted_text:
 						yield {'type': 'break'}
 				elif isinstance(msg, ResultMessage):
+					_record_turn(started, tool_calls)
 					yield {'type': 'done', 'result': msg.result or ''}
 
+		except admission.Busy as e:
+			yield {'type': 'error', 'message': f'agent busy: {e}', 'busy': True}
 		except Exception as e:
 			yield {'type': 'error', 'message': str(e)}
 
 async def close_session(user_id: str):
 	client = _clients.pop(user_id, None)
 	_locks.pop(user_id, None)
+	_forget(user_id)
 	if client:
 		await client.disconnect()
 
 async def agent_call(user_id: str, message: str) -> str:
+	'''Whole-reply variant of agent_stream; admission.Busy and TurnTimeout propagate.'''
 	lock = _locks.setdefault(user_id, asyncio.Lock())
 	async with lock:
-		client = await get_client(user_id)
-		await client.query(message)
-
+		started, tool_calls = time.monotonic(), 0
 		texts = []
 		final = None
-		async for msg in client.receive_response():
+		async for msg in _turn(user_id, message):
 			if isinstance(msg, AssistantMessage):
 				for block in msg.content:
 					if isinstance(block, TextBlock):
 						texts.append(block.text)
+					elif isinstance(block, ToolUseBlock) and block.name not in HARNESS_TOOLS:
+						tool_calls += 1
 			elif isinstance(msg, ResultMessage):
 				final = msg.result
+		_record_turn(started, tool_calls)
 
 		return final or '\n'.join(texts)
 
@@ -594,5 +766,110 @@ async def mainloop():
 		reply = await agent_call('cli', user_input)
 		print(f'\nAutoCal: {reply}')
 
+BATCH_BUSY_RETRY_SECONDS = 2.0
+
+def _emit(out, record):
+	out.write(json.dumps(record) + '\n')
+	out.flush()
+
+async def _batch_prompt(line, item):
+	'''One prompt of a batch on its own session -> its result record.'''
+	session = str(item.get('session') or f'batch-{line}')
+	started = time.monotonic()
+	while True:
+		texts, tools, reply, error, busy = [], [], None, None, False
+		async for ev in agent_stream(session, item['prompt']):
+			if ev['type'] == 'text':
+				texts.append(ev['text'])
+			elif ev['type'] == 'tool':
+				tools.append(ev['name'])
+			elif ev['type'] == 'done':
+				reply = ev['result']
+			elif ev['type'] == 'error':
+				error, busy = ev['message'], ev.get('busy', False)
+		if not busy:
+			break
+		# the turn queue is full (other workers, or a concurrency above its size): wait for room
+		await asyncio.sleep(BATCH_BUSY_RETRY_SECONDS)
+	record = {'type': 'result', 'line': line, 'id': item.get('id'), 'session': session, 'ok': error is None}
+	if error is None:
+		record['reply'] = reply if reply is not None else ''.join(texts)
+	else:
+		record['error'] = error
+	record.update(tools=tools, seconds=round(time.monotonic() - started, 3))
+	return record
+
+async def batch(source, out, concurrency):
+	'''Headless mode. Each input line is a JSON object {"prompt": ..., optional "id"
+	and "session"} (or just a JSON string). Prompts run on separate sessions - lines
+	naming the same session run in order on it - at most `concurrency` at a time.
+	Writes one result line per prompt as it finishes, then a summary line.'''
+	slots = asyncio.Semaphore(max(1, concurrency))
+	tasks, records, sessions = [], [], set()
+	started = time.monotonic()
+
+	async def run(line, item):
+		try:
+			record = await _batch_prompt(line, item)
+		finally:
+			slots.release()
+		records.append(record)
+		_emit(out, record)
+
+	line = 0
+	while True:
+		text = await asyncio.to_thread(source.readline)
+		if not text:
+			break
+		line += 1
+		if not text.strip():
+			continue
+		try:
+			item = json.loads(text)
+			item = {'prompt': item} if isinstance(item, str) else item
+			if not isinstance(item.get('prompt'), str):
+				raise ValueError('no "prompt" string')
+		except (ValueError, AttributeError) as e:
+			record = {'type': 'result', 'line': line, 'ok': False, 'error': f'bad input line: {e}', 'seconds': 0.0}
+			records.append(record)
+			_emit(out, record)
+			continue
+		await slots.acquire()
+		sessions.add(str(item.get('session') or f'batch-{line}'))
+		tasks.append(asyncio.create_task(run(line, item)))
+	await asyncio.gather(*tasks)
+	for session in sessions:
+		await close_session(session)
+
+	elapsed = time.monotonic() - started
+	seconds = sorted(r['seconds'] for r in records if r['ok'])
+	_emit(out, {
+		'type': 'summary',
+		'prompts': len(records),
+		'ok': len(seconds),
+		'failed': len(records) - len(seconds),
+		'seconds': round(elapsed, 2),
+		'promptsPerMinute': round(60 * len(records) / elapsed, 2) if elapsed else None,
+		'avgSeconds': round(sum(seconds) / len(seconds), 2) if seconds else None,
+		'p50Seconds': seconds[(len(seconds) - 1) // 2] if seconds else None,
+		'maxSeconds': seconds[-1] if seconds else None,
+		'toolCalls': sum(len(r.get('tools', ())) for r in records),
+		'concurrency': concurrency,
+	})
+
+def main():
+	parser = argparse.ArgumentParser(description='AutoCal agent from the command line; interactive unless --batch.')
+	parser.add_argument('--batch', metavar='FILE', help="JSONL prompts ('-' for stdin), run headless with JSONL results on stdout")
+	parser.add_argument('--concurrency', type=int, default=admission.MAX_CONCURRENT_TURNS, help='prompts in flight at once')
+	args = parser.parse_args()
+	if args.batch is None:
+		asyncio.run(mainloop())
+		return
+	source = sys.stdin if args.batch == '-' else open(args.batch)
+	# results own stdout; diagnostics printed along the way ([sync], [agent]) go to stderr
+	results = sys.stdout
+	with source, contextlib.redirect_stdout(sys.stderr):
+		asyncio.run(batch(source, results, args.concurrency))
+
 if __name__ == '__main__':
-	asyncio.run(mainloop())
+	main()
@@ -0,0 +1,175 @@
+'''Time-allocation totals over the mirror: hours per category (the colorId
+protocol in settings), per account, per weekday and per hour of day.
+
+Totals are event-hours, so two overlapping events both count in full;
+busyHours is the wall-clock union and overlapHours the difference. All-day
+events carry no hours and are counted as days in allDay instead.
+
+Aggregates are kept per local day and computed a span of days at a time with
+numpy. Covered time before any instant is a piecewise-linear function of the
+sorted starts and ends, so every hour bin of the span comes from a few
+searchsorted and cumsum passes. No event is split into days or hours in
+Python. The day cache is keyed by mirror.version(), so any mirror mutation
+invalidates it; a semester of cached days sums in a millisecond or two.'''
+
+from datetime import date, datetime, time, timedelta
+
+from . import mirror, sync
+from .store import get_settings
+
+UNCATEGORIZED = 'UNCATEGORIZED'
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MAX_DAYS = 366 * 2
+
+# (mirror version, timezone, categories) -> {'YYYY-MM-DD': day totals}
+_days = (None, {})
+
+def _key():
+	settings = get_settings()
+	categories = tuple((c['colorId'], c['name']) for c in settings['categories'])
+	return mirror.version(), settings['timezone'], categories
+
+def _covered(starts, ends, points):
+	'''Seconds of the intervals [starts, ends) lying before each of points.'''
+	import numpy as np  # lazy: server imports this module at boot; _warm_agent preloads it
+	starts, ends = np.sort(starts), np.sort(ends)
+	start_sums = np.concatenate(([0.0], np.cumsum(starts)))
+	end_sums = np.concatenate(([0.0], np.cumsum(ends)))
+	n_started = np.searchsorted(starts, points, side='right')
+	n_ended = np.searchsorted(ends, points, side='right')
+	return (n_started * points - start_sums[n_started]) - (n_ended * points - end_sums[n_ended])
+
+def _union(starts, ends):
+	'''Merged, non-overlapping cover of the intervals.'''
+	import numpy as np
+	if not len(starts):
+		return starts, ends
+	order = np.argsort(starts, kind='stable')
+	starts, ends = starts[order], ends[order]
+	reach = np.maximum.accumulate(ends)
+	# a new block starts wherever an interval begins after everything before it ended
+	new = np.concatenate(([True], starts[1:] > reach[:-1]))
+	last = np.concatenate((np.flatnonzero(new)[1:] - 1, [len(starts) - 1]))
+	return starts[new], reach[last]
+
+def _compute(records, first, count, zone, colors):
+	'''Day totals for `count` local days from `first`, as {'YYYY-MM-DD': totals}.'''
+	import numpy as np
+	days = [first + timedelta(days=n) for n in range(count)]
+	midnights = np.array([datetime.combine(d, time(), zone).timestamp() for d in days + [days[-1] + timedelta(days=1)]])
+	base = midnights[0]
+	midnights -= base
+	# 24 local-hour bins per day; on DST days the skipped hour is empty and the repeated one double
+	bins = midnights[:-1, None] + np.arange(24) * 3600.0
+	for i in np.flatnonzero(np.diff(midnights) != 86400):
+		bins[i] = [datetime.combine(days[i], time(h), zone).timestamp() - base for h in range(24)]
+	edges = np.append(bins.ravel(), midnights[-1])
+
+	timed = [rec for rec in records if not rec.all_day and rec.start_ts is not None and rec.end_ts is not None and rec.end_ts > rec.start_ts]
+	starts = np.array([rec.start_ts for rec in timed], dtype=float) - base
+	ends = np.array([rec.end_ts for rec in timed], dtype=float) - base
+	categories = np.array([colors.get(rec.colorId, UNCATEGORIZED) for rec in timed], dtype=object)
+	accounts = np.array([rec.account for rec in timed], dtype=object)
+
+	def hourly(mask):
+		return np.diff(_covered(starts[mask], ends[mask], edges)).reshape(count, 24)
+
+	by_category = {name: hourly(categories == name) for name in set(categories)}
+	by_account = {name: hourly(accounts == name) for name in set(accounts)}
+	busy = np.diff(_covered(*_union(starts, ends), midnights))
+	events = np.searchsorted(np.sort(starts), midnights[1:], side='left') - np.searchsorted(np.sort(ends), midnights[:-1], side='right')
+
+	# all-day events: +1 on the first covered day, -1 after the last, then a running sum
+	all_day = {}
+	first_ord = first.toordinal()
+	for rec in records:
+		if not rec.all_day:
+			continue
+		try:
+			lo = date.fromisoformat(rec.start).toordinal() - first_ord
+			hi = date.fromisoformat(rec.end).toordinal() - first_ord
+		except (TypeError, ValueError):
+			continue
+		row = all_day.setdefault(colors.get(rec.colorId, UNCATEGORIZED), np.zeros(count + 1, dtype=int))
+		row[min(max(lo, 0), count)] += 1
+		row[min(max(hi, 0), count)] -= 1
+	all_day = {name: np.cumsum(row[:-1]) for name, row in all_day.items()}
+
+	out = {}
+	for i, d in enumerate(days):
+		out[d.isoformat()] = {
+			'category': {name: rows[i] for name, rows in by_category.items() if rows[i].any()},
+			'account': {name: rows[i] for name, rows in by_account.items() if rows[i].any()},
+			'busy': float(busy[i]),
+			'events': int(events[i]),
+			'allDay': {name: int(row[i]) for name, row in all_day.items() if row[i]},
+		}
+	return out
+
+def _runs(dates):
+	'''Consecutive runs of dates, as (first, count).'''
+	runs = []
+	for d in dates:
+		if runs and runs[-1][0] + timedelta(days=runs[-1][1]) == d:
+			runs[-1][1] += 1
+		else:
+			runs.append([d, 1])
+	return runs
+
+def _hours(seconds):
+	return round(float(seconds) / 3600, 2)
+
+async def summary(start, end):
+	'''Totals for local dates [start, end) ('YYYY-MM-DD', end exclusive). Raises
+	ValueError on bad dates, HttpError if days outside the mirror cannot be fetched.'''
+	import numpy as np
+	global _days
+	first, stop = date.fromisoformat(start), date.fromisoformat(end)
+	if not 0 < (stop - first).days <= MAX_DAYS:
+		raise ValueError(f'end must be after start and at most {MAX_DAYS} days later')
+	dates = [first + timedelta(days=n) for n in range((stop - first).days)]
+	hit = _days[0] == _key() and all(d.isoformat() in _days[1] for d in dates)
+	if not hit:
+		zone = mirror.tz()
+		lo = datetime.combine(first, time(), zone).isoformat()
+		hi = datetime.combine(stop, time(), zone).isoformat()
+		# may pull month segments, which bumps the mirror version: key after this
+		records = await sync.events_between(lo, hi)
+		key = _key()
+		if _days[0] != key:
+			_days = (key, {})
+		colors = dict(key[2])
+		missing = [d for d in dates if d.isoformat() not in _days[1]]
+		for run_first, run_count in _runs(missing):
+			_days[1].update(_compute(records, run_first, run_count, zone, colors))
+
+	totals = [_days[1][d.isoformat()] for d in dates]
+	by_category, by_account, all_day = {}, {}, {}
+	by_hour = np.zeros(24)
+	by_weekday = np.zeros(7)
+	for d, day in zip(dates, totals):
+		for name, hours in day['category'].items():
+			spent = hours.sum()
+			by_category[name] = by_category.get(name, 0.0) + spent
+			by_hour += hours
+			by_weekday[d.weekday()] += spent
+		for name, hours in day['account'].items():
+			by_account[name] = by_account.get(name, 0.0) + hours.sum()
+		for name, n in day['allDay'].items():
+			all_day[name] = all_day.get(name, 0) + n
+	total = by_hour.sum()
+	busy = sum(day['busy'] for day in totals)
+	return {
+		'start': start,
+		'end': end,
+		'days': len(dates),
+		'totalHours': _hours(total),
+		'busyHours': _hours(busy),
+		'overlapHours': _hours(max(0.0, total - busy)),
+		'byCategory': {k: _hours(v) for k, v in sorted(by_category.items(), key=lambda kv: -kv[1])},
+		'byAccount': {k: _hours(v) for k, v in sorted(by_account.items(), key=lambda kv: -kv[1])},
+		'byWeekday': {name: _hours(v) for name, v in zip(WEEKDAYS, by_weekday)},
+		'byHour': [_hours(v) for v in by_hour],
+		'allDay': all_day,
+		'cached': hit,
+	}
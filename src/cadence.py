@@ -0,0 +1,125 @@
+'''Per-account refresh cadence for the sync loop.
+
+Each account's next pull is scheduled from three signals:
+- activity: a chat session starting pins every account to SYNC_MIN_SECONDS for
+  CHAT_BOOST_SECONDS; other UI/agent traffic in the last ACTIVE_SECONDS means
+  BASE_SECONDS / 2; after that the interval doubles per IDLE_DOUBLING_SECONDS of
+  idleness, so an overnight-idle machine settles at SYNC_MAX_SECONDS;
+- change rate: a decaying average of events added, removed or edited per pull,
+  each change per pull dividing the interval further;
+- failures: consecutive failed pulls double it (expired token, offline).
+Bounds come from the environment (.env), like admission's limits.'''
+
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SYNC_MIN_SECONDS = float(os.getenv('SYNC_MIN_SECONDS', '30'))
+SYNC_MAX_SECONDS = float(os.getenv('SYNC_MAX_SECONDS', '1800'))
+BASE_SECONDS = 300.0
+ACTIVE_SECONDS = 600.0
+CHAT_BOOST_SECONDS = 180.0
+IDLE_DOUBLING_SECONDS = 1800.0
+CHANGE_DECAY = 0.5
+# past SYNC_MAX_SECONDS anyway; keeps 2 ** n finite after weeks idle or failing
+MAX_DOUBLINGS = 10
+
+_booted = time.monotonic()
+_last_activity = None
+_chat_started = None
+_accounts: dict[str, dict] = {}
+_wake = asyncio.Event()
+
+def _state(email):
+	return _accounts.setdefault(email, {'lastRun': None, 'next': None, 'changes': 0.0, 'failures': 0})
+
+def interval(email):
+	'''(seconds, reason) until the account's next pull, from the signals above.'''
+	state = _state(email)
+	now = time.monotonic()
+	if _chat_started is not None and now - _chat_started < CHAT_BOOST_SECONDS:
+		seconds, reason = SYNC_MIN_SECONDS, 'chat'
+	else:
+		idle = now - (_last_activity if _last_activity is not None else _booted)
+		if idle < ACTIVE_SECONDS:
+			seconds, reason = BASE_SECONDS / 2, 'active'
+		else:
+			seconds, reason = BASE_SECONDS * 2 ** min((idle - ACTIVE_SECONDS) / IDLE_DOUBLING_SECONDS, MAX_DOUBLINGS), 'idle'
+	if state['changes'] >= 0.5:
+		seconds /= 1 + state['changes']
+		reason += ', changing'
+	if state['failures']:
+		factor = 2 ** min(state['failures'], MAX_DOUBLINGS)
+		seconds *= factor
+		reason = f'backoff x{factor}'
+	return min(SYNC_MAX_SECONDS, max(SYNC_MIN_SECONDS, seconds)), reason
+
+def _reschedule():
+	'''Pulls every account's next run in to what the current signals allow.'''
+	for email, state in _accounts.items():
+		if state['lastRun'] is not None:
+			state['next'] = min(state['next'], state['lastRun'] + interval(email)[0])
+	_wake.set()
+
+def note_activity(kind='ui'):
+	'''kind 'chat' when an agent session starts; anything else is plain use.'''
+	global _last_activity, _chat_started
+	_last_activity = time.monotonic()
+	if kind == 'chat':
+		_chat_started = _last_activity
+	_reschedule()
+
+def ran(email, changes=0, failed=False):
+	'''Records one pull of the account and schedules its next.'''
+	state = _state(email)
+	first = state['lastRun'] is None
+	state['lastRun'] = time.monotonic()
+	if failed:
+		state['failures'] += 1
+	else:
+		state['failures'] = 0
+		# the first pull after boot or linking fills the mirror; that is not churn
+		if not first:
+			state['changes'] = CHANGE_DECAY * state['changes'] + (1 - CHANGE_DECAY) * changes
+	state['next'] = state['lastRun'] + interval(email)[0]
+
+def due(emails):
+	'''Accounts whose pull is due; never-pulled ones always are.'''
+	now = time.monotonic()
+	return [email for email in emails if _state(email)['next'] is None or _state(email)['next'] <= now]
+
+async def wait(emails):
+	'''Sleeps until the first of the accounts is due, or the schedule is pulled in.'''
+	_wake.clear()
+	pending = [_state(email)['next'] for email in emails]
+	if any(n is None for n in pending):
+		return
+	delay = min(pending, default=time.monotonic() + BASE_SECONDS) - time.monotonic()
+	try:
+		await asyncio.wait_for(_wake.wait(), max(0.0, delay))
+	except asyncio.TimeoutError:
+		pass
+
+def _clock(mono):
+	if mono is None:
+		return None
+	return datetime.fromtimestamp(time.time() + mono - time.monotonic()).isoformat(timespec='seconds')
+
+def stats():
+	out = {}
+	for email, state in _accounts.items():
+		seconds, reason = interval(email)
+		out[email or 'primary'] = {
+			'intervalSeconds': round(seconds),
+			'reason': reason,
+			'lastRun': _clock(state['lastRun']),
+			'nextRun': _clock(state['next']),
+			'changeRate': round(state['changes'], 2),
+			'failures': state['failures'],
+		}
+	return out
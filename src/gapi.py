@@ -0,0 +1,212 @@
+'''Asyncio-native client for the Calendar v3 and Tasks v1 calls AutoCal makes.
+
+googleapiclient is blocking, so every call used to hold a worker thread for its
+whole round trip, and the default executor's few threads capped how many could
+be in flight. These coroutines speak the REST API directly over one shared
+httpx connection pool: hundreds of calls can wait on google at once on the
+event loop. Credentials are the linked accounts' token files (refreshed off the
+loop, only when expired), every call goes through the same per-account quota
+guard as api_call, and failures raise googleapiclient's HttpError, so callers
+handle errors exactly as before - a network failure included, as a 503. Each call holds a slot in the caller's lane
+(see lanes.py). Batch requests (sync reconcile, ICS import) still go through
+googleapiclient. Calls outside the sync lane are written to the trace when
+recording (see trace.py).'''
+
+import asyncio
+import contextvars
+import json
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+
+from . import lanes, quota, trace
+from .accounts import account_creds, account_entry, resolve_account
+
+CALENDAR_URL = 'https://www.googleapis.com/calendar/v3'
+TASKS_URL = 'https://tasks.googleapis.com/tasks/v1'
+MAX_CONNECTIONS = 100
+KEEPALIVE_CONNECTIONS = 20
+TIMEOUT_SECONDS = 30.0
+
+# replay.py's fake google; when set, calls go to it and need no credentials
+TRANSPORT = None
+
+_clients: dict = {}
+_creds: dict = {}
+_creds_locks: dict = {}
+_meter = contextvars.ContextVar('gapi_meter', default=None)
+
+def _http():
+	'''The shared pool; one per event loop, since its connections belong to one.'''
+	loop = asyncio.get_running_loop()
+	client = _clients.get(loop)
+	if client is None:
+		for old_loop, old in list(_clients.items()):
+			del _clients[old_loop]
+			# a loop that is gone took its sockets with it; a live one closes its own pool
+			if old_loop.is_running():
+				asyncio.run_coroutine_threadsafe(old.aclose(), old_loop)
+		client = _clients[loop] = httpx.AsyncClient(
+			timeout=TIMEOUT_SECONDS,
+			limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=KEEPALIVE_CONNECTIONS),
+			transport=TRANSPORT,
+			# google only compresses for user agents that mention gzip
+			headers={'Accept-Encoding': 'gzip', 'User-Agent': 'autocal (gzip)'},
+		)
+	return client
+
+async def close():
+	'''Closes this loop's pool (server shutdown).'''
+	client = _clients.pop(asyncio.get_running_loop(), None)
+	if client is not None:
+		await client.aclose()
+
+async def _token(account, interactive, reload=False):
+	'''Bearer token for an account, cached; account_creds runs in a thread only when
+	it has expired, or to re-read the token file after google rejected it.'''
+	if TRANSPORT is not None:
+		return 'replay'
+	entry = account_entry(account)
+	key = entry['token']
+	creds = _creds.get(key)
+	if reload or creds is None or not creds.valid:
+		async with _creds_locks.setdefault(key, asyncio.Lock()):
+			creds = _creds.get(key)
+			if reload or creds is None or not creds.valid:
+				creds = _creds[key] = await lanes.run(account_creds, entry, interactive)
+	return creds.token
+
+@contextmanager
+def metered(meter):
+	'''Every call made inside the block (and tasks it starts) also counts into meter.'''
+	token = _meter.set(meter)
+	try:
+		yield meter
+	finally:
+		_meter.reset(token)
+
+def _params(params):
+	out = {}
+	for key, value in (params or {}).items():
+		if value is None:
+			continue
+		out[key] = ('true' if value else 'false') if isinstance(value, bool) else value
+	return out
+
+def _traced_body(resp):
+	try:
+		return resp.json() if resp.content else ''
+	except ValueError:
+		return resp.text
+
+def _error(resp):
+	info = {k.lower(): v for k, v in resp.headers.items()}
+	info['status'] = resp.status_code
+	return HttpError(httplib2.Response(info), resp.content, uri=str(resp.url))
+
+def _unreachable(error, url):
+	'''A network failure as a retryable HttpError, so callers need one except clause.'''
+	content = json.dumps({'error': {'code': 503, 'message': f'could not reach google: {error!r}'}}).encode()
+	return HttpError(httplib2.Response({'status': 503}), content, uri=url)
+
+async def call(method, url, account=None, params=None, body=None, etag=None, interactive=True, meter=None, consent=None):
+	'''One REST call under the account's quota -> parsed JSON ('' for empty bodies).
+	etag sends If-Match, so a write against a changed resource fails with 412.
+	meter, a dict, accumulates requests, body bytes and bytes on the wire.
+	interactive is the quota priority; consent (default: the same) allows a
+	browser consent flow when the token cannot be refreshed, else NeedsConsent.'''
+	email = resolve_account(account)
+	consent = interactive if consent is None else consent
+
+	async def send():
+		token = await _token(email, consent)
+		for attempt in range(2):
+			headers = {'Authorization': f'Bearer {token}'}
+			if etag:
+				headers['If-Match'] = etag
+			started = time.monotonic()
+			resp = await _http().request(method, url, params=_params(params), json=body, headers=headers)
+			if resp.status_code != 401 or attempt:
+				break
+			token = await _token(email, consent, reload=True)
+		for m in (meter, _meter.get()):
+			if m is not None:
+				m['requests'] = m.get('requests', 0) + 1
+				m['bytes'] = m.get('bytes', 0) + len(resp.content)
+				m['wireBytes'] = m.get('wireBytes', 0) + resp.num_bytes_downloaded
+		if trace.enabled() and lanes.current() != 'sync':
+			trace.record(
+				'google', method=method, url=str(resp.request.url), status=resp.status_code,
+				ms=round(1000 * (time.monotonic() - started), 1), body=_traced_body(resp),
+			)
+		if resp.status_code >= 400:
+			raise _error(resp)
+		return resp.json() if resp.content else ''
+
+	# the lane bounds how much of one kind of work is in flight; quota orders it per account
+	async with lanes.slot():
+		try:
+			return await quota.execute_async(send, email, interactive)
+		except httpx.TransportError as error:
+			raise _unreachable(error, url) from error
+
+async def calendar_list(account=None, interactive=True, meter=None, **params):
+	return await call('GET', f'{CALENDAR_URL}/users/me/calendarList', account, params, interactive=interactive, meter=meter)
+
+def _events(calendar, event_id=None, suffix=''):
+	url = f"{CALENDAR_URL}/calendars/{quote(calendar, safe='')}/events"
+	if event_id is not None:
+		url += f"/{quote(event_id, safe='')}"
+	return url + suffix
+
+async def events_list(account=None, calendar='primary', interactive=True, meter=None, **params):
+	return await call('GET', _events(calendar), account, params, interactive=interactive, meter=meter)
+
+async def events_get(event_id, account=None, calendar='primary', interactive=True, consent=None):
+	return await call('GET', _events(calendar, event_id), account, interactive=interactive, consent=consent)
+
+async def events_instances(event_id, account=None, calendar='primary', interactive=True, **params):
+	return await call('GET', _events(calendar, event_id, '/instances'), account, params, interactive=interactive)
+
+async def events_insert(body, account=None, calendar='primary', interactive=True, consent=None, **params):
+	return await call('POST', _events(calendar), account, params, body, interactive=interactive, consent=consent)
+
+async def events_patch(event_id, body, account=None, calendar='primary', etag=None, interactive=True, consent=None):
+	return await call(
+		'PATCH', _events(calendar, event_id), account, body=body, etag=etag, interactive=interactive, consent=consent,
+	)
+
+async def events_delete(event_id, account=None, calendar='primary', etag=None, interactive=True, consent=None):
+	return await call('DELETE', _events(calendar, event_id), account, etag=etag, interactive=interactive, consent=consent)
+
+def _tasks(task_id=None, suffix=''):
+	url = f'{TASKS_URL}/lists/@default/tasks'
+	if task_id is not None:
+		url += f"/{quote(task_id, safe='')}"
+	return url + suffix
+
+# tasks live on the primary account, like get_service('tasks')
+
+async def tasks_list(interactive=True, **params):
+	return await call('GET', _tasks(), params=params, interactive=interactive)
+
+async def tasks_get(task_id, interactive=True, consent=None):
+	return await call('GET', _tasks(task_id), interactive=interactive, consent=consent)
+
+async def tasks_insert(body, interactive=True, consent=None):
+	return await call('POST', _tasks(), body=body, interactive=interactive, consent=consent)
+
+async def tasks_patch(task_id, body, interactive=True, consent=None):
+	return await call('PATCH', _tasks(task_id), body=body, interactive=interactive, consent=consent)
+
+async def tasks_delete(task_id, interactive=True, consent=None):
+	return await call('DELETE', _tasks(task_id), interactive=interactive, consent=consent)
+
+async def tasks_move(task_id, previous=None, interactive=True, consent=None):
+	return await call(
+		'POST', _tasks(task_id, '/move'), params={'previous': previous}, interactive=interactive, consent=consent,
+	)
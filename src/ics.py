@@ -0,0 +1,259 @@
+'''Minimal iCalendar (RFC 5545) reader and writer for VEVENTs.
+
+Both sides stream: Parser takes text in arbitrary chunks and hands back each
+VEVENT as soon as its END line arrives, holding at most one event in memory;
+export() yields the calendar one VEVENT at a time. Only what maps onto a google
+event is kept - summary, description, location, times, RRULE/EXDATE, UID and
+RECURRENCE-ID.
+
+The mirror holds expanded occurrences, not series masters, so export writes each
+occurrence of a series as an event of its own under instance_uid(); importing
+the file back dedupes against those UIDs. A RECURRENCE-ID in an imported file
+names an override of a series: the import patches that occurrence when the
+series exists, and adds it on its own under instance_uid() otherwise.'''
+
+import re
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+ACCOUNT_PROP = 'X-AUTOCAL-ACCOUNT'
+FOLD_AT = 75
+
+def _unescape(value):
+	return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+def _escape(value):
+	return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+def _split(line):
+	'''"NAME;P1=a;P2=b:value" -> (NAME, {P1: a, P2: b}, value); quoted params may hold ':'.'''
+	name_end = re.search(r'[;:]', line)
+	if not name_end:
+		return line.upper(), {}, ''
+	name, rest, params = line[:name_end.start()].upper(), line[name_end.start():], {}
+	while rest.startswith(';'):
+		m = re.match(r';([^=;:]+)=("[^"]*"|[^;:]*)', rest)
+		if not m:
+			break
+		params[m.group(1).upper()] = m.group(2).strip('"')
+		rest = rest[m.end():]
+	return name, params, rest[1:] if rest.startswith(':') else rest
+
+DURATION = re.compile(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+def _duration(value):
+	m = DURATION.match(value.strip())
+	if not m:
+		return None
+	sign, weeks, days, hours, minutes, seconds = m.groups()
+	delta = timedelta(
+		weeks=int(weeks or 0), days=int(days or 0),
+		hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0),
+	)
+	return -delta if sign == '-' else delta
+
+def _when(params, value, default_tz):
+	'''DTSTART/DTEND -> (google start/end dict, naive-or-aware datetime for arithmetic).'''
+	value = value.strip()
+	if params.get('VALUE') == 'DATE' or re.fullmatch(r'\d{8}', value):
+		day = datetime.strptime(value[:8], '%Y%m%d')
+		return {'date': day.date().isoformat()}, day
+	utc = value.endswith('Z')
+	dt = datetime.strptime(value.rstrip('Z')[:15], '%Y%m%dT%H%M%S')
+	if utc:
+		dt = dt.replace(tzinfo=timezone.utc)
+		return {'dateTime': dt.isoformat().replace('+00:00', 'Z')}, dt
+	# TZID or floating: wall-clock time in that zone, resolved by google
+	return {'dateTime': dt.isoformat(), 'timeZone': params.get('TZID') or default_tz}, dt
+
+def _zone(name, default_tz):
+	try:
+		return ZoneInfo(name)
+	except (ZoneInfoNotFoundError, ValueError):
+		return ZoneInfo(default_tz)
+
+def _instant(params, value, default_tz):
+	'''DTSTART/RECURRENCE-ID -> comparable key: YYYYMMDD for dates, else the UTC
+	YYYYMMDDTHHMMSSZ form export writes.'''
+	when, dt = _when(params, value, default_tz)
+	if 'date' in when:
+		return dt.strftime('%Y%m%d')
+	if dt.tzinfo is None:
+		dt = dt.replace(tzinfo=_zone(when.get('timeZone'), default_tz))
+	return dt.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def instance_uid(uid, recurrence_id):
+	'''UID of one occurrence of a series written or imported as an event of its own.'''
+	return f'{uid}-{recurrence_id}'
+
+def original_start(recurrence_id):
+	'''_instant key -> RFC3339 (or date), for events.instances(originalStart=...).'''
+	if len(recurrence_id) == 8:
+		return datetime.strptime(recurrence_id, '%Y%m%d').date().isoformat()
+	return datetime.strptime(recurrence_id, '%Y%m%dT%H%M%SZ').strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _shift(when, base, delta):
+	out = base + delta
+	if 'date' in when:
+		return {'date': out.date().isoformat()}
+	return {**when, 'dateTime': out.isoformat().replace('+00:00', 'Z')}
+
+def _event(props, default_tz):
+	'''Collected VEVENT properties -> google event body for events.import, or None.'''
+	uid = props.get('UID', [(None, '')])[0][1].strip()
+	if 'DTSTART' not in props or not uid:
+		return None
+	start_params, start_value = props['DTSTART'][0]
+	start, start_dt = _when(start_params, start_value, default_tz)
+	if 'DTEND' in props:
+		end = _when(*props['DTEND'][0], default_tz)[0]
+	else:
+		delta = _duration(props.get('DURATION', [({}, '')])[0][1])
+		if delta is None:
+			delta = timedelta(days=1) if 'date' in start else timedelta()
+		end = _shift(start, start_dt, delta)
+	event = {'iCalUID': uid, 'start': start, 'end': end}
+	for name, key in (('SUMMARY', 'summary'), ('DESCRIPTION', 'description'), ('LOCATION', 'location')):
+		if name in props:
+			event[key] = _unescape(props[name][0][1])
+	recurrence = [f'{name}:{value}' for name in ('RRULE', 'RDATE', 'EXDATE') for _, value in props.get(name, [])]
+	if recurrence:
+		event['recurrence'] = recurrence
+	if 'RECURRENCE-ID' in props:
+		event['recurrenceId'] = _instant(*props['RECURRENCE-ID'][0], default_tz)
+	if ACCOUNT_PROP in props:
+		event['account'] = props[ACCOUNT_PROP][0][1].strip()
+	return event
+
+class Parser:
+	'''Incremental VEVENT reader: feed() text chunks (any split, folded lines
+	included), get back the events each chunk completed.'''
+	def __init__(self, default_tz):
+		self.default_tz = default_tz
+		self._tail = ''
+		self._line = None
+		self._props = None
+		self._depth = 0
+		self.skipped = 0
+
+	def feed(self, text):
+		out = []
+		lines = (self._tail + text).split('\n')
+		self._tail = lines.pop()
+		for raw in lines:
+			self._physical(raw.rstrip('\r'), out)
+		return out
+
+	def close(self):
+		out = []
+		if self._tail:
+			self._physical(self._tail.rstrip('\r'), out)
+			self._tail = ''
+		if self._line is not None:
+			self._logical(self._line, out)
+			self._line = None
+		return out
+
+	def _physical(self, raw, out):
+		if raw[:1] in (' ', '\t') and self._line is not None:
+			self._line += raw[1:]
+			return
+		if self._line is not None:
+			self._logical(self._line, out)
+		self._line = raw or None
+
+	def _logical(self, line, out):
+		name, params, value = _split(line)
+		if name == 'BEGIN':
+			if value.strip().upper() == 'VEVENT' and self._props is None:
+				self._props = {}
+			elif self._props is not None:
+				self._depth += 1  # VALARM and friends nest inside VEVENT
+		elif name == 'END' and self._props is not None:
+			if self._depth:
+				self._depth -= 1
+			elif value.strip().upper() == 'VEVENT':
+				try:
+					event = _event(self._props, self.default_tz)
+				except ValueError:
+					event = None
+				if event:
+					out.append(event)
+				else:
+					self.skipped += 1
+				self._props = None
+		elif self._props is not None and not self._depth:
+			self._props.setdefault(name, []).append((params, value))
+
+def _fold(line):
+	'''Splits a content line at FOLD_AT octets, never inside a UTF-8 sequence.'''
+	data = line.encode()
+	if len(data) <= FOLD_AT:
+		return line + '\r\n'
+	parts, start, limit = [], 0, FOLD_AT
+	while start < len(data):
+		end = min(len(data), start + limit)
+		while end < len(data) and (data[end] & 0xC0) == 0x80:
+			end -= 1
+		parts.append(data[start:end].decode())
+		start, limit = end, FOLD_AT - 1
+	return '\r\n '.join(parts) + '\r\n'
+
+def _stamp(raw, all_day):
+	'''Mirror start/end string -> (params, value); timed values go out in UTC.'''
+	if all_day:
+		return ';VALUE=DATE', raw.replace('-', '')[:8]
+	dt = datetime.fromisoformat(raw)
+	if dt.tzinfo:
+		return '', dt.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+	return '', dt.strftime('%Y%m%dT%H%M%S')
+
+def vevent(rec, dtstamp):
+	'''One mirror EventRecord as a folded VEVENT block. An occurrence of a series
+	gets instance_uid() of its series UID and start: a RECURRENCE-ID without the
+	master would make importers keep one occurrence per series.'''
+	params, value = _stamp(rec.start, rec.all_day)
+	uid = rec.iCalUID or rec.id
+	if rec.recurringEventId:
+		uid = instance_uid(uid, value)
+	lines = [
+		'BEGIN:VEVENT',
+		f'UID:{uid}',
+		f'DTSTAMP:{dtstamp}',
+		f'DTSTART{params}:{value}',
+		'DTEND%s:%s' % _stamp(rec.end, rec.all_day),
+	]
+	for name, field in (('SUMMARY', rec.summary), ('DESCRIPTION', rec.description), ('LOCATION', rec.location)):
+		if field:
+			lines.append(f'{name}:{_escape(field)}')
+	if rec.htmlLink:
+		lines.append(f'URL:{rec.htmlLink}')
+	if rec.account:
+		lines.append(f'{ACCOUNT_PROP}:{rec.account}')
+	lines.append('END:VEVENT')
+	return ''.join(_fold(line) for line in lines)
+
+def known(records):
+	'''(UIDs, {series UID: one of its occurrences}) of mirror records, for import
+	dedupe: each record's UID plus, for occurrences, the UID export gives them.'''
+	uids, series = set(), {}
+	for rec in records:
+		if not rec.iCalUID:
+			continue
+		uids.add(rec.iCalUID)
+		if rec.recurringEventId and rec.start:
+			try:
+				uids.add(instance_uid(rec.iCalUID, _stamp(rec.start, rec.all_day)[1]))
+			except ValueError:
+				pass
+			series.setdefault(rec.iCalUID, rec)
+	return uids, series
+
+def export(records):
+	'''Yields a VCALENDAR for an iterable of EventRecords, one VEVENT per chunk.'''
+	dtstamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+	yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//AutoCal//EN\r\nCALSCALE:GREGORIAN\r\n'
+	for rec in records:
+		if rec.start and rec.end:
+			yield vevent(rec, dtstamp)
+	yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,127 @@
+'''Priority lanes for google and disk work: 'ui' (HTTP handlers), 'agent' (tool
+calls) and 'sync' (refresh, reconcile, segment pulls).
+
+Each lane has its own bounded thread pool for blocking work (run) and its own
+concurrency limit for coroutine work such as gapi calls (slot), so a slow
+multi-account sync can only ever fill the sync lane: a click or a tool call never
+queues behind sync pages. Work is tagged with the lane of the context it runs in
+(a contextvar, 'ui' unless set); quota.py additionally puts interactive calls
+ahead of background ones on the same account. Per-lane depth and wait times are
+in /status; the counters are shared with the pool threads, so they change
+under the lane's lock.'''
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+LANE_SIZES = {'ui': 8, 'agent': 8, 'sync': 4}
+
+_current = contextvars.ContextVar('lane', default='ui')
+
+class _Lane:
+	def __init__(self, name, size):
+		self.name = name
+		self.size = size
+		self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'lane-{name}')
+		self.slots = asyncio.Semaphore(size)
+		self.lock = threading.Lock()
+		self.waiting = 0
+		self.running = 0
+		self.done = 0
+		self.wait_total = 0.0
+		self.wait_max = 0.0
+
+	def queued(self):
+		'''-> a ticket for started(), or for abandoned() if the work never starts.'''
+		with self.lock:
+			self.waiting += 1
+		return {'at': time.monotonic(), 'waiting': True}
+
+	def abandoned(self, ticket):
+		with self.lock:
+			if ticket['waiting']:
+				ticket['waiting'] = False
+				self.waiting -= 1
+
+	def started(self, ticket):
+		waited = time.monotonic() - ticket['at']
+		with self.lock:
+			if ticket['waiting']:
+				ticket['waiting'] = False
+				self.waiting -= 1
+			self.running += 1
+			self.wait_total += waited
+			self.wait_max = max(self.wait_max, waited)
+
+	def finished(self):
+		with self.lock:
+			self.running -= 1
+			self.done += 1
+
+_lanes = {name: _Lane(name, size) for name, size in LANE_SIZES.items()}
+
+def current():
+	return _current.get()
+
+@contextmanager
+def using(lane):
+	'''Tags work started inside the block (and tasks it creates) with a lane.'''
+	token = _current.set(lane)
+	try:
+		yield
+	finally:
+		_current.reset(token)
+
+async def run(fn, *args, lane=None):
+	'''asyncio.to_thread on the lane's own pool.'''
+	entry = _lanes[lane or current()]
+	ticket = entry.queued()
+	ctx = contextvars.copy_context()
+
+	def call():
+		entry.started(ticket)
+		try:
+			return ctx.run(fn, *args)
+		finally:
+			entry.finished()
+
+	try:
+		return await asyncio.get_running_loop().run_in_executor(entry.executor, call)
+	except BaseException:
+		# cancelled before a pool thread picked it up: it no longer waits
+		entry.abandoned(ticket)
+		raise
+
+@asynccontextmanager
+async def slot(lane=None):
+	'''One unit of the lane's concurrency for coroutine work.'''
+	entry = _lanes[lane or current()]
+	ticket = entry.queued()
+	try:
+		await entry.slots.acquire()
+	except BaseException:
+		entry.abandoned(ticket)
+		raise
+	entry.started(ticket)
+	try:
+		yield
+	finally:
+		entry.finished()
+		entry.slots.release()
+
+def _stats(lane):
+	with lane.lock:
+		return {
+			'size': lane.size,
+			'running': lane.running,
+			'queued': lane.waiting,
+			'done': lane.done,
+			'avgWaitMs': round(1000 * lane.wait_total / (lane.done + lane.running or 1), 1),
+			'maxWaitMs': round(1000 * lane.wait_max, 1),
+		}
+
+def stats():
+	return {name: _stats(lane) for name, lane in _lanes.items()}
@@ -0,0 +1,129 @@
+'''Week/day grid layout for the Calendar view, computed from the mirror.
+
+Each local day's timed events are split into overlap clusters (runs of events
+that transitively overlap) and packed greedily into columns, google-calendar
+style: an event takes the first column free at its start, and every event of a
+cluster is as wide as the cluster has columns. Blocks carry minutes from local
+midnight (clipped to the day, so multi-day events show on every day they
+touch) plus their column, and only the fields the grid reads.
+
+Layouts are cached per day. A day is laid out again only when its own records
+change: after any mirror mutation its records (from the mirror's day index) are
+compared against the ones the cached layout was built from.'''
+
+import re
+from datetime import datetime, time, timedelta
+
+from . import mirror, sync
+
+# what the grid and its detail pane read; descriptions are fetched on edit
+BLOCK_FIELDS = {'id', 'summary', 'location', 'colorId', 'start', 'end', 'htmlLink', 'hangoutLink', 'account', 'calendar', 'pending'}
+# shortest span an event occupies when deciding overlaps, so instants still get a column
+MIN_BLOCK_MINUTES = 15
+CACHE_DAYS = 120
+# same patterns as the frontend's meetLink, for links only written into the description
+MEET_RE = re.compile(r'''https://(?:[\w-]+\.)*(?:zoom\.us|teams\.microsoft\.com|teams\.live\.com|meet\.google\.com)/[^\s"'<>]+''', re.I)
+
+# 'YYYY-MM-DD' -> (mirror version, timezone, records signature, day layout)
+_cache: dict[str, tuple] = {}
+
+def _signature(records):
+	'''Everything about a day's records that shows up in its layout.'''
+	return tuple(sorted(
+		(
+			rec.account, rec.calendar or '', rec.id or '', rec.start or '', rec.end or '', rec.all_day,
+			rec.summary or '', rec.location or '', rec.colorId or '', rec.meet or '', rec.htmlLink or '',
+			rec.pending or '', rec.description or '',
+		)
+		for rec in records
+	))
+
+def _meet(rec):
+	if rec.meet:
+		return rec.meet
+	for text in (rec.location, rec.description):
+		found = MEET_RE.search(text or '')
+		if found:
+			return found.group(0).replace('&amp;', '&').rstrip(').,;')
+	return None
+
+def _minute(ts, lo, hi, zone):
+	'''Wall-clock minute of the day for an epoch time, clipped to [lo, hi).'''
+	if ts <= lo:
+		return 0
+	if ts >= hi:
+		return 24 * 60
+	local = datetime.fromtimestamp(ts, zone)
+	return local.hour * 60 + local.minute
+
+def _block(rec):
+	block = rec.to_dict(BLOCK_FIELDS)
+	meet = _meet(rec)
+	if meet:
+		block['hangoutLink'] = meet
+	return block
+
+def _layout(day, records, zone):
+	'''{date, blocks, allDay} for one local day.'''
+	lo = datetime.combine(day, time(), zone).timestamp()
+	hi = datetime.combine(day + timedelta(days=1), time(), zone).timestamp()
+	spans, all_day = [], []
+	for rec in records:
+		if rec.all_day:
+			all_day.append(_block(rec))
+		elif rec.start_ts is not None and rec.end_ts is not None:
+			top = _minute(rec.start_ts, lo, hi, zone)
+			spans.append((top, max(top, _minute(rec.end_ts, lo, hi, zone)), rec))
+
+	# earlier first, longer first on a tie, like the client used to
+	spans.sort(key=lambda span: (span[0], -span[1]))
+	blocks, cluster, column_ends, cluster_end = [], [], [], -1
+
+	def flush():
+		for block in cluster:
+			block['cols'] = len(column_ends)
+		blocks.extend(cluster)
+
+	for top, bottom, rec in spans:
+		if cluster and top >= cluster_end:
+			flush()
+			cluster, column_ends = [], []
+		reach = max(bottom, top + MIN_BLOCK_MINUTES)
+		col = next((i for i, end in enumerate(column_ends) if top >= end), len(column_ends))
+		if col == len(column_ends):
+			column_ends.append(reach)
+		else:
+			column_ends[col] = reach
+		cluster.append({**_block(rec), 'top': top, 'bottom': bottom, 'col': col})
+		cluster_end = reach if len(cluster) == 1 else max(cluster_end, reach)
+	flush()
+	return {'date': day.isoformat(), 'blocks': blocks, 'allDay': all_day}
+
+async def week(first, days=7):
+	'''Layouts of `days` local days from the date first. Raises HttpError if days
+	outside the mirror cannot be fetched.'''
+	zone = mirror.tz()
+	out, cached = [], 0
+	for n in range(days):
+		day = first + timedelta(days=n)
+		key = day.isoformat()
+		records = await sync.day_events(day)
+		version, tz_name = mirror.version(), str(zone)
+		entry = _cache.pop(key, None)
+		if entry and entry[:2] == (version, tz_name):
+			layout = entry[3]
+			cached += 1
+		else:
+			signature = _signature(records)
+			if entry and entry[1:3] == (tz_name, signature):
+				layout = entry[3]
+				cached += 1
+			else:
+				layout = _layout(day, records, zone)
+			entry = (version, tz_name, signature, layout)
+		# most recently used last; the oldest go past CACHE_DAYS
+		_cache[key] = entry
+		while len(_cache) > CACHE_DAYS:
+			_cache.pop(next(iter(_cache)))
+		out.append(layout)
+	return {'weekStart': first.isoformat(), 'timezone': str(zone), 'days': out, 'cached': cached}
@@ -0,0 +1,382 @@
+'''In-memory event mirror.
+
+Google event payloads are mostly noise to us (creator/organizer, etags of past
+revisions, reminders, conference plumbing), so the mirror keeps one compact
+EventRecord per event - only the fields the UI and agent read, account strings
+interned, times pre-parsed - and persists those rows to data/mirror.json. Payloads as
+fetched go to an append-only sidecar per section under data/payloads/ and are read
+back by offset only when something asks for the whole resource; sync pulls only ask
+google for the kept fields, so their records are flagged partial.
+
+Sections are the sync window ('events') and the on-demand month segments
+('YYYY-MM', see sync.py). Records come from every mirrored calendar of each
+account; calendar is None on the account's primary calendar and the calendar id
+otherwise, so (account, calendar, id) identifies one copy.'''
+
+import bisect
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from .store import DATA_DIR, file_stamp, get_cache, get_settings, load_file, process_lock, save_file
+
+WINDOW = 'events'
+MIRROR_FILE = 'mirror.json'
+PRIMARY = 'primary'
+
+class EventRecord:
+	'''Compact mirror entry. start/end hold the raw dateTime (or date, when
+	all_day) strings; start_ts/end_ts are epoch seconds, None if unparseable.'''
+	__slots__ = (
+		'id', 'account', 'summary', 'start', 'end', 'all_day', 'start_ts', 'end_ts',
+		'location', 'description', 'colorId', 'recurringEventId', 'iCalUID', 'etag',
+		'htmlLink', 'meet', 'offset', 'pending', 'partial', 'calendar',
+	)
+
+	# pending: the queued write (see outbox.py) not yet confirmed by google
+	# partial: pulled under sync.SYNC_FIELDS, so the payload holds only those fields
+	# calendar: the calendarList id, None for the account's primary calendar
+	OPTIONAL = ('summary', 'location', 'description', 'colorId', 'recurringEventId', 'iCalUID', 'etag', 'htmlLink', 'pending', 'partial', 'calendar')
+
+	@classmethod
+	def from_google(cls, ev, tz, account=None):
+		rec = cls()
+		start, end = ev.get('start') or {}, ev.get('end') or {}
+		rec.id = ev.get('id')
+		rec.account = sys.intern(account if account is not None else ev.get('account', ''))
+		rec.all_day = 'dateTime' not in start
+		rec.start = start.get('dateTime') or start.get('date')
+		rec.end = end.get('dateTime') or end.get('date')
+		for name in cls.OPTIONAL:
+			setattr(rec, name, ev.get(name) or None)
+		if rec.calendar == PRIMARY:
+			rec.calendar = None
+		rec.meet = ev.get('hangoutLink') or _video_uri(ev)
+		rec.offset = ev.get('offset')
+		rec.parse_times(tz)
+		return rec
+
+	def parse_times(self, tz):
+		self.start_ts = _timestamp(self.start, self.all_day, tz)
+		self.end_ts = _timestamp(self.end, self.all_day, tz)
+
+	def overlaps(self, lo, hi):
+		if self.start_ts is None or self.end_ts is None:
+			return True
+		return self.end_ts > lo and self.start_ts < hi
+
+	def to_dict(self, fields=None):
+		'''Google-shaped dict of the kept fields; fields optionally projects to a key subset.'''
+		key = 'date' if self.all_day else 'dateTime'
+		out = {'id': self.id, 'start': {key: self.start}, 'end': {key: self.end}, 'account': self.account}
+		for name in self.OPTIONAL:
+			value = getattr(self, name)
+			if value is not None:
+				out[name] = value
+		if self.meet:
+			out['hangoutLink'] = self.meet
+		if fields:
+			out = {k: v for k, v in out.items() if k in fields}
+		return out
+
+	def row(self):
+		return {**self.to_dict(), 'offset': self.offset}
+
+def _video_uri(ev):
+	for ep in (ev.get('conferenceData') or {}).get('entryPoints', []):
+		if ep.get('entryPointType') == 'video' and ep.get('uri'):
+			return ep['uri']
+	return None
+
+def _timestamp(raw, all_day, tz):
+	'''All-day dates pin to local midnight, like sync._boundary.'''
+	try:
+		dt = datetime.fromisoformat(raw)
+	except (TypeError, ValueError):
+		return None
+	if all_day or not dt.tzinfo:
+		dt = dt.replace(tzinfo=tz)
+	return dt.timestamp()
+
+_lock = threading.RLock()
+_sections: dict[str, dict] | None = None
+_tz_name = None
+_stamp = None
+_version = 0
+
+def _payload_path(name):
+	return os.path.join(DATA_DIR, 'payloads', f'{name}.jsonl')
+
+def _load():
+	'''Builds the in-memory sections from mirror.json on first use, and again whenever
+	another worker has rewritten it; re-parses all-day times if the configured
+	timezone has changed since.'''
+	global _sections, _tz_name, _stamp, _version
+	tz_name = get_settings()['timezone']
+	stamp = file_stamp(MIRROR_FILE)
+	with _lock:
+		if _sections is None or stamp != _stamp:
+			tz = ZoneInfo(tz_name)
+			with process_lock():
+				stamp = file_stamp(MIRROR_FILE)
+				# before the split into mirror.json the sections lived in cache.json
+				raw = load_file(MIRROR_FILE) or {WINDOW: get_cache(WINDOW), 'segments': get_cache('segments')}
+			_sections = {}
+			for name, payload in {WINDOW: raw.get(WINDOW), **(raw.get('segments') or {})}.items():
+				if payload:
+					_sections[name] = _section(payload, [EventRecord.from_google(ev, tz) for ev in payload.get('items', [])])
+			_tz_name, _stamp = tz_name, stamp
+			_version += 1
+		elif tz_name != _tz_name:
+			tz = ZoneInfo(tz_name)
+			for payload in _sections.values():
+				for rec in payload['items']:
+					rec.parse_times(tz)
+				payload['items'].sort(key=sort_key)
+			_tz_name = tz_name
+			_version += 1
+		return _sections
+
+def _section(payload, records):
+	records.sort(key=sort_key)
+	return {**{k: v for k, v in payload.items() if k != 'items'}, 'items': records}
+
+def sort_key(rec):
+	return rec.start_ts if rec.start_ts is not None else float('-inf')
+
+def _persist(names):
+	'''Writes the mirror's compact rows to mirror.json; callers hold process_lock()
+	from their _load() on, so no other worker's write lands in between.'''
+	global _version, _stamp
+	if not names:
+		return
+	_version += 1
+	save_file(MIRROR_FILE, {
+		WINDOW: _rows(_sections[WINDOW]) if WINDOW in _sections else None,
+		'segments': {k: _rows(v) for k, v in _sections.items() if k != WINDOW},
+	})
+	_stamp = file_stamp(MIRROR_FILE)
+
+def _rows(payload):
+	return {**payload, 'items': [rec.row() for rec in payload['items']]}
+
+def version():
+	'''Bumped on every mirror mutation, this worker's or (through the reload in
+	_load) another's; cheap invalidation key for derived views.'''
+	_load()
+	return _version
+
+def tz():
+	return ZoneInfo(_tz_name or get_settings()['timezone'])
+
+def section(name=WINDOW):
+	'''Section metadata plus its sorted records, or None if never fetched.'''
+	return _load().get(name)
+
+def segment_names():
+	return [name for name in _load() if name != WINDOW]
+
+_starts: dict[str, tuple] = {}
+
+def _start_index(name, items):
+	'''(version, start times, longest duration, unparseable count) for one section,
+	rebuilt after a mutation; lets query bisect instead of scanning the section.'''
+	cached = _starts.get(name)
+	if cached and cached[0] == _version and len(cached[1]) == len(items):
+		return cached
+	starts = [sort_key(rec) for rec in items]
+	span = max((rec.end_ts - rec.start_ts for rec in items if rec.start_ts is not None and rec.end_ts is not None), default=0)
+	untimed = bisect.bisect_right(starts, float('-inf'))
+	_starts[name] = cached = (_version, starts, span, untimed)
+	return cached
+
+def query(name, lo, hi):
+	'''Records of one section overlapping [lo, hi) epoch seconds. Nothing starting
+	before lo minus the section's longest event can overlap, so only the slice
+	between that and hi is checked.'''
+	with _lock:
+		payload = _load().get(name)
+		if not payload:
+			return []
+		items = payload['items']
+		_, starts, span, untimed = _start_index(name, items)
+		first = max(untimed, bisect.bisect_left(starts, lo - span))
+		last = bisect.bisect_left(starts, hi)
+		return items[:untimed] + [rec for rec in items[first:last] if rec.overlaps(lo, hi)]
+
+_days = (None, {})
+
+def _bucket(records, zone):
+	days = {}
+	for rec in records:
+		if rec.start_ts is None or rec.end_ts is None:
+			continue
+		first = datetime.fromtimestamp(rec.start_ts, zone).date()
+		# end is exclusive: an event ending at midnight does not touch the next day
+		last = datetime.fromtimestamp(max(rec.start_ts, rec.end_ts - 1), zone).date()
+		for n in range(min((last - first).days, 366) + 1):
+			days.setdefault((first + timedelta(days=n)).isoformat(), []).append(rec)
+	return days
+
+def day(date):
+	'''Window records overlapping one local day ('YYYY-MM-DD'), from a per-day bucket
+	index rebuilt lazily on the first lookup after a mirror mutation.'''
+	global _days
+	payload = section()
+	key = (_version, _tz_name)
+	if _days[0] != key:
+		_days = (key, _bucket(payload['items'] if payload else [], tz()))
+	return list(_days[1].get(date, ()))
+
+_calendars = (None, {})
+
+def calendar_key(rec):
+	'''(account, calendar id) of a record, 'primary' for the primary calendar.'''
+	return rec.account, rec.calendar or PRIMARY
+
+def by_calendar():
+	'''Window records per (account, calendar id), rebuilt lazily after a mutation.'''
+	global _calendars
+	payload = section()
+	if _calendars[0] != _version:
+		index = {}
+		for rec in payload['items'] if payload else ():
+			index.setdefault(calendar_key(rec), []).append(rec)
+		_calendars = (_version, index)
+	return _calendars[1]
+
+def kept(rec, keep):
+	'''Whether keep (emails and (email, calendar id) pairs) covers a record.'''
+	return rec.account in keep or calendar_key(rec) in keep
+
+def all_records():
+	'''Every mirrored record once, window first, then segments outside it.'''
+	seen = set()
+	for payload in list(_load().values()):
+		for rec in payload['items']:
+			if (rec.id, rec.account, rec.calendar) not in seen:
+				seen.add((rec.id, rec.account, rec.calendar))
+				yield rec
+
+def _read_payload(name, rec):
+	if rec.offset is None:
+		return None
+	try:
+		with open(_payload_path(name), 'rb') as f:
+			f.seek(rec.offset)
+			full = json.loads(f.readline())
+	except (OSError, ValueError):
+		return None
+	# a crash between the sidecar and mirror.json writes can leave offsets pointing elsewhere
+	return full if isinstance(full, dict) and full.get('id') == rec.id else None
+
+def replace(name, items, meta, keep=()):
+	'''Swaps one section for freshly fetched google payloads. Records of the
+	accounts and (account, calendar id) pairs in keep (their fetch failed) carry
+	over from the old section, payloads included.'''
+	with _lock, process_lock():
+		sections = _load()
+		tz = ZoneInfo(_tz_name)
+		old = sections.get(name)
+		carried = [
+			(rec, _read_payload(name, rec))
+			for rec in (old or {}).get('items', []) if kept(rec, keep)
+		]
+		path = _payload_path(name)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		records = []
+		with open(f'{path}.tmp', 'wb') as f:
+			for ev in items:
+				rec = EventRecord.from_google(ev, tz)
+				rec.offset = f.tell()
+				f.write(json.dumps(ev).encode() + b'\n')
+				records.append(rec)
+			for rec, full in carried:
+				rec.offset = None
+				if full is not None:
+					rec.offset = f.tell()
+					f.write(json.dumps(full).encode() + b'\n')
+				records.append(rec)
+		os.replace(f'{path}.tmp', path)
+		sections[name] = _section(meta, records)
+		_persist([name])
+
+def drop(name):
+	with _lock, process_lock():
+		if _load().pop(name, None) is None:
+			return
+		try:
+			os.remove(_payload_path(name))
+		except FileNotFoundError:
+			pass
+		_persist([name])
+
+def _append_payload(name, ev):
+	path = _payload_path(name)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, 'ab') as f:
+		offset = f.tell()
+		f.write(json.dumps(ev).encode() + b'\n')
+	return offset
+
+def apply(upserts=(), removals=()):
+	'''Bulk write-through, persisted once. removals drop events by id, a recurring
+	master's expanded instances (ids like '<master>_<start>') with it. Each upserted
+	event replaces its copies on the same calendar everywhere and lands in the window
+	plus, when its start month is cached as a segment, that segment. No-op for
+	never-synced sections.'''
+	with _lock, process_lock():
+		sections = _load()
+		zone = ZoneInfo(_tz_name)
+		records = [EventRecord.from_google(ev, zone) for ev in upserts]
+		replaced = {(rec.id, rec.calendar) for rec in records}
+		drop_ids = set(removals)
+		prefixes = tuple(f'{event_id}_' for event_id in removals)
+		touched = []
+		for name, payload in sections.items():
+			items = [
+				r for r in payload['items']
+				if (r.id, r.calendar) not in replaced and r.id not in drop_ids
+				and not (prefixes and str(r.id or '').startswith(prefixes))
+			]
+			changed = len(items) != len(payload['items'])
+			for rec, event in zip(records, upserts):
+				# segments are keyed by local month; the start's own offset is close enough,
+				# and a misfiled edge-of-month event heals on the segment's next refetch
+				if name in (WINDOW, (rec.start or '')[:7]):
+					copy = EventRecord.from_google(rec.to_dict(), zone)
+					copy.offset = _append_payload(name, event)
+					items.append(copy)
+					changed = True
+			if changed:
+				items.sort(key=sort_key)
+				payload['items'] = items
+				touched.append(name)
+		_persist(touched)
+
+def upsert_event(event):
+	'''Write-through after a create/edit; see apply.'''
+	apply(upserts=[event])
+
+def remove_event(event_id):
+	apply(removals=[event_id])
+
+def full_event(event_id, account=None):
+	'''The google payload of a mirrored event, read lazily from its section's
+	sidecar; None if the event is not mirrored. Flagged partial when it was synced
+	under the field mask - sync.full_event fetches the rest. Carries calendar when
+	the event is not on the primary calendar.'''
+	with _lock:
+		for name, payload in _load().items():
+			for rec in payload['items']:
+				if rec.id == event_id and (account is None or rec.account == account):
+					full = _read_payload(name, rec)
+					if full is None:
+						return rec.to_dict()
+					full = {**full, 'account': rec.account}
+					full.pop('calendar', None)
+					return {**full, 'calendar': rec.calendar} if rec.calendar else full
+	return None
@@ -0,0 +1,327 @@
+'''Durable write-ahead queue for UI writes.
+
+POST/PATCH/DELETE on /events and /tasks apply to the mirror at once, marked
+pending, and queue the google call here (data/outbox.json) instead of waiting on
+it; the UI no longer blocks on google, and keeps working offline. The worker
+running the sync loop flushes the queue: per resource strictly in order, with
+different resources in parallel. Transport and server errors retry with capped
+exponential backoff; anything google rejects outright is dropped, reverted in
+the mirror and reported in the activity log and /status.
+
+Event creates carry their own id (a valid google event id), so a retried create
+is idempotent. Task creates get a local id until google assigns the real one;
+later writes to the task are rewritten to it, and aliases keep the local id
+usable. Edits and deletes carry the etag they were made against: a calendar
+write goes out with If-Match, a task write compares etags first (the tasks API
+has no If-Match), and a mismatch is a conflict - google's version wins and is
+refetched.'''
+
+import asyncio
+import time
+import uuid
+from datetime import datetime
+
+from googleapiclient.errors import HttpError
+
+from . import gapi, lanes, mirror, quota
+from .accounts import NeedsConsent
+from .store import cache_remove_task, cache_upsert_task, load_file, log_activity, process_lock, save_file
+
+OUTBOX_FILE = 'outbox.json'
+LOCAL_PREFIX = 'local'
+RETRY_BASE_SECONDS = 2.0
+RETRY_CAP_SECONDS = 300.0
+RETRY_MAX_DOUBLINGS = 16
+POLL_SECONDS = 1.0
+FAILED_KEPT = 20
+ALIASES_KEPT = 500
+
+_wake = asyncio.Event()
+
+def _sync():
+	from . import sync  # lazy: sync imports this module
+	return sync
+
+def _state():
+	state = load_file(OUTBOX_FILE) or {}
+	return {'ops': state.get('ops', []), 'aliases': state.get('aliases', {}), 'failed': state.get('failed', [])}
+
+def _mutate(fn):
+	'''fn(state) under the cross-process lock, persisted; returns fn's result.'''
+	with process_lock():
+		state = _state()
+		result = fn(state)
+		save_file(OUTBOX_FILE, state)
+		return result
+
+def local_id():
+	return f'{LOCAL_PREFIX}{uuid.uuid4().hex}'
+
+def is_local(resource_id):
+	return resource_id.startswith(LOCAL_PREFIX)
+
+def resolve(resource_id):
+	'''Real google id for a local id whose create has flushed; anything else as is.'''
+	if not is_local(resource_id):
+		return resource_id
+	return _state()['aliases'].get(resource_id, resource_id)
+
+def push(api, op, account, resource, body=None, etag=None, local=None, **extra):
+	'''Queues one write. local is the optimistic resource as written to the mirror,
+	replayed by overlay() if a refresh lands before the flush. A delete of a
+	never-flushed create cancels it instead; a patch to one folds into it.'''
+	entry = {
+		'id': uuid.uuid4().hex, 'api': api, 'op': op, 'account': account, 'resource': resource,
+		'body': body or {}, 'etag': etag, 'local': local, 'queuedAt': datetime.now().isoformat(timespec='seconds'),
+		'attempts': 0, 'nextAttempt': 0, 'error': None, 'inflight': False, **extra,
+	}
+
+	def fn(state):
+		queued = [o for o in state['ops'] if o['api'] == api and o['resource'] == resource]
+		create = next((o for o in queued if o['op'] == 'insert' and not o['inflight']), None)
+		if create and op == 'delete':
+			state['ops'] = [o for o in state['ops'] if o not in queued]
+			return
+		if create and op == 'patch':
+			create['body'].update(entry['body'])
+			create['local'] = local or create['local']
+			return
+		state['ops'].append(entry)
+
+	_mutate(fn)
+	_wake.set()
+
+def overlay():
+	'''Re-applies queued optimistic writes on top of freshly pulled data.'''
+	ops = _state()['ops']
+	events = [o for o in ops if o['api'] == 'calendar']
+	upserts = [o['local'] for o in events if o['local'] and o['op'] != 'delete']
+	removals = [o['resource'] for o in events if o['op'] == 'delete']
+	if upserts or removals:
+		mirror.apply(upserts=upserts, removals=removals)
+	for o in ops:
+		if o['api'] != 'tasks':
+			continue
+		if o['op'] == 'delete':
+			cache_remove_task(o['resource'])
+		elif o['local']:
+			cache_upsert_task(o['local'])
+
+class Conflict(Exception):
+	pass
+
+def _calendar(op):
+	'''The calendar a calendar op targets; ops queued before calendars were tracked are primary.'''
+	return op.get('calendar') or mirror.PRIMARY
+
+async def _execute(op):
+	'''Sends one queued op to google -> the resulting resource ('' for deletes).
+	User writes keep the interactive quota priority, but the flusher runs in the
+	background: an account needing consent raises NeedsConsent, never a browser.'''
+	aliases = (await lanes.run(_state))['aliases']
+	resource = aliases.get(op['resource'], op['resource'])
+	if op['api'] == 'calendar':
+		account, calendar = op['account'], _calendar(op)
+		if op['op'] == 'insert':
+			try:
+				return await gapi.events_insert(op['body'], account, calendar, consent=False)
+			except HttpError as error:
+				if error.resp.status != 409:
+					raise
+				# an earlier attempt landed before we heard back
+				return await gapi.events_get(resource, account, calendar, consent=False)
+		if op['op'] == 'patch':
+			return await gapi.events_patch(resource, op['body'], account, calendar, etag=op['etag'], consent=False)
+		return await gapi.events_delete(resource, account, calendar, etag=op['etag'], consent=False)
+	if op['op'] == 'insert':
+		return await gapi.tasks_insert(op['body'], consent=False)
+	if op['etag'] and op['op'] in ('patch', 'delete'):
+		current = await gapi.tasks_get(resource, consent=False)
+		if current.get('etag') != op['etag']:
+			raise Conflict()
+	if op['op'] == 'patch':
+		return await gapi.tasks_patch(resource, op['body'], consent=False)
+	if op['op'] == 'move':
+		return await gapi.tasks_move(resource, aliases.get(op.get('previous'), op.get('previous')), consent=False)
+	return await gapi.tasks_delete(resource, consent=False)
+
+def _outcome(op, error):
+	''''conflict', 'gone', 'rejected' (dropped), 'parked' (until the account is
+	re-linked) or 'retry' for a failed op.'''
+	if isinstance(error, Conflict):
+		return 'conflict'
+	if isinstance(error, NeedsConsent):
+		return 'parked'
+	if not isinstance(error, HttpError):
+		return 'retry'  # offline, no account linked yet
+	if quota.is_rate_limited(error):
+		return 'retry'  # quota gave up backing off; the write itself is fine
+	status = error.resp.status
+	if status == 412:
+		return 'conflict'
+	if status in (404, 410):
+		return 'gone'
+	if status in (408, 429) or status >= 500:
+		return 'retry'
+	return 'rejected'
+
+def _label(op):
+	kind = 'EVT' if op['api'] == 'calendar' else 'TASK'
+	name = (op['local'] or {}).get('summary') or (op['local'] or {}).get('title') or op['resource']
+	return f'{kind} {op["op"]} {name}'
+
+async def _succeeded(op, result):
+	sync = _sync()
+	real = (result or {}).get('id')
+
+	def fn(state):
+		state['ops'] = [o for o in state['ops'] if o['id'] != op['id']]
+		for o in state['ops']:
+			if o['api'] != op['api'] or o['resource'] != op['resource']:
+				continue
+			if op['op'] == 'insert' and real:
+				o['resource'] = real
+			# later writes were made on top of this one, not against google's old copy
+			if o['etag'] and result and result.get('etag'):
+				o['etag'] = result['etag']
+		if op['op'] == 'insert' and real:
+			state['aliases'][op['resource']] = real
+			while len(state['aliases']) > ALIASES_KEPT:
+				state['aliases'].pop(next(iter(state['aliases'])))
+
+	await lanes.run(_mutate, fn)
+	if op['api'] == 'calendar':
+		if op['op'] == 'delete':
+			sync.event_deleted(op['resource'], op['account'], _calendar(op))
+		else:
+			sync.event_written({**result, 'account': op['account'], 'calendar': _calendar(op)})
+	else:
+		if op['op'] == 'insert':
+			cache_remove_task(op['resource'])
+		if op['op'] == 'delete':
+			sync.task_deleted(op['resource'])
+		else:
+			sync.task_written(result)
+
+async def _failed(op, error, outcome):
+	sync = _sync()
+	if outcome in ('retry', 'parked'):
+		def fn(state):
+			for o in state['ops']:
+				if o['id'] == op['id']:
+					o['attempts'] += 1
+					o['inflight'] = False
+					o['error'] = str(error)[:300]
+					o['parked'] = outcome == 'parked'
+					delay = RETRY_BASE_SECONDS * 2 ** min(o['attempts'], RETRY_MAX_DOUBLINGS)
+					o['nextAttempt'] = time.time() + (RETRY_CAP_SECONDS if o['parked'] else min(RETRY_CAP_SECONDS, delay))
+		await lanes.run(_mutate, fn)
+		return
+	if outcome == 'gone' and op['op'] == 'delete':
+		await _succeeded(op, None)
+		return
+	reason = {'conflict': 'changed on google, local write discarded', 'gone': 'no longer exists on google'}.get(outcome, str(error)[:200])
+
+	def fn(state):
+		# with the head dropped, what was queued on top of it cannot apply either
+		dropped = [o for o in state['ops'] if o['api'] == op['api'] and o['resource'] == op['resource']]
+		state['ops'] = [o for o in state['ops'] if o not in dropped]
+		state['failed'] = (state['failed'] + [{
+			'op': op['op'], 'api': op['api'], 'resource': op['resource'], 'queuedAt': op['queuedAt'],
+			'at': datetime.now().isoformat(timespec='seconds'), 'outcome': outcome, 'reason': reason,
+			'dropped': len(dropped),
+		}])[-FAILED_KEPT:]
+
+	await lanes.run(_mutate, fn)
+	log_activity('CONFLICT' if outcome == 'conflict' else 'FAILED', f'{_label(op)} // {reason}', 'ui')
+	# put the mirror back to google's version of the resource
+	if op['op'] == 'insert':
+		if op['api'] == 'calendar':
+			mirror.remove_event(op['resource'])
+		else:
+			cache_remove_task(op['resource'])
+	elif op['api'] == 'calendar':
+		if outcome == 'gone':
+			sync.event_deleted(op['resource'], op['account'], _calendar(op))
+		else:
+			sync.event_stale(op['resource'], op['account'], _calendar(op))
+	else:
+		if outcome == 'gone':
+			sync.task_deleted(op['resource'])
+		else:
+			sync.task_stale(op['resource'])
+
+async def _flush_one(op):
+	def fn(state):
+		for o in state['ops']:
+			if o['id'] == op['id']:
+				o['inflight'] = True
+
+	await lanes.run(_mutate, fn)
+	try:
+		result = await _execute(op)
+	except Exception as error:
+		outcome = _outcome(op, error)
+		if outcome != 'retry':
+			print(f'[outbox] {_label(op)} {outcome}: {error}')
+		await _failed(op, error, outcome)
+		return False
+	await _succeeded(op, result)
+	return True
+
+async def flush():
+	'''One pass: the oldest queued op of every resource that is due. -> ops done.'''
+	now = time.time()
+	heads = {}
+	for op in (await lanes.run(_state))['ops']:
+		heads.setdefault((op['api'], op['resource']), op)
+	due = [op for op in heads.values() if op['nextAttempt'] <= now]
+	done = await asyncio.gather(*(_flush_one(op) for op in due))
+	return sum(done)
+
+async def flush_loop():
+	'''Runs beside the sync loop in the leader worker; others only queue.'''
+	sync = _sync()
+	while not sync.is_leader():
+		await asyncio.sleep(sync.LEADER_RETRY_SECONDS)
+	# whatever a previous run left in flight goes out again
+	def fn(state):
+		for o in state['ops']:
+			o['inflight'] = False
+
+	await lanes.run(_mutate, fn)
+	while True:
+		try:
+			if await flush():
+				continue
+		except Exception as e:
+			print(f'[outbox] flush failed: {e}')
+		_wake.clear()
+		try:
+			await asyncio.wait_for(_wake.wait(), POLL_SECONDS)
+		except asyncio.TimeoutError:
+			pass
+
+async def unpark():
+	'''Sends writes parked on a consent-needing account again, after a re-link.'''
+	def fn(state):
+		for o in state['ops']:
+			if o.get('parked'):
+				o['parked'] = False
+				o['nextAttempt'] = 0
+
+	await lanes.run(_mutate, fn)
+	_wake.set()
+
+def stats():
+	state = _state()
+	ops = state['ops']
+	retrying = [o for o in ops if o['attempts']]
+	return {
+		'pending': len(ops),
+		'retrying': len(retrying),
+		'parked': sum(1 for o in ops if o.get('parked')),
+		'oldestQueuedAt': min((o['queuedAt'] for o in ops), default=None),
+		'lastError': max(retrying, key=lambda o: o['attempts'])['error'] if retrying else None,
+		'failed': state['failed'][-5:],
+	}
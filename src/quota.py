@@ -0,0 +1,211 @@
+'''Client-side rate limiting for google API calls.
+
+Every request that leaves for google goes through execute(). Per account, a
+token bucket paces calls, an adaptive (AIMD) limit caps how many are in flight -
+halved on a rate-limit response, regrown slowly on success - and rate-limited
+calls retry with jittered exponential backoff that honors Retry-After, as do
+coroutine requests that could not connect at all (nothing was sent, so even an
+insert is safe to resend).
+Interactive callers (UI, agent) always go ahead of background sync on the same
+account, and one in-flight slot is held back for them. execute_async is the same
+guard for the coroutine requests of gapi.py.'''
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+from googleapiclient.errors import HttpError
+
+RATE_PER_SECOND = 8.0
+BURST = 10
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 8
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 32.0
+MAX_RETRIES = 5
+CONNECT_RETRIES = 2
+ASYNC_POLL_SECONDS = 0.01
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+class _Account:
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.tokens = float(BURST)
+		self.stamp = time.monotonic()
+		self.limit = float(MAX_CONCURRENCY) / 2
+		self.inflight = 0
+		self.waiting_interactive = 0
+		self.blocked_until = 0.0
+		self.throttled = 0
+
+	def _refill(self, now):
+		self.tokens = min(BURST, self.tokens + (now - self.stamp) * RATE_PER_SECOND)
+		self.stamp = now
+
+	def _wait_for(self, interactive, now):
+		'''Seconds until this caller may go (0 = now), None to wait for a release.'''
+		if now < self.blocked_until:
+			return self.blocked_until - now
+		if not interactive and self.waiting_interactive:
+			return None
+		# background sync never takes the last slot
+		cap = int(self.limit) if interactive else max(MIN_CONCURRENCY, int(self.limit) - 1)
+		if self.inflight >= cap:
+			return None
+		self._refill(now)
+		if self.tokens < 1:
+			return (1 - self.tokens) / RATE_PER_SECOND
+		return 0
+
+	def acquire(self, interactive):
+		with self.cond:
+			if interactive:
+				self.waiting_interactive += 1
+			try:
+				while True:
+					wait = self._wait_for(interactive, time.monotonic())
+					if wait == 0:
+						break
+					self.cond.wait(wait)
+				self.tokens -= 1
+				self.inflight += 1
+			finally:
+				if interactive:
+					self.waiting_interactive -= 1
+
+	async def acquire_async(self, interactive):
+		'''acquire() for the event loop: polls for a slot instead of blocking a thread.'''
+		with self.cond:
+			if interactive:
+				self.waiting_interactive += 1
+		try:
+			while True:
+				with self.cond:
+					wait = self._wait_for(interactive, time.monotonic())
+					if wait == 0:
+						self.tokens -= 1
+						self.inflight += 1
+						return
+				await asyncio.sleep(ASYNC_POLL_SECONDS if wait is None else wait)
+		finally:
+			if interactive:
+				with self.cond:
+					self.waiting_interactive -= 1
+
+	def release(self, throttled=False, retry_after=None):
+		with self.cond:
+			self.inflight -= 1
+			if throttled:
+				self.throttled += 1
+				self.limit = max(MIN_CONCURRENCY, self.limit / 2)
+				if retry_after:
+					self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+			else:
+				self.limit = min(MAX_CONCURRENCY, self.limit + 1 / self.limit)
+			self.cond.notify_all()
+
+_accounts: dict[str, _Account] = {}
+_accounts_lock = threading.Lock()
+
+def _account(key):
+	with _accounts_lock:
+		if key not in _accounts:
+			_accounts[key] = _Account()
+		return _accounts[key]
+
+def is_rate_limited(error):
+	status = error.resp.status
+	if status == 429:
+		return True
+	return status == 403 and any(r in (error.content or b'') for r in RATE_LIMIT_REASONS)
+
+def _retry_after(error):
+	value = error.resp.get('retry-after')
+	if not value:
+		return None
+	try:
+		return max(0.0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return None
+
+def _backoff(attempt, retry_after):
+	delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+	return max(delay, retry_after or 0)
+
+def execute(request, account='', interactive=True):
+	'''request.execute() under the account's quota; blocking, so run it off the event loop.
+	Rate-limit errors are retried; anything else (or a final rate limit) raises as before.'''
+	acct = _account(account or '')
+	attempt = 0
+	while True:
+		acct.acquire(interactive)
+		try:
+			result = request.execute()
+		except HttpError as error:
+			if not is_rate_limited(error):
+				acct.release()
+				raise
+			retry_after = _retry_after(error)
+			acct.release(throttled=True, retry_after=retry_after)
+			if attempt >= MAX_RETRIES:
+				raise
+			time.sleep(_backoff(attempt, retry_after))
+			attempt += 1
+			continue
+		except BaseException:
+			acct.release()
+			raise
+		acct.release()
+		return result
+
+async def execute_async(send, account='', interactive=True):
+	'''execute() for a coroutine function sending one request; no thread is held
+	while it waits for quota, backs off or is in flight.'''
+	acct = _account(account or '')
+	attempt = 0
+	while True:
+		await acct.acquire_async(interactive)
+		try:
+			result = await send()
+		except HttpError as error:
+			if not is_rate_limited(error):
+				acct.release()
+				raise
+			retry_after = _retry_after(error)
+			acct.release(throttled=True, retry_after=retry_after)
+			if attempt >= MAX_RETRIES:
+				raise
+			await asyncio.sleep(_backoff(attempt, retry_after))
+			attempt += 1
+			continue
+		except (httpx.ConnectError, httpx.ConnectTimeout):
+			acct.release()
+			if attempt >= CONNECT_RETRIES:
+				raise
+			await asyncio.sleep(_backoff(attempt, None))
+			attempt += 1
+			continue
+		except BaseException:
+			acct.release()
+			raise
+		acct.release()
+		return result
+
+def stats():
+	with _accounts_lock:
+		items = list(_accounts.items())
+	return {
+		key or 'primary': {
+			'limit': round(acct.limit, 2),
+			'inflight': acct.inflight,
+			'throttled': acct.throttled,
+		}
+		for key, acct in items
+	}
@@ -0,0 +1,187 @@
+'''Offline replay of a recorded trace (see trace.py) through the agent tool layer.
+
+	python -m src.replay TRACE [--scale 1.0] [--json]
+
+Starts from the trace's mirror, accounts and settings in a scratch data dir,
+answers google from the recorded responses (matched by method and URL, in
+recorded order) and calls the tools in agent.CALENDAR_TOOLS directly: no model,
+no network, nothing touched in data/. --scale stretches the recorded think time
+and google latency: 1 replays the original timing, 0.1 runs ten times faster, 0
+runs the calls back to back. Reports per-tool latency, bytes returned to the
+model and how many calls the mirror answered without google, next to the
+recorded numbers.'''
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+import httpx
+
+def load(path):
+	'''(header, events) of a trace file.'''
+	with open(path, 'rb') as f:
+		lines = [json.loads(line) for line in f if line.strip()]
+	if not lines or lines[0].get('type') != 'start':
+		raise SystemExit(f'{path}: not a trace (no start header)')
+	return lines[0], lines[1:]
+
+class FakeGoogle:
+	'''Recorded responses per (method, URL), served in order; the last one repeats.'''
+	def __init__(self, events, scale):
+		self.responses = defaultdict(deque)
+		for ev in events:
+			if ev['type'] == 'google':
+				self.responses[(ev['method'], ev['url'])].append(ev)
+		self.scale = scale
+		self.served = 0
+		self.unmatched = []
+
+	async def handle(self, request):
+		queue = self.responses.get((request.method, str(request.url)))
+		if not queue:
+			self.unmatched.append(f'{request.method} {request.url}')
+			return httpx.Response(404, json={'error': {'code': 404, 'message': 'not in trace'}})
+		ev = queue.popleft() if len(queue) > 1 else queue[0]
+		self.served += 1
+		if self.scale:
+			await asyncio.sleep(ev['ms'] / 1000 * self.scale)
+		if ev['body'] == '':
+			return httpx.Response(ev['status'])
+		return httpx.Response(ev['status'], json=ev['body'])
+
+def _prepare(header):
+	'''Scratch data dir holding the recorded state; must run before store is imported.'''
+	data = tempfile.mkdtemp(prefix='autocal-replay-')
+	os.environ['AUTOCAL_DATA_DIR'] = data
+	os.environ['AUTOCAL_TRACE'] = ''  # a replay is not recorded
+	state = header.get('mirror') or {}
+	for payload in [state.get('events')] + list((state.get('segments') or {}).values()):
+		# the payload sidecars are not in the trace; full payloads come from google
+		for row in (payload or {}).get('items', []):
+			row['offset'] = None
+	files = {
+		'mirror.json': state,
+		'settings.json': header.get('settings') or {},
+		'accounts.json': [{**a, 'token': 'replay'} for a in header.get('accounts', [])],
+	}
+	for name, content in files.items():
+		with open(os.path.join(data, name), 'w') as f:
+			json.dump(content, f)
+	return data
+
+async def replay(header, events, scale):
+	'''Drives every recorded tool call -> (per-call results, the fake backend).'''
+	from . import agent, gapi, sync  # lazy: after _prepare has pointed the store at the scratch dir
+
+	fake = FakeGoogle(events, scale)
+	gapi.TRANSPORT = httpx.MockTransport(fake.handle)
+	# the recording's clock, so segment freshness and boot staleness play out as they did
+	recorded_at, origin = datetime.fromisoformat(header['at']), time.monotonic()
+	sync._now = lambda: recorded_at + timedelta(seconds=time.monotonic() - origin)
+	sync._booted_at = datetime.fromisoformat(header['bootedAt'])
+
+	tools = {t.name: t for t in agent.CALENDAR_TOOLS}
+	calls = [ev for ev in events if ev['type'] == 'tool']
+	results = []
+
+	async def run(ev):
+		tool = tools.get(ev['name'])
+		if tool is None:
+			print(f"[replay] no tool {ev['name']}, skipped", file=sys.stderr)
+			return
+		with gapi.metered({}) as meter:
+			started = time.monotonic()
+			result = await tool.handler(ev['args'])
+			ms = 1000 * (time.monotonic() - started)
+		results.append({
+			'name': ev['name'], 'ms': ms, 'bytes': agent._result_bytes(result), 'google': meter.get('requests', 0),
+			'recordedMs': ev.get('ms', 0), 'recordedBytes': ev.get('bytes', 0),
+		})
+
+	# tool lines are stamped when the call returned
+	calls.sort(key=lambda ev: ev['t'] - ev.get('ms', 0) / 1000)
+	started, first = time.monotonic(), (calls[0]['t'] - calls[0].get('ms', 0) / 1000) if calls else 0
+	tasks = []
+	for ev in calls:
+		if not scale:
+			await run(ev)
+			continue
+		at = ev['t'] - ev.get('ms', 0) / 1000 - first
+		await asyncio.sleep(max(0.0, started + at * scale - time.monotonic()))
+		tasks.append(asyncio.create_task(run(ev)))
+	await asyncio.gather(*tasks)
+	return results, fake
+
+def _pct(values, q):
+	'''Nearest-rank percentile.'''
+	values = sorted(values)
+	return values[max(0, math.ceil(q * len(values)) - 1)] if values else 0.0
+
+def summarize(results, fake):
+	tools = {}
+	by_name = defaultdict(list)
+	for r in results:
+		by_name[r['name']].append(r)
+	for name, rows in sorted(by_name.items()):
+		ms = [r['ms'] for r in rows]
+		hits = sum(not r['google'] for r in rows)
+		tools[name] = {
+			'calls': len(rows),
+			'p50Ms': round(_pct(ms, 0.5), 2),
+			'p95Ms': round(_pct(ms, 0.95), 2),
+			'maxMs': round(max(ms), 2),
+			'recordedP50Ms': round(_pct([r['recordedMs'] for r in rows], 0.5), 2),
+			'avgBytes': round(sum(r['bytes'] for r in rows) / len(rows)),
+			'recordedAvgBytes': round(sum(r['recordedBytes'] for r in rows) / len(rows)),
+			'googleCalls': sum(r['google'] for r in rows),
+			'mirrorHitRate': round(hits / len(rows), 3),
+		}
+	total = len(results) or 1
+	return {
+		'tools': tools,
+		'calls': len(results),
+		'mirrorHitRate': round(sum(not r['google'] for r in results) / total, 3),
+		'bytesToModel': sum(r['bytes'] for r in results),
+		'googleServed': fake.served,
+		'googleUnmatched': len(fake.unmatched),
+	}
+
+def _print(summary):
+	cols = ('calls', 'p50Ms', 'p95Ms', 'maxMs', 'recordedP50Ms', 'avgBytes', 'recordedAvgBytes', 'googleCalls', 'mirrorHitRate')
+	print(f"{'tool':<20}" + ''.join(f'{c:>17}' for c in cols))
+	for name, row in summary['tools'].items():
+		print(f'{name:<20}' + ''.join(f'{row[c]:>17}' for c in cols))
+	print(
+		f"\n{summary['calls']} calls, mirror hit rate {summary['mirrorHitRate']:.1%}, "
+		f"{summary['bytesToModel']} bytes to the model, google: {summary['googleServed']} served "
+		f"from the trace, {summary['googleUnmatched']} not in it"
+	)
+
+def main():
+	parser = argparse.ArgumentParser(description='Replay a recorded AutoCal trace through the agent tools, offline.')
+	parser.add_argument('trace')
+	parser.add_argument('--scale', type=float, default=1.0, help='timing factor: 1 original, 0 back to back')
+	parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+	args = parser.parse_args()
+	header, events = load(args.trace)
+	data = _prepare(header)
+	try:
+		results, fake = asyncio.run(replay(header, events, args.scale))
+	finally:
+		shutil.rmtree(data, ignore_errors=True)
+	summary = summarize(results, fake)
+	if args.json:
+		print(json.dumps(summary, indent=1))
+	else:
+		_print(summary)
+
+if __name__ == '__main__':
+	main()
@@ -1,30 +1,32 @@
 import asyncio
-import json
+import codecs
+import datetime
+import gzip
+import importlib
+import sys
+import time
+import uuid
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+import brotli
+import orjson
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from googleapiclient.errors import HttpError
 from pydantic import BaseModel
-from . import sync
-from .agent import (
-	agent_call,
-	agent_stream,
-	close_session,
+from . import admission, analytics, gapi, ics, lanes, layout, mirror, outbox, quota, sync, turns
+from .accounts import (
+	NeedsConsent,
 	get_accounts,
-	get_service,
 	google_status,
 	link_account,
 	resolve_account,
 	set_primary_account,
 	unlink_account,
-	_clients,
 )
 from .store import (
-	cache_remove_event,
 	cache_remove_task,
-	cache_upsert_event,
 	cache_upsert_task,
 	log_activity,
 	read_activity,
@@ -33,23 +35,61 @@ from .store import (
 	update_note,
 	delete_note,
 	get_settings,
+	load_file,
+	process_lock,
+	save_file,
 	update_settings,
 )
 
+AGENT_MODULE = f'{__package__}.agent'
+
+def _agent():
+	# lazy: the agent SDK is most of the cold-start import time; _warm_agent preloads it
+	return importlib.import_module(AGENT_MODULE)
+
+async def _warm_agent():
+	await sync.until_serving()
+	await asyncio.to_thread(_agent)
+	await asyncio.to_thread(importlib.import_module, 'numpy')  # for analytics
+
 @asynccontextmanager
 async def lifespan(app):
-	loop = asyncio.create_task(sync.sync_loop())
+	with lanes.using('sync'):
+		loop_task = asyncio.create_task(sync.sync_loop())
+	# queued UI writes stay in the ui lane, ahead of sync pages
+	tasks = [
+		loop_task,
+		asyncio.create_task(outbox.flush_loop()),
+		asyncio.create_task(_warm_agent()),
+	]
 	yield
-	loop.cancel()
+	for task in tasks:
+		task.cancel()
+	await gapi.close()
 
 app = FastAPI(lifespan=lifespan)
 
+class ServingSignal:
+	'''Pure ASGI pass-through that tells sync the port is bound and answering, and
+	that someone is using the app (status polling aside) for its cadence.'''
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope['type'] == 'http':
+			sync.mark_serving()
+			if scope['path'] != '/status':
+				sync.note_activity()
+		await self.app(scope, receive, send)
+
+app.add_middleware(ServingSignal)
 app.add_middleware(
 	CORSMiddleware,
 	allow_origins=["*"],
 	allow_credentials=True,
 	allow_methods=["*"],
 	allow_headers=["*"],
+	expose_headers=["X-Mirror-Stale", "X-Turn-Id"],
 )
 
 class AgentRequest(BaseModel):
@@ -59,81 +99,326 @@ class AgentRequest(BaseModel):
 class AgentResponse(BaseModel):
 	reply: str
 
+def _busy(detail):
+	return HTTPException(status_code=429, detail=detail, headers={'Retry-After': '5'})
+
 @app.post("/chat", response_model=AgentResponse)
 async def chat(request: AgentRequest):
-	reply = await agent_call(request.user_id, request.message)
+	agent = _agent()
+	try:
+		reply = await agent.agent_call(request.user_id, request.message)
+	except admission.Busy as e:
+		raise _busy(f'agent busy: {e}')
+	except agent.TurnTimeout as e:
+		raise HTTPException(status_code=504, detail=str(e))
 	return AgentResponse(reply=reply)
 
-async def run_gcal(op):
-	'''Blocking Google client work goes to a worker thread; API errors become HTTP errors.'''
+async def run_gcal(call):
+	'''Awaits a gapi call; API errors become HTTP errors.'''
 	try:
-		return await asyncio.to_thread(op)
+		return await call
 	except HttpError as error:
 		raise HTTPException(status_code=error.resp.status, detail=str(error))
 
+COMPRESS_MIN_BYTES = 1024
+
+def _accepts(header, coding):
+	for part in header.split(','):
+		name, _, params = part.strip().partition(';')
+		if name.strip() == coding:
+			return params.replace(' ', '') not in ('q=0', 'q=0.0')
+	return False
+
+def packed(request: Request, data):
+	'''JSON via orjson, compressed with the best encoding the client accepts
+	(br, then gzip); small bodies are not worth the round of compression.
+	X-Mirror-Stale marks data served from a previous run's mirror during boot.'''
+	body = orjson.dumps(data)
+	headers = {'Vary': 'Accept-Encoding'}
+	if sync.is_stale():
+		headers['X-Mirror-Stale'] = '1'
+	accept = request.headers.get('accept-encoding', '')
+	if len(body) >= COMPRESS_MIN_BYTES:
+		if _accepts(accept, 'br'):
+			body = brotli.compress(body, quality=4)
+			headers['Content-Encoding'] = 'br'
+		elif _accepts(accept, 'gzip'):
+			body = gzip.compress(body, compresslevel=5)
+			headers['Content-Encoding'] = 'gzip'
+	return Response(body, media_type='application/json', headers=headers)
+
+def _fields(value):
+	'''fields= query param -> set of top-level keys to keep, None for everything.'''
+	keys = {k.strip() for k in (value or '').split(',') if k.strip()}
+	return keys or None
+
 @app.get("/events")
-async def list_events(timeMin: str, timeMax: str, maxResults: int = 250):
-	cached = sync.cached_events(timeMin, timeMax)
-	if cached is not None:
-		return cached[:maxResults]
-
-	# outside the mirrored window (or never synced) - fall through to a live pull
-	def op():
-		merged = []
-		for acct in get_accounts():
-			email = acct.get('email', '')
-			result = get_service(account=email).events().list(
-				calendarId='primary',
-				timeMin=timeMin,
-				timeMax=timeMax,
-				maxResults=maxResults,
-				singleEvents=True,
-				orderBy='startTime',
-			).execute()
-			for ev in result.get('items', []):
-				ev['account'] = email
-				merged.append(ev)
-		merged.sort(key=lambda e: e['start'].get('dateTime', e['start'].get('date', '')))
-		return merged
-
-	return await run_gcal(op)
+async def list_events(request: Request, timeMin: str, timeMax: str, maxResults: int = 250, fields: str | None = None):
+	# outside the sync window this stitches in month segments fetched on demand
+	try:
+		items = await sync.events_between(timeMin, timeMax)
+	except ValueError:
+		raise HTTPException(status_code=400, detail='timeMin/timeMax must be RFC3339')
+	except HttpError as error:
+		raise HTTPException(status_code=error.resp.status, detail=str(error))
+	keys = _fields(fields)
+	return packed(request, [rec.to_dict(keys) for rec in items[:maxResults]])
+
+@app.get("/analytics")
+async def get_analytics(start: str | None = None, end: str | None = None):
+	'''Hours per category, account, weekday and hour for local dates [start, end);
+	defaults to the current month.'''
+	today = datetime.datetime.now(mirror.tz()).date()
+	first = today.replace(day=1)
+	start = start or first.isoformat()
+	end = end or (first + datetime.timedelta(days=32)).replace(day=1).isoformat()
+	try:
+		return await analytics.summary(start, end)
+	except ValueError as e:
+		raise HTTPException(status_code=400, detail=f'start/end must be YYYY-MM-DD: {e}')
+	except HttpError as error:
+		raise HTTPException(status_code=error.resp.status, detail=str(error))
 
 EVENT_PATCH_FIELDS = {'summary', 'location', 'description', 'start', 'end', 'colorId', 'recurrence', 'attendees'}
 
 @app.post("/events")
 async def create_event(body: dict, account: str | None = None):
+	'''Applied to the mirror at once and queued for google (see outbox.py);
+	the returned event carries pending until the write is confirmed.'''
 	body = {k: v for k, v in body.items() if k in EVENT_PATCH_FIELDS}
-	event = await run_gcal(lambda: get_service(account=account).events().insert(
-		calendarId='primary', body=body
-	).execute())
-	event['account'] = resolve_account(account)
-	cache_upsert_event(event)
-	sync.schedule_refresh()
-	log_activity('CREATE', f"EVT {event.get('summary')} // {event['start'].get('dateTime', event['start'].get('date', ''))[:16]}", 'ui')
+	if not isinstance(body.get('start'), dict) or not isinstance(body.get('end'), dict):
+		raise HTTPException(status_code=400, detail='start and end are required')
+	email = resolve_account(account)
+	# a client-chosen id keeps a retried insert from creating the event twice
+	body['id'] = outbox.local_id()
+	event = {**body, 'account': email, 'pending': 'insert'}
+	mirror.upsert_event(event)
+	outbox.push('calendar', 'insert', email, body['id'], body, local=event)
+	log_activity('CREATE', f"EVT {event.get('summary')} // {event.get('start', {}).get('dateTime', event.get('start', {}).get('date', ''))[:16]}", 'ui')
+	return event
+
+@app.get("/events/{event_id}")
+async def get_event(event_id: str, account: str | None = None):
+	'''The whole google resource; /events items flagged partial carry only the
+	fields the mirror keeps.'''
+	try:
+		event = await sync.full_event(event_id, resolve_account(account))
+		if event is None:
+			event = {**await gapi.events_get(event_id, account), 'account': resolve_account(account)}
+	except HttpError as error:
+		raise HTTPException(status_code=error.resp.status, detail=str(error))
 	return event
 
 @app.patch("/events/{event_id}")
 async def patch_event(event_id: str, body: dict, account: str | None = None):
 	body = {k: v for k, v in body.items() if k in EVENT_PATCH_FIELDS}
-	event = await run_gcal(lambda: get_service(account=account).events().patch(
-		calendarId='primary', eventId=event_id, body=body
-	).execute())
-	event['account'] = resolve_account(account)
-	cache_upsert_event(event)
-	sync.schedule_refresh()
+	email = resolve_account(account)
+	current = mirror.full_event(event_id, email)
+	event = {**(current or {}), **body, 'id': event_id, 'account': email, 'pending': 'patch'}
+	if current:
+		mirror.upsert_event(event)
+	outbox.push(
+		'calendar', 'patch', email, event_id, body, etag=(current or {}).get('etag'), local=event if current else None,
+		calendar=(current or {}).get('calendar') or mirror.PRIMARY,
+	)
 	log_activity('EDIT', f"EVT {event.get('summary')} updated", 'ui')
 	return event
 
 @app.delete("/events/{event_id}")
 async def delete_event(event_id: str, account: str | None = None):
-	def op():
-		get_service(account=account).events().delete(calendarId='primary', eventId=event_id).execute()
-		return {'ok': True}
-	result = await run_gcal(op)
-	cache_remove_event(event_id)
-	sync.schedule_refresh()
+	email = resolve_account(account)
+	current = mirror.full_event(event_id, email)
+	mirror.remove_event(event_id)
+	outbox.push(
+		'calendar', 'delete', email, event_id, etag=(current or {}).get('etag'),
+		calendar=(current or {}).get('calendar') or mirror.PRIMARY,
+	)
 	log_activity('DELETE', f'EVT {event_id} removed', 'ui')
-	return result
+	return {'ok': True, 'pending': 'delete'}
+
+@app.get("/events.ics")
+async def export_ics(timeMin: str | None = None, timeMax: str | None = None):
+	'''The mirror as an .ics download, streamed one VEVENT at a time; everything
+	mirrored unless a timeMin/timeMax range is given.'''
+	if timeMin and timeMax:
+		try:
+			records = await sync.events_between(timeMin, timeMax)
+		except ValueError:
+			raise HTTPException(status_code=400, detail='timeMin/timeMax must be RFC3339')
+		except HttpError as error:
+			raise HTTPException(status_code=error.resp.status, detail=str(error))
+	else:
+		records = mirror.all_records()
+	return StreamingResponse(
+		ics.export(records),
+		media_type='text/calendar',
+		headers={'Content-Disposition': 'attachment; filename="autocal.ics"'},
+	)
+
+IMPORT_JOBS_KEPT = 20
+IMPORTS_FILE = 'imports.json'
+# how often a running import publishes its counts for the other workers
+IMPORT_PROGRESS_SECONDS = 1.0
+_imports: dict[str, dict] = {}
+
+def _save_import(progress):
+	'''Publishes one job's counts to data/imports.json, readable from any worker.'''
+	with process_lock():
+		jobs = load_file(IMPORTS_FILE, {})
+		jobs.pop(progress['id'], None)
+		jobs[progress['id']] = progress
+		while len(jobs) > IMPORT_JOBS_KEPT:
+			jobs.pop(next(iter(jobs)))
+		save_file(IMPORTS_FILE, jobs)
+
+@app.post("/import/ics")
+async def import_ics(request: Request, account: str | None = None, job: str | None = None):
+	'''Imports a raw text/calendar body as it arrives: events whose UID the mirror
+	(or an earlier event in the file) already has are skipped, the rest go to
+	google via events.import in batches of sync.IMPORT_BATCH per account. Events
+	exported with an account tag land on that account if it is linked, the rest
+	on account (default primary). Overrides (RECURRENCE-ID) are deduped on UID
+	plus recurrence id and, once the file is read, patched onto their occurrence
+	when the series exists, else imported on their own (see ics.py). Progress is
+	readable at /import/ics/{job}; accounts whose token needs a new consent are
+	listed in needsConsent instead of prompting. Memory stays at one parsed event
+	plus a batch per account, the overrides and the UID set.'''
+	job = job or uuid.uuid4().hex
+	progress = _imports[job] = {
+		'id': job, 'parsed': 0, 'imported': 0, 'updated': 0, 'duplicates': 0, 'failed': 0, 'invalid': 0, 'done': False,
+		# accounts whose events were not imported until they are linked again
+		'needsConsent': [],
+	}
+	while len(_imports) > IMPORT_JOBS_KEPT:
+		_imports.pop(next(iter(_imports)))
+	published = 0.0
+
+	async def publish(force=False):
+		nonlocal published
+		if force or time.monotonic() - published >= IMPORT_PROGRESS_SECONDS:
+			published = time.monotonic()
+			await lanes.run(_save_import, {**progress, 'needsConsent': list(progress['needsConsent'])})
+
+	await publish(force=True)
+	target = resolve_account(account)
+	linked = {a.get('email') for a in get_accounts()}
+	seen, series = await lanes.run(ics.known, mirror.all_records())
+	parser = ics.Parser(get_settings()['timezone'])
+	decoder = codecs.getincrementaldecoder('utf-8')('replace')
+	pending: dict[str, list] = {}
+	overrides = []
+	# series UID -> (email, calendar, google id) of masters imported by this request
+	imported_series = {}
+
+	async def flush(email):
+		batch = pending.pop(email, [])
+		if not batch:
+			return
+		try:
+			imported, failed = await lanes.run(sync.import_batch, email, batch, lane='sync')
+		except HttpError as error:
+			print(f'[import] batch into {email} failed: {error}')
+			imported, failed = [], len(batch)
+		except NeedsConsent:
+			needs_consent(email)
+			imported, failed = [], len(batch)
+		progress['imported'] += len(imported)
+		progress['failed'] += failed
+		for event in imported:
+			if event.get('recurrence'):
+				imported_series[event['iCalUID']] = (email, mirror.PRIMARY, event['id'])
+
+	def needs_consent(email):
+		if email not in progress['needsConsent']:
+			progress['needsConsent'].append(email)
+
+	async def add(event):
+		tagged = event.pop('account', None)
+		email = tagged if tagged in linked else target
+		pending.setdefault(email, []).append(event)
+		if len(pending[email]) >= sync.IMPORT_BATCH:
+			await flush(email)
+
+	async def take(events):
+		for event in events:
+			progress['parsed'] += 1
+			uid = event['iCalUID']
+			if 'recurrenceId' in event:
+				uid = ics.instance_uid(uid, event['recurrenceId'])
+			if uid in seen:
+				progress['duplicates'] += 1
+				continue
+			seen.add(uid)
+			if 'recurrenceId' in event:
+				# its series may come later in the file
+				overrides.append(event)
+				continue
+			await add(event)
+		await publish()
+
+	async def override(event):
+		'''Patches one occurrence of an existing series -> False if there is none.'''
+		uid, recurrence_id = event['iCalUID'], event.pop('recurrenceId')
+		if uid in imported_series:
+			email, calendar, master = imported_series[uid]
+		elif uid in series:
+			rec = series[uid]
+			email, calendar, master = rec.account, rec.calendar or mirror.PRIMARY, rec.recurringEventId
+		else:
+			event['iCalUID'] = ics.instance_uid(uid, recurrence_id)
+			return False
+		body = {k: event[k] for k in ('summary', 'description', 'location', 'start', 'end') if k in event}
+		try:
+			found = await gapi.events_instances(
+				master, email, calendar, interactive=False, originalStart=ics.original_start(recurrence_id),
+			)
+			if not found.get('items'):
+				progress['failed'] += 1
+				return True
+			patched = await gapi.events_patch(found['items'][0]['id'], body, email, calendar, interactive=False)
+			sync.event_written({**patched, 'account': email, 'calendar': calendar})
+			progress['updated'] += 1
+		except HttpError as error:
+			print(f'[import] override of {uid} failed: {error}')
+			progress['failed'] += 1
+		except NeedsConsent:
+			needs_consent(email)
+			progress['failed'] += 1
+		return True
+
+	try:
+		async for chunk in request.stream():
+			await take(parser.feed(decoder.decode(chunk)))
+		await take(parser.feed(decoder.decode(b'', final=True)) + parser.close())
+		for email in list(pending):
+			await flush(email)
+		with lanes.using('sync'):
+			for event in overrides:
+				if not await override(event):
+					await add(event)
+		for email in list(pending):
+			await flush(email)
+	finally:
+		progress['invalid'] = parser.skipped
+		progress['done'] = True
+		await publish(force=True)
+		# one window pull picks the lot up; per-batch write-through would rewrite the mirror every 50 events
+		if progress['imported']:
+			sync.schedule_refresh()
+	log_activity(
+		'IMPORT',
+		f"ICS {progress['imported']} imported // {progress['updated']} occurrences updated // {progress['duplicates']} already present",
+		'ui',
+	)
+	return progress
+
+@app.get("/import/ics/{job}")
+async def import_progress(job: str):
+	'''Counts of an import running (or run) in this or any other worker.'''
+	progress = _imports.get(job) or (await lanes.run(load_file, IMPORTS_FILE, {})).get(job)
+	if progress is None:
+		raise HTTPException(status_code=404, detail='import not found')
+	return progress
 
 TASK_FIELDS = {'title', 'notes', 'due', 'status', 'completed'}
 
@@ -142,50 +427,101 @@ def _sort_tasks(items):
 	done = sorted((t for t in items if t.get('status') == 'completed'), key=lambda t: t.get('completed', ''), reverse=True)
 	return pending + done
 
-@app.get("/tasks")
-async def list_tasks():
+async def _load_tasks():
 	items = sync.cached_tasks()
 	if items is None:
 		# showHidden=False keeps cleared history out - matches the Google Tasks app view
-		result = await run_gcal(lambda: get_service('tasks').tasks().list(
-			tasklist='@default', showCompleted=True, showHidden=False, maxResults=100
-		).execute())
+		result = await run_gcal(gapi.tasks_list(showCompleted=True, showHidden=False, maxResults=100))
 		items = result.get('items', [])
-	return _sort_tasks(items)
+	return items
+
+@app.get("/tasks")
+async def list_tasks(request: Request, fields: str | None = None):
+	items = _sort_tasks(await _load_tasks())
+	keys = _fields(fields)
+	if keys:
+		items = [{k: v for k, v in t.items() if k in keys} for t in items]
+	return packed(request, items)
+
+@app.get("/layout")
+async def week_layout(request: Request, weekStart: str | None = None):
+	'''The Calendar grid for seven local days from weekStart (default: this week's
+	Monday), overlap columns already assigned; see layout.py.'''
+	try:
+		if weekStart:
+			first = datetime.date.fromisoformat(weekStart)
+		else:
+			today = datetime.datetime.now(mirror.tz()).date()
+			first = today - datetime.timedelta(days=today.weekday())
+	except ValueError:
+		raise HTTPException(status_code=400, detail='weekStart must be YYYY-MM-DD')
+	try:
+		return packed(request, await layout.week(first))
+	except HttpError as error:
+		raise HTTPException(status_code=error.resp.status, detail=str(error))
+
+AGENDA_HORIZON_DAYS = 7
+
+@app.get("/agenda")
+async def agenda(date: str | None = None, horizon: int = AGENDA_HORIZON_DAYS):
+	'''Everything the Dashboard shows for one local day in a single round trip:
+	that day's events split timed/all-day, tasks due within the horizon (undated
+	ones always), the category protocol and sync status.'''
+	try:
+		day = datetime.date.fromisoformat(date) if date else datetime.datetime.now(mirror.tz()).date()
+	except ValueError:
+		raise HTTPException(status_code=400, detail='date must be YYYY-MM-DD')
+	try:
+		records = await sync.day_events(day)
+	except HttpError as error:
+		raise HTTPException(status_code=error.resp.status, detail=str(error))
+	timed, all_day = [], []
+	for rec in records:
+		(all_day if rec.all_day else timed).append(rec.to_dict())
+	due_by = (day + datetime.timedelta(days=horizon)).isoformat()
+	tasks = [t for t in await _load_tasks() if not t.get('due') or t['due'][:10] <= due_by]
+	return {
+		'date': day.isoformat(),
+		'allDay': all_day,
+		'events': timed,
+		'tasks': _sort_tasks(tasks),
+		'categories': get_settings()['categories'],
+		'sync': sync.last_sync(),
+	}
+
+def _cached_task(task_id):
+	return next((t for t in sync.cached_tasks() or [] if t.get('id') == task_id), None)
 
 @app.post("/tasks")
 async def create_task(body: dict):
 	body = {k: v for k, v in body.items() if k in TASK_FIELDS}
-	task = await run_gcal(lambda: get_service('tasks').tasks().insert(
-		tasklist='@default', body=body
-	).execute())
+	task = {'status': 'needsAction', **body, 'id': outbox.local_id(), 'pending': 'insert'}
 	cache_upsert_task(task)
-	sync.schedule_refresh()
+	outbox.push('tasks', 'insert', '', task['id'], body, local=task)
 	log_activity('CREATE', f"TASK {task.get('title')}", 'ui')
 	return task
 
 @app.patch("/tasks/{task_id}")
 async def patch_task(task_id: str, body: dict):
 	body = {k: v for k, v in body.items() if k in TASK_FIELDS}
-	task = await run_gcal(lambda: get_service('tasks').tasks().patch(
-		tasklist='@default', task=task_id, body=body
-	).execute())
-	cache_upsert_task(task)
-	sync.schedule_refresh()
+	task_id = outbox.resolve(task_id)
+	current = _cached_task(task_id)
+	task = {**(current or {}), **body, 'id': task_id, 'pending': 'patch'}
+	if current:
+		cache_upsert_task(task)
+	outbox.push('tasks', 'patch', '', task_id, body, etag=(current or {}).get('etag'), local=task if current else None)
 	verb = 'completed' if task.get('status') == 'completed' else 'updated'
 	log_activity('EDIT', f"TASK {task.get('title')} {verb}", 'ui')
 	return task
 
 @app.delete("/tasks/{task_id}")
 async def delete_task(task_id: str):
-	def op():
-		get_service('tasks').tasks().delete(tasklist='@default', task=task_id).execute()
-		return {'ok': True}
-	result = await run_gcal(op)
+	task_id = outbox.resolve(task_id)
+	current = _cached_task(task_id)
 	cache_remove_task(task_id)
-	sync.schedule_refresh()
+	outbox.push('tasks', 'delete', '', task_id, etag=(current or {}).get('etag'))
 	log_activity('DELETE', f'TASK {task_id} removed', 'ui')
-	return result
+	return {'ok': True, 'pending': 'delete'}
 
 @app.get("/settings")
 async def settings_get():
@@ -195,17 +531,32 @@ async def settings_get():
 async def settings_patch(body: dict):
 	return update_settings(body)
 
+def _agent_status():
+	agent = sys.modules.get(AGENT_MODULE)
+	if agent is None:
+		return {'ready': False, 'sessions': 0}
+	return {'ready': True, 'sessions': len(agent._clients), **agent.turn_stats()}
+
 @app.get("/status")
 async def status():
 	return {
-		'agent': {'ready': True, 'sessions': len(_clients)},
-		'google': await asyncio.to_thread(google_status),
+		'agent': _agent_status(),
+		'google': await lanes.run(google_status),
 		'sync': sync.last_sync(),
+		'quota': quota.stats(),
+		'turns': {**admission.stats(), 'streams': turns.stats()},
+		'outbox': await lanes.run(outbox.stats),
+		'lanes': lanes.stats(),
 	}
 
 @app.post("/sync")
 async def force_sync():
-	await sync.refresh()
+	if sync.is_leader():
+		# a full window pull: sync lane, so the ui lane stays free for clicks meanwhile
+		with lanes.using('sync'):
+			await sync.refresh()
+	else:
+		sync.schedule_refresh()  # forwarded to the worker running the sync loop
 	return {'ok': True, **sync.last_sync()}
 
 @app.post("/auth/google")
@@ -216,18 +567,19 @@ async def auth_google():
 		raise HTTPException(status_code=502, detail=f'consent flow failed: {e}')
 	log_activity('SYNC', f'google account {email} linked', 'ui')
 	sync.schedule_refresh()
+	await outbox.unpark()
 	return {'ok': True, 'email': email}
 
 @app.post("/accounts/{email}/primary")
 async def account_primary(email: str):
-	if not await asyncio.to_thread(set_primary_account, email):
+	if not await lanes.run(set_primary_account, email):
 		raise HTTPException(status_code=404, detail='account not linked')
 	log_activity('SYNC', f'{email} set as primary account', 'ui')
 	return {'ok': True}
 
 @app.delete("/accounts/{email}")
 async def account_unlink(email: str):
-	removed = await asyncio.to_thread(unlink_account, email)
+	removed = await lanes.run(unlink_account, email)
 	if not removed:
 		raise HTTPException(status_code=404, detail='account not linked')
 	log_activity('SYNC', f'google account {email} unlinked', 'ui')
@@ -260,27 +612,47 @@ async def notes_delete(note_id: str):
 
 @app.post("/tasks/{task_id}/move")
 async def move_task(task_id: str, previous: str | None = None):
-	kwargs = {'previous': previous} if previous else {}
-	task = await run_gcal(lambda: get_service('tasks').tasks().move(
-		tasklist='@default', task=task_id, **kwargs
-	).execute())
+	# google assigns the new position, so the cached task only gets the pending marker
+	task_id = outbox.resolve(task_id)
+	task = {**(_cached_task(task_id) or {}), 'id': task_id, 'pending': 'move'}
 	cache_upsert_task(task)
-	sync.schedule_refresh()
+	outbox.push('tasks', 'move', '', task_id, local=task, previous=outbox.resolve(previous) if previous else None)
 	return task
 
 @app.delete("/chat/sessions/{user_id}")
 async def chat_close(user_id: str):
-	await close_session(user_id)
+	agent = sys.modules.get(AGENT_MODULE)
+	if agent:
+		await agent.close_session(user_id)
 	return {'ok': True}
 
-@app.post("/chat/stream")
-async def chat_stream(request: AgentRequest):
+def _sse(turn, after):
 	async def gen():
-		async for event in agent_stream(request.user_id, request.message):
-			yield f"data: {json.dumps(event)}\n\n"
+		async for seq, event in turn.frames(after):
+			yield b'id: %d\ndata: %s\n\n' % (seq, orjson.dumps(event))
 
 	return StreamingResponse(
 		gen(),
 		media_type="text/event-stream",
-		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Turn-Id": turn.id},
 	)
+
+@app.post("/chat/stream")
+async def chat_stream(request: AgentRequest):
+	'''Starts a turn and streams it; the first event carries the turnId to resume with.'''
+	# turned away before the stream opens; a race past this check still ends in a busy error event
+	if admission.is_full():
+		raise _busy('agent busy: turn queue full')
+	return _sse(turns.start(_agent().agent_stream(request.user_id, request.message)), 0)
+
+@app.get("/chat/stream/{turn_id}")
+async def chat_resume(turn_id: str, request: Request, lastEventId: int = 0):
+	'''Re-attaches to a turn after a dropped connection, from Last-Event-ID on.'''
+	turn = turns.get(turn_id)
+	if turn is None:
+		raise HTTPException(status_code=404, detail='turn not found or expired')
+	try:
+		after = int(request.headers.get('last-event-id', lastEventId))
+	except ValueError:
+		raise HTTPException(status_code=400, detail='Last-Event-ID must be an integer')
+	return _sse(turn, after)
@@ -4,11 +4,73 @@ import threading
 import uuid
 from datetime import datetime
 
+try:
+	import fcntl
+except ImportError:  # windows
+	fcntl = None
+	import msvcrt
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+# overridable so tools like replay.py can run against a scratch copy
+DATA_DIR = os.getenv('AUTOCAL_DATA_DIR') or os.path.join(BASE_DIR, 'data')
 ACTIVITY_CAP = 500
 
-_lock = threading.Lock()
+def lock_file(f, blocking=True):
+	'''OS-level exclusive lock on an open file; False if non-blocking and held elsewhere.'''
+	try:
+		if fcntl:
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+		else:
+			f.seek(0)
+			while True:
+				try:
+					msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+					break
+				except OSError:
+					if not blocking:
+						raise
+		return True
+	except OSError:
+		return False
+
+def unlock_file(f):
+	if fcntl:
+		fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+	else:
+		f.seek(0)
+		msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class _ProcessLock:
+	'''Re-entrant lock that also holds an OS lock on data/.lock, so several server
+	workers can share the data dir without losing each other's read-modify-writes.'''
+	def __init__(self):
+		self._thread_lock = threading.RLock()
+		self._depth = 0
+		self._file = None
+
+	def __enter__(self):
+		self._thread_lock.acquire()
+		if self._depth == 0:
+			try:
+				if self._file is None:
+					os.makedirs(DATA_DIR, exist_ok=True)
+					self._file = open(_path('.lock'), 'a+b')
+				if not lock_file(self._file):
+					# carrying on unlocked would let workers overwrite each other's writes
+					raise OSError(f"could not lock {_path('.lock')}")
+			except BaseException:
+				self._thread_lock.release()
+				raise
+		self._depth += 1
+		return self
+
+	def __exit__(self, *exc):
+		self._depth -= 1
+		if self._depth == 0:
+			unlock_file(self._file)
+		self._thread_lock.release()
+
+_lock = _ProcessLock()
 
 def _path(name):
 	return os.path.join(DATA_DIR, name)
@@ -27,6 +89,53 @@ def _write(name, data):
 		json.dump(data, f, indent=1)
 	os.replace(tmp, _path(name))
 
+def process_lock():
+	'''The store's cross-process lock, for callers composing several reads and writes.'''
+	return _lock
+
+def load_file(name, default=None):
+	with _lock:
+		return _read(name, default)
+
+def save_file(name, data):
+	with _lock:
+		_write(name, data)
+
+def file_stamp(name):
+	'''Cheap change marker for a data file (None if missing) - another worker's
+	write shows up as a different stamp.'''
+	try:
+		st = os.stat(_path(name))
+	except FileNotFoundError:
+		return None
+	return st.st_mtime_ns, st.st_size
+
+def queue_push(name, item):
+	'''Appends one JSON line to a data-dir queue file shared between workers.'''
+	with _lock:
+		os.makedirs(DATA_DIR, exist_ok=True)
+		with open(_path(name), 'a') as f:
+			f.write(json.dumps(item) + '\n')
+
+def queue_drain(name):
+	'''Takes every queued line, leaving the file empty.'''
+	if not (file_stamp(name) or (0, 0))[1]:
+		return []
+	with _lock:
+		try:
+			with open(_path(name), 'r+') as f:
+				lines = f.readlines()
+				f.truncate(0)
+		except FileNotFoundError:
+			return []
+	items = []
+	for line in lines:
+		try:
+			items.append(json.loads(line))
+		except json.JSONDecodeError:
+			pass
+	return items
+
 def get_cache(section):
 	with _lock:
 		return _read('cache.json', {}).get(section)
@@ -47,27 +156,6 @@ def _mutate_cache_items(section, fn):
 		payload['items'] = fn(payload.get('items', []))
 		_write('cache.json', cache)
 
-def _event_sort_key(ev):
-	start = ev.get('start', {})
-	return start.get('dateTime', start.get('date', ''))
-
-def cache_upsert_event(event):
-	def fn(items):
-		items = [e for e in items if e.get('id') != event.get('id')]
-		items.append(event)
-		items.sort(key=_event_sort_key)
-		return items
-	_mutate_cache_items('events', fn)
-
-def cache_remove_event(event_id):
-	# a recurring master's expanded instances carry ids like '<master>_<start>'
-	def fn(items):
-		return [
-			e for e in items
-			if e.get('id') != event_id and not str(e.get('id', '')).startswith(f'{event_id}_')
-		]
-	_mutate_cache_items('events', fn)
-
 def cache_upsert_task(task):
 	def fn(items):
 		items = [t for t in items if t.get('id') != task.get('id')]
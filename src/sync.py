@@ -1,24 +1,77 @@
 '''Local mirror of google calendar + tasks.
 
-A background loop refetches a bounded window every few minutes into data/cache.json;
+A background loop refetches a bounded window every few minutes into data/mirror.json;
 reads are served from the mirror, writes go through to google and patch the mirror
 in place. syncToken is deliberately not used: it cannot be combined with a time
-range, which would force full-history sync plus local recurrence expansion.'''
+range, which would force full-history sync plus local recurrence expansion.
+
+Reads outside the window are served from month-aligned segments fetched on demand,
+each with its own fetchedAt, evicted least-recently-used past a count/size bound.
+
+With several server workers, one holds data/leader.lock and runs the loop; the
+others pick up its writes through the mirror's file stamp and forward their
+refresh/reconcile requests through a queue file the leader drains.
+
+Each account is pulled on its own adaptive cadence (see cadence.py); a pull of
+some accounts carries the others' records over unchanged.
+
+Every calendar an account shows in google calendar is mirrored, not just its
+primary: the calendarList is rechecked hourly, and all calendars of all pulled
+accounts are fetched at once, each one carrying its previous records over when
+its own fetch fails. The window's metadata records when each calendar was last
+pulled.'''
 
 import asyncio
+import os
+import time
 from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
 
-from .agent import get_accounts, get_service
-from .store import get_cache, get_settings, save_cache
+from googleapiclient.errors import HttpError
+
+from . import cadence, gapi, lanes, mirror, outbox
+from .accounts import api_call, get_accounts, get_service, primary_of
+from .store import (
+	DATA_DIR,
+	cache_remove_task,
+	cache_upsert_task,
+	get_cache,
+	lock_file,
+	queue_drain,
+	queue_push,
+	save_cache,
+	unlock_file,
+)
 
+# only what EventRecord keeps; the rest of a resource is fetched on demand (full_event)
+SYNC_FIELDS = (
+	'nextPageToken,items(id,etag,summary,location,description,colorId,start,end,recurringEventId,'
+	'iCalUID,htmlLink,hangoutLink,conferenceData/entryPoints(entryPointType,uri))'
+)
+SYNC_PAGE_SIZE = 2500  # events.list maximum
+CALENDAR_FIELDS = 'nextPageToken,items(id,summary,primary,selected,hidden,accessRole)'
+CALENDARS_CACHE = 'calendars'
+CALENDARS_TTL_SECONDS = 3600
 WINDOW_PAST_DAYS = 30
 WINDOW_FUTURE_DAYS = 120
-REFRESH_SECONDS = 300
 DEBOUNCE_SECONDS = 2.0
+SEGMENT_TTL_SECONDS = 3600
+SEGMENT_CAP = 12
+SEGMENT_MAX_EVENTS = 5000
+BOOT_GRACE_SECONDS = 5.0
+LEADER_RETRY_SECONDS = 5.0
+FORWARD_POLL_SECONDS = 1.0
+FORWARD_QUEUE = 'sync-requests.jsonl'
+ACTIVITY_FORWARD_SECONDS = 30.0
 
 _refresh_lock = asyncio.Lock()
 _debounce_pending = False
+_segment_fetches: dict[str, asyncio.Future] = {}
+_segment_used: dict[str, float] = {}
+_serving = asyncio.Event()
+_booted_at = datetime.now(timezone.utc)
+_leader_file = None
+_activity_forwarded: dict[str, float] = {}
+_last_refresh: dict = {}
 
 def _now():
 	return datetime.now(timezone.utc)
@@ -30,70 +83,189 @@ def _window():
 		(now + timedelta(days=WINDOW_FUTURE_DAYS)).isoformat(),
 	)
 
-def _event_sort_key(ev):
-	start = ev.get('start', {})
-	return start.get('dateTime', start.get('date', ''))
+def _selected(entries):
+	'''The calendars worth mirroring out of a calendarList, primary first: the
+	primary plus those shown in google calendar whose event details we can read.'''
+	out = []
+	for entry in entries:
+		if entry.get('primary'):
+			out.insert(0, {'id': mirror.PRIMARY, 'summary': entry.get('summary', '')})
+		elif entry.get('selected') and not entry.get('hidden') and entry.get('accessRole') != 'freeBusyReader':
+			out.append({'id': entry['id'], 'summary': entry.get('summary', '')})
+	return out
+
+async def _calendar_list(email, known, background, meter):
+	'''-> (calendars, fetched). Falls back to the last known list, and failing that
+	to the calendars the mirror already holds for the account.'''
+	try:
+		entries, page_token = [], None
+		while True:
+			result = await gapi.calendar_list(
+				email, fields=CALENDAR_FIELDS, pageToken=page_token, interactive=not background, meter=meter,
+			)
+			entries.extend(result.get('items', []))
+			page_token = result.get('nextPageToken')
+			if not page_token:
+				break
+	except Exception as e:
+		print(f"[sync] calendar list for {email or 'account'} failed, keeping the last one: {e}")
+		if known:
+			return known['items'], False
+		mirrored = sorted({calendar for account, calendar in mirror.by_calendar() if account == email} - {mirror.PRIMARY})
+		return [{'id': mirror.PRIMARY, 'summary': ''}] + [{'id': calendar, 'summary': ''} for calendar in mirrored], False
+	return _selected(entries) or [{'id': mirror.PRIMARY, 'summary': ''}], True
+
+async def account_calendars(emails, background=True, meter=None):
+	'''{email: [{id, summary}]} of the calendars mirrored per account ('primary' for
+	the primary), from the cached calendarList while it is fresh.'''
+	cache = get_cache(CALENDARS_CACHE) or {}
+	stale = [email for email in emails if not _is_fresh(cache.get(email), CALENDARS_TTL_SECONDS)]
+	lists = await asyncio.gather(*(_calendar_list(email, cache.get(email), background, meter) for email in stale))
+	fetched = _now().isoformat()
+	updated = {email: {'items': items, 'fetchedAt': fetched} for email, (items, ok) in zip(stale, lists) if ok}
+	if updated:
+		linked = {acct.get('email', '') for acct in get_accounts()}
+		cache = {email: entry for email, entry in {**cache, **updated}.items() if email in linked}
+		await lanes.run(save_cache, CALENDARS_CACHE, cache)
+	out = {email: (cache.get(email) or {}).get('items') for email in emails}
+	for email, (items, _) in zip(stale, lists):
+		out[email] = items
+	return out
 
-def _fetch_account_events(email, time_min, time_max):
-	service = get_service(account=email, interactive=False)
+async def _fetch_account_events(email, time_min, time_max, background=True, meter=None, calendar=mirror.PRIMARY):
 	items, page_token = [], None
 	while True:
-		result = service.events().list(
-			calendarId='primary',
+		result = await gapi.events_list(
+			email,
+			calendar,
 			timeMin=time_min,
 			timeMax=time_max,
-			maxResults=250,
+			maxResults=SYNC_PAGE_SIZE,
+			fields=SYNC_FIELDS,
 			singleEvents=True,
 			orderBy='startTime',
 			pageToken=page_token,
-		).execute()
+			interactive=not background,
+			meter=meter,
+		)
 		for ev in result.get('items', []):
 			ev['account'] = email
+			ev['calendar'] = calendar
+			ev['partial'] = True
 			items.append(ev)
 		page_token = result.get('nextPageToken')
 		if not page_token:
 			return items
 
-def _fetch_events(time_min, time_max):
-	'''Full-window pull across accounts; an account that fails (expired token,
-	network) keeps its previously mirrored events instead of vanishing.'''
-	old = (get_cache('events') or {}).get('items', [])
-	merged = []
-	for acct in get_accounts():
-		email = acct.get('email', '')
-		try:
-			merged.extend(_fetch_account_events(email, time_min, time_max))
-		except Exception as e:
-			print(f"[sync] events for {email or 'account'} failed, keeping mirror: {e}")
-			merged.extend(ev for ev in old if ev.get('account') == email)
-	merged.sort(key=_event_sort_key)
-	return merged
+async def _fetch_events(time_min, time_max, background=True, emails=None, meter=None):
+	'''Range pull across accounts (default all) and every mirrored calendar of each,
+	all at once -> (items, failed, errors, pulled). pulled lists the (email, calendar
+	id) pairs fetched, failed the ones that errored (expired token, network, calendar
+	unshared): the mirror keeps their previous events instead of dropping them.
+	The fan-out is bounded by the caller's lane and the per-account quota only.'''
+	if emails is None:
+		emails = [acct.get('email', '') for acct in get_accounts()]
+	calendars = await account_calendars(emails, background, meter)
+	pulled = [(email, calendar['id']) for email in emails for calendar in calendars[email]]
+	results = await asyncio.gather(
+		*(_fetch_account_events(email, time_min, time_max, background, meter, calendar) for email, calendar in pulled),
+		return_exceptions=True,
+	)
+	merged, failed, errors = [], set(), []
+	for (email, calendar), result in zip(pulled, results):
+		if isinstance(result, Exception):
+			print(f"[sync] events for {email or 'account'} ({calendar}) failed, keeping mirror: {result}")
+			failed.add((email, calendar))
+			errors.append(result)
+		else:
+			merged.extend(result)
+	return merged, failed, errors, pulled
 
-def _fetch_tasks():
-	result = get_service('tasks', interactive=False).tasks().list(
-		tasklist='@default', showCompleted=True, showHidden=False, maxResults=100
-	).execute()
+async def _fetch_tasks():
+	result = await gapi.tasks_list(showCompleted=True, showHidden=False, maxResults=100, interactive=False)
 	return result.get('items', [])
 
-async def refresh():
-	'''One full mirror pull; concurrent callers coalesce on the lock.'''
+def _changes(items, emails, failed):
+	'''Events added, removed or edited per account against the mirror's copy;
+	calendars whose fetch failed are left out.'''
+	before, after = {}, {}
+	for (email, calendar), records in mirror.by_calendar().items():
+		if (email, calendar) not in failed:
+			before.setdefault(email, {}).update(((calendar, rec.id), rec.etag) for rec in records)
+	for ev in items:
+		after.setdefault(ev['account'], {})[(ev['calendar'], ev.get('id'))] = ev.get('etag')
+	changes = {}
+	for email in emails:
+		old, new = before.get(email, {}), after.get(email, {})
+		changes[email] = sum(old.get(key) != new.get(key) for key in old.keys() | new.keys())
+	return changes
+
+def _calendar_meta(pulled, failed, items, fetched, carried):
+	'''{email: {calendar id: {fetchedAt, events}}} for the window metadata; failed
+	calendars and accounts not pulled keep their previous entries.'''
+	old = (mirror.section() or {}).get('calendars') or {}
+	counts = {}
+	for ev in items:
+		counts[ev['account'], ev['calendar']] = counts.get((ev['account'], ev['calendar']), 0) + 1
+	out = {email: dict(entries) for email, entries in old.items() if email in carried}
+	for email, calendar in pulled:
+		entry = old.get(email, {}).get(calendar) if (email, calendar) in failed else {
+			'fetchedAt': fetched, 'events': counts.get((email, calendar), 0),
+		}
+		if entry:
+			out.setdefault(email, {})[calendar] = entry
+	return out
+
+async def refresh(accounts=None):
+	'''Mirror pull of some accounts (default all, tasks with the primary); the rest
+	carry over. Concurrent callers coalesce on the lock.'''
 	async with _refresh_lock:
+		linked = [acct.get('email', '') for acct in get_accounts()]
+		emails = linked if accounts is None else [email for email in accounts if email in linked]
 		time_min, time_max = _window()
 		fetched = _now().isoformat()
+		started, meter = time.monotonic(), {}
 		try:
-			items = await asyncio.to_thread(_fetch_events, time_min, time_max)
-			save_cache('events', {'items': items, 'timeMin': time_min, 'timeMax': time_max, 'fetchedAt': fetched})
+			items, failed, _, pulled = await _fetch_events(time_min, time_max, emails=emails, meter=meter)
+			_last_refresh.update(
+				at=fetched, accounts=len(emails), calendars=len(pulled), events=len(items),
+				seconds=round(time.monotonic() - started, 3), requests=meter.get('requests', 0),
+				bytes=meter.get('bytes', 0), wireBytes=meter.get('wireBytes', 0),
+			)
+			carried = set(linked) - set(emails)
+			meta = {
+				'timeMin': time_min, 'timeMax': time_max, 'fetchedAt': fetched, 'fields': SYNC_FIELDS,
+				'calendars': _calendar_meta(pulled, failed, items, fetched, carried),
+			}
+			if failed and len(failed) >= len(pulled):
+				# every calendar failed: the mirror is as old as it was
+				meta['fetchedAt'] = (mirror.section() or {}).get('fetchedAt')
+			changes = _changes(items, emails, failed)
+			await lanes.run(mirror.replace, mirror.WINDOW, items, meta, failed | carried)
+			for email in emails:
+				mine = [pair for pair in pulled if pair[0] == email]
+				cadence.ran(email, changes[email], bool(mine) and all(pair in failed for pair in mine))
 		except Exception as e:
 			print(f'[sync] events refresh failed: {e}')
-		try:
-			tasks = await asyncio.to_thread(_fetch_tasks)
-			save_cache('tasks', {'items': tasks, 'fetchedAt': fetched})
-		except Exception as e:
-			print(f'[sync] tasks refresh failed: {e}')
+			for email in emails:
+				cadence.ran(email, failed=True)
+		primary = primary_of(get_accounts())
+		if accounts is None or (primary or {}).get('email') in emails:
+			try:
+				tasks = await _fetch_tasks()
+				save_cache('tasks', {'items': tasks, 'fetchedAt': fetched})
+			except Exception as e:
+				print(f'[sync] tasks refresh failed: {e}')
+		# writes still queued for google would otherwise vanish until they flush
+		await lanes.run(outbox.overlay)
 
 def schedule_refresh():
-	'''Debounced fire-and-forget reconcile - safe to call after every write.'''
+	'''Debounced fire-and-forget full refresh, for account link/unlink; single
+	writes go through the targeted reconcile queue below instead.'''
 	global _debounce_pending
+	if not is_leader():
+		_forward({'op': 'refresh'})
+		return
 	if _debounce_pending:
 		return
 	_debounce_pending = True
@@ -103,57 +275,458 @@ def schedule_refresh():
 		try:
 			await asyncio.sleep(DEBOUNCE_SECONDS)
 			_debounce_pending = False
-			await refresh()
+			with lanes.using('sync'):
+				await refresh()
 		except Exception:
 			_debounce_pending = False
 
 	asyncio.get_running_loop().create_task(run())
 
-async def sync_loop():
+# (api, account, calendar) -> {resource id: kind}; kind is 'event', 'series' (a
+# recurring master, reconciled through its instances) or 'task'
+_reconcile_queue: dict[tuple[str, str, str], dict[str, str]] = {}
+_reconcile_pending = False
+
+def _enqueue(api, account, resource_id, kind, calendar=mirror.PRIMARY):
+	global _reconcile_pending
+	if not is_leader():
+		_forward({
+			'op': 'reconcile', 'api': api, 'account': account, 'id': resource_id, 'kind': kind, 'calendar': calendar,
+		})
+		return
+	_reconcile_queue.setdefault((api, account, calendar), {})[resource_id] = kind
+	if _reconcile_pending:
+		return
+	_reconcile_pending = True
+
+	async def run():
+		global _reconcile_pending
+		try:
+			await asyncio.sleep(DEBOUNCE_SECONDS)
+		finally:
+			_reconcile_pending = False
+		with lanes.using('sync'):
+			await reconcile()
+
+	asyncio.get_running_loop().create_task(run())
+
+def event_written(event):
+	'''Write-through of a created/edited event plus a debounced refetch of just that
+	event (or, for a recurring master, its instances) - safe to call after every write.'''
+	mirror.upsert_event(event)
+	kind = 'series' if event.get('recurrence') else 'event'
+	_enqueue('calendar', event.get('account', ''), event['id'], kind, event.get('calendar') or mirror.PRIMARY)
+
+def event_deleted(event_id, account='', calendar=mirror.PRIMARY):
+	mirror.remove_event(event_id)
+	_enqueue('calendar', account, event_id, 'event', calendar)
+
+def event_stale(event_id, account='', calendar=mirror.PRIMARY):
+	'''Refetch of one event whose mirror copy may be wrong (a failed local write).'''
+	_enqueue('calendar', account, event_id, 'event', calendar)
+
+def task_written(task):
+	cache_upsert_task(task)
+	_enqueue('tasks', '', task['id'], 'task')
+
+def task_deleted(task_id):
+	cache_remove_task(task_id)
+	_enqueue('tasks', '', task_id, 'task')
+
+def task_stale(task_id):
+	_enqueue('tasks', '', task_id, 'task')
+
+def _gone(error):
+	return isinstance(error, HttpError) and error.resp.status in (404, 410)
+
+def _reconcile_events(email, calendar, targets, time_min, time_max):
+	'''One batched round trip for the touched events of one of an account's
+	calendars -> (upserts, removals). A target that errors otherwise is left for
+	the periodic refresh.'''
+	service = get_service(account=email, interactive=False)
+	upserts, removals, more = [], [], []
+
+	def on_event(event_id):
+		def cb(_, response, error):
+			if error is not None:
+				if _gone(error):
+					removals.append(event_id)
+				else:
+					print(f'[sync] reconcile of event {event_id} failed: {error}')
+			elif response.get('status') == 'cancelled':
+				removals.append(event_id)
+			else:
+				upserts.append({**response, 'account': email, 'calendar': calendar})
+		return cb
+
+	def on_series(master_id):
+		def cb(_, response, error):
+			if error is not None:
+				if _gone(error):
+					removals.append(master_id)
+				else:
+					print(f'[sync] reconcile of series {master_id} failed: {error}')
+				return
+			# the instances replace the master and every previously expanded occurrence
+			removals.append(master_id)
+			upserts.extend(
+				{**ev, 'account': email, 'calendar': calendar} for ev in response.get('items', []) if ev.get('status') != 'cancelled'
+			)
+			if response.get('nextPageToken'):
+				more.append((master_id, response['nextPageToken']))
+		return cb
+
+	def instances(master_id, page_token=None):
+		return service.events().instances(
+			calendarId=calendar, eventId=master_id, timeMin=time_min, timeMax=time_max,
+			maxResults=2500, pageToken=page_token,
+		)
+
+	batch = service.new_batch_http_request()
+	for resource_id, kind in targets.items():
+		if kind == 'series':
+			batch.add(instances(resource_id), callback=on_series(resource_id))
+		else:
+			batch.add(service.events().get(calendarId=calendar, eventId=resource_id), callback=on_event(resource_id))
+	api_call(batch, email, interactive=False)
+	for master_id, page_token in more:
+		while page_token:
+			page = api_call(instances(master_id, page_token), email, interactive=False)
+			upserts.extend(
+				{**ev, 'account': email, 'calendar': calendar} for ev in page.get('items', []) if ev.get('status') != 'cancelled'
+			)
+			page_token = page.get('nextPageToken')
+	return upserts, removals
+
+IMPORT_BATCH = 50
+
+def import_batch(email, events):
+	'''events.import of up to IMPORT_BATCH bodies in one batched round trip ->
+	(imported events tagged with the account, number failed). Blocking; raises
+	NeedsConsent rather than opening a browser from a lane thread.'''
+	service = get_service(account=email, interactive=False)
+	imported, failed = [], []
+
+	def cb(_, response, error):
+		if error is not None:
+			failed.append(error)
+		else:
+			imported.append({**response, 'account': email})
+
+	batch = service.new_batch_http_request()
+	for body in events:
+		batch.add(service.events().import_(calendarId='primary', body=body), callback=cb)
+	# bulk, so it queues behind the UI and agent like background sync does
+	api_call(batch, email, interactive=False)
+	for error in failed[:3]:
+		print(f'[sync] import into {email} failed: {error}')
+	return imported, len(failed)
+
+def _reconcile_tasks(targets):
+	service = get_service('tasks', interactive=False)
+	upserts, removals = [], []
+
+	def on_task(task_id):
+		def cb(_, response, error):
+			if error is not None:
+				if _gone(error):
+					removals.append(task_id)
+				else:
+					print(f'[sync] reconcile of task {task_id} failed: {error}')
+			elif response.get('deleted') or response.get('hidden'):
+				removals.append(task_id)
+			else:
+				upserts.append(response)
+		return cb
+
+	batch = service.new_batch_http_request()
+	for task_id in targets:
+		batch.add(service.tasks().get(tasklist='@default', task=task_id), callback=on_task(task_id))
+	api_call(batch, interactive=False)
+	return upserts, removals
+
+async def reconcile():
+	'''Drains the reconcile queue: per account, one batched refetch of only the
+	touched resources, applied to the mirror in one write. Full-window pulls are
+	left to the periodic loop.'''
+	async with _refresh_lock:
+		queue = dict(_reconcile_queue)
+		_reconcile_queue.clear()
+		payload = mirror.section() or {}
+		for (api, account, calendar), targets in queue.items():
+			try:
+				if api == 'tasks':
+					upserts, removals = await lanes.run(_reconcile_tasks, targets)
+					for task in upserts:
+						cache_upsert_task(task)
+					for task_id in removals:
+						cache_remove_task(task_id)
+				elif payload:
+					upserts, removals = await lanes.run(
+						_reconcile_events, account, calendar, targets, payload['timeMin'], payload['timeMax'],
+					)
+					await lanes.run(mirror.apply, upserts, removals)
+			except Exception as e:
+				print(f"[sync] reconcile for {account or 'primary'} failed, left to the next refresh: {e}")
+
+def mark_serving():
+	_serving.set()
+
+async def until_serving():
+	'''Returns once the server has answered a request (so its port is bound),
+	or after a short grace period if nothing has asked yet.'''
+	try:
+		await asyncio.wait_for(_serving.wait(), BOOT_GRACE_SECONDS)
+	except asyncio.TimeoutError:
+		pass
+
+def is_stale():
+	'''True until a refresh lands after this process booted: until then reads are
+	served from the mirror a previous run persisted, without waiting on google.'''
+	try:
+		fetched = datetime.fromisoformat((mirror.section() or {})['fetchedAt'])
+	except (KeyError, TypeError, ValueError):
+		return True
+	return fetched < _booted_at
+
+def is_leader():
+	return _leader_file is not None
+
+def _try_lead():
+	'''Non-blocking grab of data/leader.lock, held until the process exits.'''
+	global _leader_file
+	os.makedirs(DATA_DIR, exist_ok=True)
+	f = open(os.path.join(DATA_DIR, 'leader.lock'), 'a+b')
+	if not lock_file(f, blocking=False):
+		f.close()
+		return False
+	_leader_file = f
+	return True
+
+def _leader_running():
+	'''Whether some other process holds leader.lock (probed without keeping it).'''
+	try:
+		f = open(os.path.join(DATA_DIR, 'leader.lock'), 'r+b')
+	except OSError:
+		return False  # no server has run on this data dir
+	with f:
+		if not lock_file(f, blocking=False):
+			return True
+		unlock_file(f)
+		return False
+
+def _forward(item):
+	'''Queues a request for the leader. Without one (a CLI run, no server up) it is
+	dropped: the next leader starts with a full refresh anyway.'''
+	if _leader_running():
+		queue_push(FORWARD_QUEUE, item)
+
+async def _drain_forwarded():
+	'''Leader side of the worker queue: replays other workers' requests locally.'''
 	while True:
-		await refresh()
-		await asyncio.sleep(REFRESH_SECONDS)
+		for item in await lanes.run(queue_drain, FORWARD_QUEUE):
+			if item.get('op') == 'refresh':
+				schedule_refresh()
+			elif item.get('op') == 'reconcile':
+				_enqueue(item['api'], item['account'], item['id'], item['kind'], item.get('calendar', mirror.PRIMARY))
+			elif item.get('op') == 'activity':
+				cadence.note_activity(item.get('kind', 'ui'))
+		await asyncio.sleep(FORWARD_POLL_SECONDS)
+
+async def sync_loop():
+	'''Runs in every worker; only the one that wins leader.lock syncs, the rest
+	keep retrying in case the leader exits.'''
+	# the first pull waits for the port, so boot requests are answered from disk at once
+	await until_serving()
+	while not _try_lead():
+		await asyncio.sleep(LEADER_RETRY_SECONDS)
+	forwarded = asyncio.create_task(_drain_forwarded())
+	try:
+		while True:
+			emails = [acct.get('email', '') for acct in get_accounts()]
+			due = cadence.due(emails)
+			if due:
+				await refresh(due)
+			await cadence.wait(emails)
+	finally:
+		forwarded.cancel()
+
+def note_activity(kind='ui'):
+	'''UI or agent use ('chat' for a new agent session), for the leader's cadence.'''
+	if is_leader():
+		cadence.note_activity(kind)
+		return
+	now = time.monotonic()
+	if kind == 'chat' or now - _activity_forwarded.get(kind, float('-inf')) >= ACTIVITY_FORWARD_SECONDS:
+		_activity_forwarded[kind] = now
+		_forward({'op': 'activity', 'kind': kind})
 
 def last_sync():
 	return {
-		'events': (get_cache('events') or {}).get('fetchedAt'),
+		'events': (mirror.section() or {}).get('fetchedAt'),
 		'tasks': (get_cache('tasks') or {}).get('fetchedAt'),
+		'segments': {name: mirror.section(name).get('fetchedAt') for name in mirror.segment_names()},
+		'stale': is_stale(),
+		'leader': is_leader(),
+		'cadence': cadence.stats(),
+		'lastRefresh': _last_refresh,
+		'calendars': (mirror.section() or {}).get('calendars'),
 	}
 
 def _parse(ts, tz):
 	dt = datetime.fromisoformat(ts)
 	return dt if dt.tzinfo else dt.replace(tzinfo=tz)
 
-def _boundary(obj, tz):
-	'''Event start/end object -> aware datetime; all-day dates pin to local midnight.'''
-	if 'dateTime' in obj:
-		return _parse(obj['dateTime'], tz)
-	return datetime.fromisoformat(obj['date']).replace(tzinfo=tz)
+def _window_bounds(payload, tz):
+	try:
+		return _parse(payload['timeMin'], tz), _parse(payload['timeMax'], tz)
+	except (KeyError, TypeError, ValueError):
+		return None
 
 def cached_events(time_min, time_max):
-	'''Mirrored events intersecting [time_min, time_max), or None on a miss
+	'''Mirrored EventRecords intersecting [time_min, time_max), or None on a miss
 	(never synced, or the request reaches outside the mirrored window).'''
-	payload = get_cache('events')
+	payload = mirror.section()
 	if not payload:
 		return None
-	tz = ZoneInfo(get_settings()['timezone'])
+	tz = mirror.tz()
 	try:
 		req_min = _parse(time_min, tz)
 		req_max = _parse(time_max, tz)
-		win_min = _parse(payload['timeMin'], tz)
-		win_max = _parse(payload['timeMax'], tz)
-	except (KeyError, ValueError):
+	except ValueError:
 		return None
-	if req_min < win_min or req_max > win_max:
+	win = _window_bounds(payload, tz)
+	if not win or req_min < win[0] or req_max > win[1]:
 		return None
-	out = []
-	for ev in payload.get('items', []):
-		try:
-			if _boundary(ev['end'], tz) > req_min and _boundary(ev['start'], tz) < req_max:
-				out.append(ev)
-		except (KeyError, ValueError):
-			out.append(ev)
-	return out
+	return mirror.query(mirror.WINDOW, req_min.timestamp(), req_max.timestamp())
+
+def _next_month(dt):
+	return (dt.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def _segment_keys(req_min, req_max):
+	'''Month keys ('YYYY-MM', local time) covering [req_min, req_max).'''
+	keys = []
+	cur = req_min.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+	while cur < req_max:
+		keys.append(cur.strftime('%Y-%m'))
+		cur = _next_month(cur)
+	return keys
+
+def _segment_bounds(key, tz):
+	start = datetime.strptime(key, '%Y-%m').replace(tzinfo=tz)
+	return start, _next_month(start)
+
+def _is_fresh(payload, ttl=SEGMENT_TTL_SECONDS):
+	try:
+		fetched = datetime.fromisoformat(payload['fetchedAt'])
+	except (KeyError, TypeError, ValueError):
+		return False
+	return (_now() - fetched).total_seconds() < ttl
+
+def _store_segment(key, items, meta):
+	'''Saves one segment, then evicts least-recently-used ones past the bounds.'''
+	mirror.replace(key, items, meta)
+	order = sorted((k for k in mirror.segment_names() if k != key), key=lambda k: _segment_used.get(k, 0))
+	total = sum(len(mirror.section(k)['items']) for k in mirror.segment_names())
+	while order and (len(mirror.segment_names()) > SEGMENT_CAP or total > SEGMENT_MAX_EVENTS):
+		victim = order.pop(0)
+		total -= len(mirror.section(victim)['items'])
+		mirror.drop(victim)
+		_segment_used.pop(victim, None)
+
+async def _load_segment(key, tz, stale):
+	start, end = _segment_bounds(key, tz)
+	time_min, time_max = start.isoformat(), end.isoformat()
+	fetched = _now().isoformat()
+	items, failed, errors, pulled = await _fetch_events(time_min, time_max, False)
+	if errors:
+		# a partial pull is served but not cached; with nothing to fall back on, surface it
+		if not stale and len(errors) == len(pulled):
+			raise errors[0]
+		kept = [rec for rec in (stale or {}).get('items', []) if mirror.kept(rec, failed)]
+		return [mirror.EventRecord.from_google(ev, tz) for ev in items] + kept
+	meta = {'timeMin': time_min, 'timeMax': time_max, 'fetchedAt': fetched, 'fields': SYNC_FIELDS}
+	await lanes.run(_store_segment, key, items, meta)
+	return mirror.section(key)['items']
+
+async def _segment(key, tz):
+	'''Records for one month segment, fetched if missing or stale. Concurrent
+	callers for the same month share a single in-flight google pull.'''
+	_segment_used[key] = time.monotonic()
+	payload = mirror.section(key)
+	if payload and (_is_fresh(payload) or is_stale()):
+		return payload['items']
+	fut = _segment_fetches.get(key)
+	if fut is None:
+		fut = asyncio.ensure_future(_load_segment(key, tz, payload))
+		_segment_fetches[key] = fut
+		fut.add_done_callback(lambda _: _segment_fetches.pop(key, None))
+	# shielded: one caller going away must not cancel the fetch the others await
+	return await asyncio.shield(fut)
+
+async def events_between(time_min, time_max):
+	'''EventRecords intersecting [time_min, time_max): straight from the mirror inside
+	the sync window, otherwise stitched from the window and on-demand month segments.
+	Raises ValueError on unparseable bounds, HttpError if google is unreachable
+	and nothing is cached.'''
+	cached = cached_events(time_min, time_max)
+	if cached is not None:
+		return cached
+	tz = mirror.tz()
+	req_min = _parse(time_min, tz).astimezone(tz)
+	req_max = _parse(time_max, tz).astimezone(tz)
+
+	payload = mirror.section()
+	win = _window_bounds(payload, tz) if payload else None
+	parts = []
+	if win and win[0] < req_max and req_min < win[1]:
+		parts.append(payload['items'])
+
+	keys = []
+	for key in _segment_keys(req_min, req_max):
+		seg_min, seg_max = _segment_bounds(key, tz)
+		if not (win and win[0] <= seg_min and seg_max <= win[1]):
+			keys.append(key)
+	parts.extend(await asyncio.gather(*(_segment(key, tz) for key in keys)))
+
+	lo, hi = req_min.timestamp(), req_max.timestamp()
+	seen, merged = set(), []
+	for records in parts:
+		for rec in records:
+			ident = (rec.account, rec.calendar, rec.id)
+			if ident not in seen and rec.overlaps(lo, hi):
+				seen.add(ident)
+				merged.append(rec)
+	merged.sort(key=mirror.sort_key)
+	return merged
+
+async def day_events(day):
+	'''EventRecords overlapping one local day (a date); inside the sync window this
+	is a single bucket lookup in the mirror's day index.'''
+	tz = mirror.tz()
+	start = datetime.combine(day, datetime.min.time(), tz)
+	end = start + timedelta(days=1)
+	payload = mirror.section()
+	win = _window_bounds(payload, tz) if payload else None
+	if win and win[0] <= start and end <= win[1]:
+		return mirror.day(day.isoformat())
+	return await events_between(start.isoformat(), end.isoformat())
+
+async def full_event(event_id, account=None):
+	'''The complete google resource of a mirrored event (None if not mirrored). A
+	record synced under SYNC_FIELDS is fetched in full once and written through;
+	one with a queued write keeps its local fields on top. HttpError propagates.'''
+	event = mirror.full_event(event_id, account)
+	if event is None or not event.get('partial'):
+		return event
+	calendar = event.get('calendar') or mirror.PRIMARY
+	full = {**await gapi.events_get(event_id, event['account'], calendar), 'account': event['account']}
+	if event.get('calendar'):
+		full['calendar'] = calendar
+	if event.get('pending'):
+		return {**full, **{k: v for k, v in event.items() if k != 'partial'}}
+	await lanes.run(mirror.upsert_event, full)
+	return full
 
 def cached_tasks():
 	payload = get_cache('tasks')
@@ -0,0 +1,53 @@
+'''Record side of the tool-layer benchmark (see replay.py).
+
+With AUTOCAL_TRACE=<path> in the environment (.env), every agent tool call and
+every google REST call made outside the sync lane is appended to that JSONL
+file: tool name, args, latency and bytes returned to the model; method, URL,
+status, response body and latency for google. The first line holds the mirror,
+accounts and clocks as they stood, so a replay starts from the same state.
+Traces contain calendar data; keep them local. Record with a single worker.'''
+
+import os
+import threading
+import time
+
+import orjson
+from dotenv import load_dotenv
+
+from .store import get_settings, list_accounts, load_file
+
+load_dotenv()
+
+TRACE_PATH = os.getenv('AUTOCAL_TRACE')
+
+_lock = threading.Lock()
+_started = None
+
+def enabled():
+	return bool(TRACE_PATH)
+
+def _header():
+	from . import mirror, sync  # lazy: sync imports gapi, which imports this module
+	return {
+		'type': 'start',
+		'at': sync._now().isoformat(),
+		'bootedAt': sync._booted_at.isoformat(),
+		'settings': get_settings(),
+		'accounts': [{'email': a.get('email', ''), 'primary': bool(a.get('primary'))} for a in list_accounts()],
+		'mirror': load_file(mirror.MIRROR_FILE),
+	}
+
+def record(kind, **fields):
+	'''Appends one event, stamped with seconds since the trace started.'''
+	global _started
+	if not TRACE_PATH:
+		return
+	with _lock:
+		lines = []
+		if _started is None:
+			_started = time.monotonic()
+			lines.append(_header())
+		lines.append({'type': kind, 't': round(time.monotonic() - _started, 4), **fields})
+		with open(TRACE_PATH, 'ab') as f:
+			for line in lines:
+				f.write(orjson.dumps(line) + b'\n')
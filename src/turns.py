@@ -0,0 +1,199 @@
+'''Server-side buffers for streamed agent turns.
+
+A turn runs as its own task, detached from the HTTP request that started it, and
+appends every event to a per-turn buffer numbered from 1 (the SSE id). Readers
+follow the buffer from any point, so a reload or dropped connection resumes the
+same in-flight turn from Last-Event-ID instead of losing it. On the way out,
+adjacent text deltas are merged into one frame on a small time/size budget.
+Finished turns stay resumable for TURN_TTL_SECONDS.
+
+The buffer is also appended, off the event loop, to data/turns/<id>.jsonl, so a
+reconnect that lands on another server worker follows the turn from that file.'''
+
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+
+from . import lanes
+from .store import DATA_DIR
+
+COALESCE_SECONDS = 0.04
+COALESCE_MAX_CHARS = 2048
+TURN_TTL_SECONDS = 120
+# frame files a crashed worker never expired
+TURN_STALE_SECONDS = 3600
+STORED_POLL_SECONDS = 0.1
+TURNS_DIR = os.path.join(DATA_DIR, 'turns')
+# last line of a finished turn's frame file
+END = {'type': 'end'}
+
+class Turn:
+	def __init__(self, turn_id):
+		self.id = turn_id
+		self.events = [{'type': 'turn', 'turnId': turn_id}]
+		self.done = False
+		self._changed = asyncio.Event()
+		self._task = None
+		self._writer = None
+
+	def _push(self, event):
+		self.events.append(event)
+		self._changed.set()
+		self._changed = asyncio.Event()
+
+	async def _run(self, source):
+		try:
+			async for event in source:
+				self._push(event)
+		except Exception as e:
+			self._push({'type': 'error', 'message': str(e)})
+		finally:
+			self.done = True
+			self._changed.set()
+			asyncio.get_running_loop().call_later(TURN_TTL_SECONDS, _expire, self.id)
+
+	async def _persist(self):
+		'''Appends what the buffer gained since the last pass to the frame file.'''
+		written = 0
+		while True:
+			changed, done = self._changed, self.done
+			end = len(self.events)
+			if written < end or done:
+				await lanes.run(_append, self.id, self.events[written:end] + ([END] if done else []))
+				written = end
+			if done:
+				return
+			await changed.wait()
+
+	def _pending_chars(self, cursor):
+		return sum(len(ev.get('text', '')) for ev in self.events[cursor:])
+
+	async def frames(self, after=0):
+		'''(seq, event) frames after seq `after` until the turn ends; seq is the
+		last buffered event a frame covers, so resuming from it loses nothing.'''
+		cursor = max(0, min(after, len(self.events)))
+		while True:
+			changed = self._changed
+			if cursor >= len(self.events):
+				if self.done:
+					return
+				await changed.wait()
+				continue
+			# a burst of deltas gets a moment to pile up into one frame
+			if not self.done and self.events[-1]['type'] == 'text' and self._pending_chars(cursor) < COALESCE_MAX_CHARS:
+				await asyncio.sleep(COALESCE_SECONDS)
+			end = len(self.events)
+			for frame in _coalesce(self.events, cursor, end):
+				yield frame
+			cursor = end
+
+def _coalesce(events, start, end):
+	text, seq = [], start
+	for seq in range(start + 1, end + 1):
+		event = events[seq - 1]
+		if event['type'] == 'text':
+			text.append(event['text'])
+			if sum(map(len, text)) < COALESCE_MAX_CHARS:
+				continue
+			yield seq, {'type': 'text', 'text': ''.join(text)}
+			text = []
+			continue
+		if text:
+			yield seq - 1, {'type': 'text', 'text': ''.join(text)}
+			text = []
+		yield seq, event
+	if text:
+		yield seq, {'type': 'text', 'text': ''.join(text)}
+
+class StoredTurn:
+	'''A turn running (or run) in another worker, followed through its frame file.'''
+	def __init__(self, turn_id):
+		self.id = turn_id
+		self.events = []
+		self.done = False
+		self._offset = 0
+
+	def _read(self):
+		try:
+			with open(_frame_path(self.id), 'rb') as f:
+				f.seek(self._offset)
+				data = f.read()
+		except FileNotFoundError:
+			self.done = True  # expired meanwhile
+			return
+		# a line still being written waits for the next poll
+		whole = data.rfind(b'\n') + 1
+		self._offset += whole
+		for line in data[:whole].splitlines():
+			event = json.loads(line)
+			if event == END:
+				self.done = True
+			else:
+				self.events.append(event)
+
+	async def frames(self, after=0):
+		'''Same frames as Turn.frames, polling the file instead of the buffer.'''
+		cursor = max(0, after)
+		while True:
+			await lanes.run(self._read)
+			if self.done:
+				cursor = min(cursor, len(self.events))
+			if cursor < len(self.events):
+				end = len(self.events)
+				for frame in _coalesce(self.events, cursor, end):
+					yield frame
+				cursor = end
+			elif self.done:
+				return
+			else:
+				await asyncio.sleep(STORED_POLL_SECONDS)
+
+def _frame_path(turn_id):
+	return os.path.join(TURNS_DIR, f'{turn_id}.jsonl')
+
+def _append(turn_id, events):
+	os.makedirs(TURNS_DIR, exist_ok=True)
+	with open(_frame_path(turn_id), 'a') as f:
+		f.write(''.join(json.dumps(event) + '\n' for event in events))
+
+def _remove(turn_id):
+	'''Drops the turn's frame file, and any a crashed worker left behind.'''
+	stale = time.time() - TURN_STALE_SECONDS
+	paths = [_frame_path(turn_id)]
+	try:
+		paths += [entry.path for entry in os.scandir(TURNS_DIR) if entry.stat().st_mtime < stale]
+	except FileNotFoundError:
+		pass
+	for path in paths:
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+def _expire(turn_id):
+	_turns.pop(turn_id, None)
+	asyncio.get_running_loop().create_task(lanes.run(_remove, turn_id))
+
+_turns: dict[str, Turn] = {}
+
+def start(source):
+	'''Runs an agent_stream-style async iterator as a buffered turn.'''
+	turn = Turn(uuid.uuid4().hex)
+	_turns[turn.id] = turn
+	turn._task = asyncio.create_task(turn._run(source))
+	turn._writer = asyncio.create_task(turn._persist())
+	return turn
+
+def get(turn_id):
+	'''The turn, from this worker's buffers or another worker's frame file; None
+	if it is unknown or expired.'''
+	turn = _turns.get(turn_id)
+	if turn is None and re.fullmatch(r'[0-9a-f]{32}', turn_id) and os.path.exists(_frame_path(turn_id)):
+		turn = StoredTurn(turn_id)
+	return turn
+
+def stats():
+	return {'buffered': len(_turns), 'running': sum(not t.done for t in _turns.values())}